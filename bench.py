@@ -0,0 +1,757 @@
+"""Замеры производительности бота.
+
+Запуск: python bench.py <сценарий> [параметры]. Сценарии, которым нужна БД,
+работают с настройками из main.py (локальный MySQL/MariaDB).
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import os
+import resource
+import secrets
+import statistics
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import pymysql
+from aiogram import Bot
+from aiogram.bot.api import TelegramAPIServer
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.dispatcher.webhook import BOT_DISPATCHER_KEY
+from aiogram.utils.exceptions import RetryAfter
+from aiogram.utils.payload import prepare_arg
+from aiohttp import web
+
+import main
+from fake_bot_api import FakeBotAPI
+from outbox import ScheduledBot, SendScheduler, bulk
+from sharding import ShardRouter
+from sqlite_storage import SQLiteStorage
+from webhook_server import FastAckWebhookHandler, create_webhook_app
+
+FAKE_TOKEN = "123456:FAKE-TOKEN"
+
+# Прежний вариант _get_latest_request_sync (три обращения к БД) — база для сравнения
+LEGACY_LATEST_REQUEST_QUERIES = (
+    """
+    SELECT id, status, region, is_additional, created_at
+    FROM s3app_userrequest
+    WHERE telegram_id = %s
+    ORDER BY created_at DESC
+    LIMIT 1
+    """,
+    """
+    SELECT g.name
+    FROM auth_group g
+    JOIN s3app_userrequest_processed_departments pd ON g.id = pd.group_id
+    WHERE pd.userrequest_id = %s
+    ORDER BY g.name
+    """,
+    """
+    SELECT g.name
+    FROM auth_group g
+    JOIN s3app_userrequest_departments d ON g.id = d.group_id
+    WHERE d.userrequest_id = %s
+    ORDER BY g.name
+    """,
+)
+
+
+class CountingCursor(pymysql.cursors.DictCursor):
+    executed = 0
+
+    def execute(self, query, args=None):
+        CountingCursor.executed += 1
+        return super().execute(query, args)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def print_latency(title: str, latencies: List[float], elapsed: float) -> None:
+    print(f"{title}:")
+    print(f"   Запросов: {len(latencies)} за {elapsed:.2f} с ({len(latencies) / elapsed:.0f} в секунду)")
+    print(
+        f"   Задержка, мс: среднее {statistics.mean(latencies) * 1000:.2f}, "
+        f"p50 {percentile(latencies, 50) * 1000:.2f}, "
+        f"p95 {percentile(latencies, 95) * 1000:.2f}, "
+        f"p99 {percentile(latencies, 99) * 1000:.2f}"
+    )
+
+
+async def run_concurrently(call: Callable[[], Awaitable[object]], total: int, concurrency: int) -> Dict[str, object]:
+    latencies: List[float] = []
+    queue = iter(range(total))
+
+    async def worker() -> None:
+        for _ in queue:
+            started = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return {"latencies": latencies, "elapsed": time.perf_counter() - started}
+
+
+async def bench_db_backends(args: argparse.Namespace) -> None:
+    print("=" * 60)
+    print("БЭКЕНДЫ БД НА ПУТИ /status (get_latest_request)")
+    print("=" * 60)
+    for backend_name in args.backends:
+        database = main.create_database(backend_name)
+        await database.start()
+        try:
+            # Прогрев: открываем соединения пула до замера
+            await asyncio.gather(*(database.get_latest_request(args.telegram_id) for _ in range(args.concurrency)))
+            result = await run_concurrently(
+                lambda: database.get_latest_request(args.telegram_id), args.requests, args.concurrency,
+            )
+            print_latency(f"Бэкенд {database.name}", result["latencies"], result["elapsed"])
+            print(f"   Пул: {database.stats()}")
+            print()
+        finally:
+            await database.close()
+
+
+def _legacy_latest_request(conn, telegram_id: str):
+    with conn.cursor(CountingCursor) as cursor:
+        cursor.execute(LEGACY_LATEST_REQUEST_QUERIES[0], (telegram_id,))
+        request = cursor.fetchone()
+        if not request:
+            return None
+        request["is_additional"] = bool(request.get("is_additional"))
+        cursor.execute(LEGACY_LATEST_REQUEST_QUERIES[1], (request["id"],))
+        request["processed_departments"] = [row["name"] for row in cursor.fetchall()]
+        cursor.execute(LEGACY_LATEST_REQUEST_QUERIES[2], (request["id"],))
+        request["departments"] = [row["name"] for row in cursor.fetchall()]
+        return request
+
+
+def _snapshot_latest_request(conn, telegram_id: str):
+    with conn.cursor(CountingCursor) as cursor:
+        cursor.execute(main.SQL_LATEST_REQUEST_SNAPSHOT, (telegram_id,))
+        return main._decode_request_snapshot(cursor.fetchone())
+
+
+async def bench_status_snapshot(args: argparse.Namespace) -> None:
+    print("=" * 60)
+    print("СНИМОК ЗАЯВКИ: ТРИ ЗАПРОСА ПРОТИВ ОДНОГО")
+    print("=" * 60)
+    with main.get_db_connection() as conn:
+        legacy = _legacy_latest_request(conn, args.telegram_id)
+        snapshot = _snapshot_latest_request(conn, args.telegram_id)
+        print(f"Результаты совпадают: {'да' if legacy == snapshot else 'НЕТ'}")
+        print()
+        for title, query in (("Три запроса", _legacy_latest_request), ("Один запрос", _snapshot_latest_request)):
+            CountingCursor.executed = 0
+            latencies: List[float] = []
+            started = time.perf_counter()
+            for _ in range(args.requests):
+                call_started = time.perf_counter()
+                query(conn, args.telegram_id)
+                latencies.append(time.perf_counter() - call_started)
+            print_latency(title, latencies, time.perf_counter() - started)
+            print(f"   Обращений к БД на вызов: {CountingCursor.executed / args.requests:.1f}")
+            print()
+    main.db_pool.close()
+
+
+async def bench_keyboards(args: argparse.Namespace) -> None:
+    print("=" * 60)
+    print("КЛАВИАТУРА ОТДЕЛОВ: СБОРКА + СЕРИАЛИЗАЦИЯ")
+    print("=" * 60)
+    for size in args.sizes:
+        items = [{"id": dept_id, "name": f"Отдел {dept_id}"} for dept_id in range(1, size + 1)]
+        departments = main.Departments(items=items, names={d["id"]: d["name"] for d in items}, version=size)
+        selected = [d["id"] for d in items[:3]]
+
+        # Как было: весь справочник в одной клавиатуре, новая сборка и json.dumps на каждое нажатие
+        started = time.perf_counter()
+        for _ in range(args.iterations):
+            prepare_arg(main.departments_keyboard(items, selected, page_size=size))
+        full = (time.perf_counter() - started) / args.iterations
+        full_payload = len(main.serialize_keyboard(main.departments_keyboard(items, selected, page_size=size)).encode("utf-8"))
+
+        started = time.perf_counter()
+        for _ in range(args.iterations):
+            prepare_arg(main.departments_keyboard(items, selected))
+        uncached = (time.perf_counter() - started) / args.iterations
+
+        main.department_keyboards.clear()
+        main.cached_departments_keyboard(departments, selected)  # первое построение попадает в кэш
+        started = time.perf_counter()
+        for _ in range(args.iterations):
+            prepare_arg(main.cached_departments_keyboard(departments, selected))
+        cached = (time.perf_counter() - started) / args.iterations
+
+        payload = len(main.cached_departments_keyboard(departments, selected).encode("utf-8"))
+        print(f"Отделов: {size}")
+        print(f"   Весь список без кэша: {full * 1e6:.1f} мкс, reply_markup {full_payload} байт")
+        print(f"   Страница без кэша: {uncached * 1e6:.1f} мкс, с кэшем: {cached * 1e6:.1f} мкс, reply_markup {payload} байт")
+        print()
+
+
+async def start_bot_against(api: FakeBotAPI, mode: str, storage=None):
+    """Запустить настоящий Dispatcher из main.py против заглушки Bot API. Возвращает функцию остановки"""
+    # Лимиты отправки отключены: заглушка их не требует, а вызовы API считаются по обработчикам
+    bot = ScheduledBot(token=FAKE_TOKEN, server=TelegramAPIServer.from_base(api.url),
+                       scheduler=SendScheduler(global_rate=0, chat_rate=0, group_rate=0),
+                       api_stats=main.api_call_stats)
+    dp = main.create_dispatcher(bot, storage or MemoryStorage())
+
+    if mode == "polling":
+        await bot.delete_webhook()
+        polling = asyncio.ensure_future(dp.start_polling(timeout=20))
+
+        async def stop() -> None:
+            dp.stop_polling()
+            polling.cancel()
+            await asyncio.gather(polling, return_exceptions=True)
+            await (await bot.get_session()).close()
+
+        return dp, stop
+
+    secret = "bench-secret"
+    app = create_webhook_app(secret)
+    app[BOT_DISPATCHER_KEY] = dp
+    app.router.add_route("*", "/webhook", FastAckWebhookHandler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    await bot.set_webhook(f"http://127.0.0.1:{port}/webhook", secret_token=secret)
+
+    async def stop() -> None:
+        await bot.delete_webhook()
+        await runner.cleanup()
+        await (await bot.get_session()).close()
+
+    return dp, stop
+
+
+async def bench_update_latency(args: argparse.Namespace) -> None:
+    print("=" * 60)
+    print("ЗАДЕРЖКА ОТ АПДЕЙТА ДО ОТВЕТА: POLLING ПРОТИВ WEBHOOK")
+    print("=" * 60)
+    async with FakeBotAPI() as api:
+        api.keep_sent = False
+        for mode in args.modes:
+            dp, stop = await start_bot_against(api, mode)
+            try:
+                user_ids = iter(range(1, args.concurrency + 1))
+
+                async def one_update(user_id: int) -> None:
+                    reply = api.wait_reply(user_id)
+                    await api.push_update(api.message_update(user_id, "/help"))
+                    await asyncio.wait_for(reply, timeout=30)
+
+                async def user_loop() -> List[float]:
+                    user_id = next(user_ids)
+                    latencies = []
+                    for _ in range(args.requests // args.concurrency):
+                        started = time.perf_counter()
+                        await one_update(user_id)
+                        latencies.append(time.perf_counter() - started)
+                    return latencies
+
+                started = time.perf_counter()
+                results = await asyncio.gather(*(user_loop() for _ in range(args.concurrency)))
+                elapsed = time.perf_counter() - started
+                print_latency(f"Режим {mode}", [lat for user in results for lat in user], elapsed)
+                print()
+            finally:
+                await stop()
+
+
+async def bench_send_queue(args: argparse.Namespace) -> None:
+    print("=" * 60)
+    print("ВСПЛЕСК ОТПРАВОК: НАПРЯМУЮ ПРОТИВ ОЧЕРЕДИ С ЛИМИТАМИ")
+    print("=" * 60)
+    async with FakeBotAPI(global_limit=30, chat_limit=args.chat_limit) as api:
+        api.keep_sent = False
+        for variant in ("напрямую", "через очередь"):
+            server = TelegramAPIServer.from_base(api.url)
+            if variant == "напрямую":
+                bot = Bot(token=FAKE_TOKEN, server=server)
+                scheduler = None
+            else:
+                scheduler = SendScheduler(global_rate=args.global_rate)
+                bot = ScheduledBot(token=FAKE_TOKEN, server=server, scheduler=scheduler)
+            flood_before = api.flood_errors
+            failed = 0
+            interactive: List[float] = []
+
+            async def send(chat_id: int, text: str) -> bool:
+                nonlocal failed
+                try:
+                    await bot.send_message(chat_id, text)
+                    return True
+                except RetryAfter:
+                    failed += 1
+                    return False
+
+            async def notify(chat_id: int) -> None:
+                with bulk():
+                    await send(chat_id, "Статус заявки изменён")
+
+            async def reply(chat_id: int) -> None:
+                # Пользователь проходит анкету: несколько ответов подряд в один чат
+                for step in range(args.replies):
+                    started = time.perf_counter()
+                    if await send(chat_id, f"Шаг {step}"):
+                        interactive.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            notifications = asyncio.gather(*(notify(2_000_000 + i) for i in range(args.notifications)))
+            await asyncio.sleep(0)
+            await asyncio.gather(*(reply(1_000_000 + i) for i in range(args.users)))
+            interactive_done = time.perf_counter() - started
+            await notifications
+            elapsed = time.perf_counter() - started
+
+            print(f"Отправка {variant}:")
+            print(f"   Ответов пользователям доставлено: {len(interactive)} из {args.users * args.replies}, "
+                  f"все ответы за {interactive_done:.2f} с")
+            if interactive:
+                print(f"   Задержка ответа, мс: p50 {percentile(interactive, 50) * 1000:.1f}, "
+                      f"p95 {percentile(interactive, 95) * 1000:.1f}, p99 {percentile(interactive, 99) * 1000:.1f}")
+            print(f"   Рассылка из {args.notifications} уведомлений завершена за {elapsed:.2f} с")
+            print(f"   Ответов 429: {api.flood_errors - flood_before}, потеряно сообщений: {failed}")
+            if scheduler is not None:
+                print(f"   Очередь: {scheduler.stats()}")
+                await scheduler.close()
+            print()
+            await (await bot.get_session()).close()
+            # Даём окну лимитов заглушки освободиться перед следующим вариантом
+            await asyncio.sleep(1.5)
+
+
+async def run_form_flow(api: FakeBotAPI, send: Callable[[Dict[str, object]], Awaitable[object]],
+                        user_id: int, dept_id: int) -> None:
+    """Пройти анкету InviteRequestForm до подтверждения выбора отделов (без записи заявки в БД)"""
+    done = api.wait_reply(user_id, "Вы выбрали отделы")
+    for update in (
+        api.message_update(user_id, "/post_invate"),
+        api.message_update(user_id, "Иван"),
+        api.message_update(user_id, "Иванов"),
+        api.message_update(user_id, "Иванович"),
+        api.callback_update(user_id, f"region_{main.REGION_OPTIONS[0]}"),
+        api.callback_update(user_id, f"dept_{dept_id}"),
+        api.callback_update(user_id, "confirm_departments"),
+    ):
+        await send(update)
+    await asyncio.wait_for(done, timeout=60)
+
+
+async def bench_workers(args: argparse.Namespace) -> None:
+    print("=" * 60)
+    print("ПРОПУСКНАЯ СПОСОБНОСТЬ АНКЕТЫ В ЗАВИСИМОСТИ ОТ ЧИСЛА ВОРКЕРОВ")
+    print("=" * 60)
+    await main.db.start()
+    dept_id = (await main.fetch_departments()).items[0]["id"]
+    await main.db.close()
+
+    async with FakeBotAPI() as api:
+        api.keep_sent = False
+        # Воркеры — отдельные процессы, настройки получают через окружение
+        os.environ["TG_TOKEN"] = FAKE_TOKEN
+        os.environ["TELEGRAM_API_URL"] = api.url
+        # Заглушка не ограничивает частоту, замеряется только обработка апдейтов
+        os.environ["SEND_GLOBAL_RATE"] = "0"
+        os.environ["SEND_CHAT_RATE"] = "0"
+        for workers in args.workers:
+            with tempfile.TemporaryDirectory() as directory:
+                os.environ["FSM_SQLITE_PATH"] = os.path.join(directory, "fsm.sqlite3")
+                secret = secrets.token_urlsafe(16)
+                urls, processes = main.start_local_workers(workers, secret, base_port=args.base_port)
+                router = ShardRouter(urls, secret)
+                try:
+                    await router.wait_ready()
+                    user_ids = iter(range(1_000_000, 1_000_000 + args.users))
+                    latencies: List[float] = []
+
+                    async def user_loop() -> None:
+                        for user_id in user_ids:
+                            started = time.perf_counter()
+                            await run_form_flow(api, router.route, user_id, dept_id)
+                            latencies.append(time.perf_counter() - started)
+
+                    started = time.perf_counter()
+                    await asyncio.gather(*(user_loop() for _ in range(args.concurrency)))
+                    elapsed = time.perf_counter() - started
+                    print_latency(f"Воркеров: {workers} (анкет)", latencies, elapsed)
+                    print(f"   Распределение: {router.stats()['forwarded']}")
+                    print()
+                finally:
+                    await router.close()
+                    for process in processes:
+                        process.terminate()
+                    for process in processes:
+                        process.join(10)
+
+
+async def bench_api_calls(args: argparse.Namespace) -> None:
+    print("=" * 60)
+    print("ЗАПРОСЫ К BOT API НА ДЕЙСТВИЕ ПОЛЬЗОВАТЕЛЯ")
+    print("=" * 60)
+    # Считаем запросы к Bot API, а не к БД: MySQL для этого не нужен
+    real_db, main.db = main.db, MemoryDatabase(departments=args.departments)
+    department_ids = [item["id"] for item in (await main.fetch_departments()).items[:3]]
+    async with FakeBotAPI() as api:
+        dp, stop = await start_bot_against(api, "webhook")
+        try:
+            main.api_call_stats.reset()
+            api.calls.clear()
+            for user_id in range(1_000_000, 1_000_000 + args.users):
+                # Две части анкеты, каждая заканчивается сообщением «Вы выбрали отделы»
+                for updates in (
+                    [
+                        api.message_update(user_id, "/post_invate"),
+                        api.message_update(user_id, "Иван"),
+                        api.message_update(user_id, "Иванов"),
+                        api.message_update(user_id, "Иванович"),
+                        api.callback_update(user_id, f"region_{main.REGION_OPTIONS[0]}"),
+                        *(api.callback_update(user_id, f"dept_{dept_id}") for dept_id in department_ids),
+                        api.callback_update(user_id, "reset_departments"),
+                        api.callback_update(user_id, "confirm_departments"),
+                        api.callback_update(user_id, f"dept_{department_ids[0]}"),
+                        api.callback_update(user_id, "confirm_departments"),
+                    ],
+                    [
+                        api.callback_update(user_id, "confirm_no"),
+                        api.callback_update(user_id, f"dept_{department_ids[-1]}"),
+                        api.callback_update(user_id, "confirm_departments"),
+                    ],
+                ):
+                    done = api.wait_reply(user_id, "Вы выбрали отделы")
+                    for update in updates:
+                        await api.push_update(update)
+                    await asyncio.wait_for(done, timeout=30)
+            await asyncio.sleep(0.1)
+            handlers = main.api_call_stats.stats()
+            calls = dict(api.calls)
+        finally:
+            await stop()
+            main.db = real_db
+
+    for handler, entry in handlers.items():
+        methods = ", ".join(f"{method} {count}" for method, count in entry["methods"].items())
+        print(f"{handler}: вызовов {entry['invocations']}, "
+              f"запросов на вызов {entry.get('calls_per_invocation', '-')} ({methods})")
+    print()
+    print(f"Всего запросов к API по методам: {calls} ({sum(calls.values())})")
+
+
+async def bench_toggle_burst(args: argparse.Namespace) -> None:
+    print("=" * 60)
+    print("СЕРИЯ НАЖАТИЙ НА ОТДЕЛЫ: ПРАВКА НА КАЖДОЕ НАЖАТИЕ ПРОТИВ СКЛЕЙКИ")
+    print("=" * 60)
+    real_db, main.db = main.db, MemoryDatabase(departments=args.departments)
+    departments = await main.fetch_departments()
+    taps = [item["id"] for item in departments.items[:args.taps]]
+    final_text = main.departments_prompt_text(departments.resolve(taps))
+    async with FakeBotAPI() as api:
+        dp, stop = await start_bot_against(api, "webhook")
+        try:
+            for delay in args.delays:
+                main.edit_coalescer.delay = delay
+                edits = 0
+                latencies: List[float] = []
+                for user_id in range(1_000_000, 1_000_000 + args.users):
+                    prompt = api.wait_reply(user_id, "Выберите отделы")
+                    for text in ("/post_invate", "Иван", "Иванов", "Иванович"):
+                        await api.push_update(api.message_update(user_id, text))
+                    await api.push_update(api.callback_update(user_id, f"region_{main.REGION_OPTIONS[0]}"))
+                    await asyncio.wait_for(prompt, timeout=30)
+
+                    edits_before = api.calls["editMessageText"]
+                    done = api.wait_reply(user_id, final_text)
+                    started = time.perf_counter()
+                    for dept_id in taps:
+                        await api.push_update(api.callback_update(user_id, f"dept_{dept_id}"))
+                    await asyncio.wait_for(done, timeout=30)
+                    latencies.append(time.perf_counter() - started)
+                    await asyncio.sleep(main.DEPARTMENT_EDIT_MAX_DELAY)
+                    edits += api.calls["editMessageText"] - edits_before
+                title = f"Пауза склейки {delay} с" if delay > 0 else "Правка на каждое нажатие"
+                print(f"{title}:")
+                print(f"   Правок сообщения на {len(taps)} нажатий: {edits / args.users:.1f}")
+                print(f"   До итогового вида, мс: p50 {percentile(latencies, 50) * 1000:.0f}, "
+                      f"p95 {percentile(latencies, 95) * 1000:.0f}")
+                print()
+        finally:
+            main.edit_coalescer.delay = main.DEPARTMENT_EDIT_DELAY
+            await stop()
+            main.db = real_db
+
+
+class MemoryDatabase:
+    """Заглушка бэкенда БД из main.py: данные в памяти, каждое обращение считается.
+
+    latency — искусственная задержка на обращение, имитирует сетевой круг до MySQL.
+    """
+
+    name = "memory"
+
+    def __init__(self, departments: int = 30, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.groups = [{"id": index, "name": f"Отдел {index:02d}"} for index in range(1, departments + 1)]
+        self.requests: Dict[str, Dict[str, object]] = {}
+        self.ids = itertools.count(1)
+        self.queries: Counter = Counter()
+
+    async def _query(self, method: str) -> None:
+        self.queries[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, object]:
+        return dict(self.queries)
+
+    async def fetch_departments(self) -> List[Dict[str, object]]:
+        await self._query("fetch_departments")
+        return [dict(group) for group in self.groups]
+
+    async def probe_departments(self) -> Tuple[int, int]:
+        await self._query("probe_departments")
+        return len(self.groups), 0
+
+    async def get_user_by_telegram(self, telegram_id: str) -> Optional[Dict[str, object]]:
+        await self._query("get_user_by_telegram")
+        return None
+
+    async def create_request(self, full_name: str, telegram_id: str, region: str, departments: Dict[int, str], *,
+                             is_additional: bool = False, target_user_id: Optional[int] = None,
+                             allow_processed: bool = False) -> Tuple[int, List[str]]:
+        await self._query("create_request")
+        conflict = main._request_conflict(self.requests.get(telegram_id), allow_processed)
+        if conflict:
+            return conflict
+        group_ids, missing = main._match_groups(departments, [{"id": group["id"]} for group in self.groups])
+        request_id = next(self.ids)
+        self.requests[telegram_id] = {
+            "id": request_id, "status": "new", "region": region, "is_additional": is_additional,
+            "created_at": datetime.datetime.now(), "processed_departments": [],
+            "departments": sorted(departments[group_id] for group_id in group_ids),
+        }
+        return request_id, missing
+
+    async def get_latest_request(self, telegram_id: str) -> Optional[Dict[str, object]]:
+        await self._query("get_latest_request")
+        request = self.requests.get(telegram_id)
+        return dict(request) if request else None
+
+    async def fetch_all(self, query: str, args: Sequence[object] = ()) -> List[Dict[str, object]]:
+        await self._query("fetch_all")
+        return []
+
+
+class HandlerTimings(BaseMiddleware):
+    """Время выполнения каждого обработчика сообщений и нажатий"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+
+    async def _start(self, data: dict) -> None:
+        data["bench_handler"] = current_handler.get().__name__
+        data["bench_started"] = time.perf_counter()
+
+    async def _finish(self, data: dict) -> None:
+        if "bench_handler" in data:
+            self.latencies[data["bench_handler"]].append(time.perf_counter() - data["bench_started"])
+
+    async def on_process_message(self, message, data: dict) -> None:
+        await self._start(data)
+
+    async def on_process_callback_query(self, query, data: dict) -> None:
+        await self._start(data)
+
+    async def on_post_process_message(self, message, results, data: dict) -> None:
+        await self._finish(data)
+
+    async def on_post_process_callback_query(self, query, results, data: dict) -> None:
+        await self._finish(data)
+
+
+def applicant_steps(api: FakeBotAPI, user_id: int, department: Dict[str, object]) -> List[Tuple[Dict[str, object], str]]:
+    """Анкета InviteRequestForm и /status: апдейт и начало ответа, которого ждёт пользователь"""
+    return [
+        (api.message_update(user_id, "/post_invate"), "Введите имя"),
+        (api.message_update(user_id, "Иван"), "Введите фамилию"),
+        (api.message_update(user_id, "Иванов"), "Введите отчество"),
+        (api.message_update(user_id, "Иванович"), "Выберите регион"),
+        (api.callback_update(user_id, f"region_{main.REGION_OPTIONS[0]}"), "Выберите отделы"),
+        (api.callback_update(user_id, f"dept_{department['id']}"), main.departments_prompt_text([department["name"]])),
+        (api.callback_update(user_id, "confirm_departments"), "Вы выбрали отделы"),
+        (api.callback_update(user_id, "confirm_yes"), "📝 Заявка №"),
+        (api.message_update(user_id, "/status"), "📋 Статус вашей заявки"),
+    ]
+
+
+async def bench_load_test(args: argparse.Namespace) -> None:
+    print("=" * 60)
+    print(f"НАГРУЗКА: {args.users} ЗАЯВИТЕЛЕЙ, ОДНОВРЕМЕННО {args.concurrency}")
+    print("=" * 60)
+    memory_db = MemoryDatabase(departments=args.departments, latency=args.db_latency / 1000)
+    real_db, main.db = main.db, memory_db
+    timings = HandlerTimings()
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    with tempfile.TemporaryDirectory() as directory:
+        storage = SQLiteStorage(os.path.join(directory, "fsm.sqlite3")) if args.storage == "sqlite" else MemoryStorage()
+        async with FakeBotAPI() as api:
+            api.keep_sent = False
+            dp, stop = await start_bot_against(api, "webhook", storage)
+            dp.middleware.setup(timings)
+            try:
+                user_ids = iter(range(1_000_000, 1_000_000 + args.users))
+                flows: List[float] = []
+                timeouts = 0
+
+                async def applicant() -> None:
+                    nonlocal timeouts
+                    for user_id in user_ids:
+                        department = memory_db.groups[user_id % len(memory_db.groups)]
+                        started = time.perf_counter()
+                        try:
+                            for update, reply_prefix in applicant_steps(api, user_id, department):
+                                reply = api.wait_reply(user_id, reply_prefix)
+                                await api.push_update(update)
+                                await asyncio.wait_for(reply, timeout=args.timeout)
+                                if args.think:
+                                    await asyncio.sleep(args.think)
+                        except asyncio.TimeoutError:
+                            timeouts += 1
+                            continue
+                        flows.append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                await asyncio.gather(*(applicant() for _ in range(args.concurrency)))
+                elapsed = time.perf_counter() - started
+            finally:
+                await stop()
+                await storage.close()
+                await storage.wait_closed()
+                main.db = real_db
+
+    peak_traced = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    if args.tracemalloc:
+        tracemalloc.stop()
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(f"Анкет пройдено: {len(flows)} из {args.users} за {elapsed:.2f} с ({len(flows) / elapsed:.1f} в секунду), "
+          f"не дождались ответа: {timeouts}")
+    if flows:
+        print(f"Анкета целиком, мс: p50 {percentile(flows, 50) * 1000:.0f}, p95 {percentile(flows, 95) * 1000:.0f}, "
+              f"p99 {percentile(flows, 99) * 1000:.0f}")
+    print()
+    print("Обработчики, мс:")
+    for handler, latencies in sorted(timings.latencies.items()):
+        print(f"   {handler:<28} вызовов {len(latencies):>6}   p50 {percentile(latencies, 50) * 1000:7.2f}   "
+              f"p95 {percentile(latencies, 95) * 1000:7.2f}   p99 {percentile(latencies, 99) * 1000:7.2f}")
+    print()
+    completed = max(len(flows), 1)
+    total_queries = sum(memory_db.queries.values())
+    print(f"Обращений к БД на анкету: {total_queries / completed:.2f}")
+    for method, count in memory_db.queries.most_common():
+        print(f"   {method:<28} {count / completed:.2f}")
+    print()
+    # ru_maxrss в Linux — в килобайтах
+    print(f"Пик RSS процесса: {rss_peak / 1024:.1f} МБ (до нагрузки {rss_before / 1024:.1f} МБ)")
+    if peak_traced is not None:
+        print(f"Пик памяти Python (tracemalloc): {peak_traced / 1024 / 1024:.1f} МБ")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    db_backends = commands.add_parser("db-backends", help="Сравнить бэкенды БД на запросе /status")
+    db_backends.add_argument("--telegram-id", default="323049682")
+    db_backends.add_argument("--requests", type=int, default=2000)
+    db_backends.add_argument("--concurrency", type=int, default=50)
+    db_backends.add_argument("--backends", nargs="+", default=["thread", "aiomysql"])
+    db_backends.set_defaults(handler=bench_db_backends)
+
+    status_snapshot = commands.add_parser("status-snapshot", help="Снимок заявки одним запросом против трёх")
+    status_snapshot.add_argument("--telegram-id", default="323049682")
+    status_snapshot.add_argument("--requests", type=int, default=1000)
+    status_snapshot.set_defaults(handler=bench_status_snapshot)
+
+    keyboards = commands.add_parser("keyboards", help="Время сборки и сериализации клавиатуры отделов")
+    keyboards.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    keyboards.add_argument("--iterations", type=int, default=200)
+    keyboards.set_defaults(handler=bench_keyboards)
+
+    update_latency = commands.add_parser("update-latency", help="Задержка апдейт → ответ для polling и webhook")
+    update_latency.add_argument("--requests", type=int, default=500)
+    update_latency.add_argument("--concurrency", type=int, default=10)
+    update_latency.add_argument("--modes", nargs="+", default=["polling", "webhook"])
+    update_latency.set_defaults(handler=bench_update_latency)
+
+    send_queue = commands.add_parser("send-queue", help="Всплеск ответов и рассылки при лимитах Telegram")
+    send_queue.add_argument("--users", type=int, default=30)
+    send_queue.add_argument("--replies", type=int, default=3)
+    send_queue.add_argument("--notifications", type=int, default=200)
+    send_queue.add_argument("--chat-limit", type=int, default=3)
+    send_queue.add_argument("--global-rate", type=float, default=25)
+    send_queue.set_defaults(handler=bench_send_queue)
+
+    api_calls = commands.add_parser("api-calls", help="Число запросов к Bot API по обработчикам анкеты")
+    api_calls.add_argument("--users", type=int, default=20)
+    api_calls.add_argument("--departments", type=int, default=30)
+    api_calls.set_defaults(handler=bench_api_calls)
+
+    toggle_burst = commands.add_parser("toggle-burst", help="Быстрые нажатия на отделы: число правок сообщения")
+    toggle_burst.add_argument("--users", type=int, default=10)
+    toggle_burst.add_argument("--taps", type=int, default=5)
+    toggle_burst.add_argument("--departments", type=int, default=30)
+    toggle_burst.add_argument("--delays", type=float, nargs="+", default=[0, main.DEPARTMENT_EDIT_DELAY])
+    toggle_burst.set_defaults(handler=bench_toggle_burst)
+
+    workers = commands.add_parser("workers", help="Анкета через фронт и N процессов-воркеров")
+    workers.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    workers.add_argument("--users", type=int, default=400)
+    workers.add_argument("--concurrency", type=int, default=50)
+    workers.add_argument("--base-port", type=int, default=18081)
+    workers.set_defaults(handler=bench_workers)
+
+    load_test = commands.add_parser("load-test", help="Анкета и /status от тысяч заявителей без MySQL и Telegram")
+    load_test.add_argument("--users", type=int, default=2000)
+    load_test.add_argument("--concurrency", type=int, default=500)
+    load_test.add_argument("--departments", type=int, default=30)
+    load_test.add_argument("--db-latency", type=float, default=1.0, help="задержка обращения к БД, мс")
+    load_test.add_argument("--think", type=float, default=0.0, help="пауза пользователя между шагами, с")
+    load_test.add_argument("--timeout", type=float, default=60.0)
+    load_test.add_argument("--storage", choices=["memory", "sqlite"], default="memory")
+    load_test.add_argument("--tracemalloc", action="store_true", help="считать пик памяти Python (медленнее)")
+    load_test.set_defaults(handler=bench_load_test)
+
+    return parser
+
+
+if __name__ == "__main__":
+    arguments = build_parser().parse_args()
+    asyncio.run(arguments.handler(arguments))
@@ -0,0 +1,225 @@
+"""Массовая рассылка администратора.
+
+Получатели читаются страницами по id через серверный курсор, так что в памяти
+одновременно не больше одной страницы. Отправка идёт с ограниченной
+параллельностью через общую очередь (лимиты Telegram соблюдает она), после
+каждой страницы в файл сохраняется только курсор (последний id). После
+падения рассылка продолжается с последней сохранённой страницы: часть её
+получателей может получить сообщение повторно, но никто не будет пропущен.
+При штатной остановке запоминаются и уже обслуженные получатели текущей
+страницы. Если страница не читается и после повторов, рассылка завершается
+со статусом failed, и администратор получает отчёт.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from aiogram.utils.exceptions import BotBlocked, CantInitiateConversation, ChatNotFound, UserDeactivated
+
+SQL_BROADCAST_USERS = """
+    SELECT id, telegram_id
+    FROM s3app_user
+    WHERE id > %s AND telegram_id IS NOT NULL AND telegram_id <> ''
+    ORDER BY id
+    LIMIT %s
+"""
+
+# Незавершённые заявки: у пользователя их может быть несколько — берём только первую из его
+# незавершённых. Страница — диапазон первичного ключа после курсора, проверка «нет более ранней»
+# идёт по индексу (telegram_id, created_at) для строк этой страницы, а не группировкой всей таблицы.
+# Если первая заявка закроется во время рассылки, пользователь может получить сообщение
+# повторно, но не будет пропущен
+SQL_BROADCAST_PENDING = """
+    SELECT r.id, r.telegram_id
+    FROM s3app_userrequest r
+    WHERE r.id > %s
+      AND r.status IN ('new', 'pending')
+      AND NOT EXISTS (
+          SELECT 1
+          FROM s3app_userrequest earlier
+          WHERE earlier.telegram_id = r.telegram_id
+            AND earlier.status IN ('new', 'pending')
+            AND earlier.id < r.id
+      )
+    ORDER BY r.id
+    LIMIT %s
+"""
+
+AUDIENCES = {
+    "all": SQL_BROADCAST_USERS,
+    "pending": SQL_BROADCAST_PENDING,
+}
+
+# Пользователь заблокировал бота или удалил аккаунт — повторять бессмысленно
+UNREACHABLE_ERRORS = (BotBlocked, CantInitiateConversation, ChatNotFound, UserDeactivated)
+
+IterRows = Callable[[str, Sequence[object], int], AsyncIterator[List[Dict[str, object]]]]
+Send = Callable[[str, str], Awaitable[object]]
+OnDone = Callable[[Dict[str, object]], Awaitable[None]]
+
+
+class BroadcastBusy(Exception):
+    """Предыдущая рассылка ещё не завершена"""
+
+
+class Broadcaster:
+    """Одна рассылка за раз; признак идущей рассылки — файл прогресса"""
+
+    def __init__(self, iter_rows: IterRows, *, state_path: str = "broadcast.json", concurrency: int = 20,
+                 page_size: int = 200, retry_delay: float = 5.0, read_retries: int = 5) -> None:
+        self.iter_rows = iter_rows
+        self.state_path = state_path
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.retry_delay = retry_delay
+        self.read_retries = read_retries
+        self.state: Optional[Dict[str, object]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._send: Optional[Send] = None
+        self._on_done: Optional[OnDone] = None
+
+    # --- управление ---
+
+    def start(self, audience: str, text: str, admin_id: str, send: Send, on_done: OnDone) -> None:
+        if audience not in AUDIENCES:
+            raise ValueError(f"Неизвестная аудитория: {audience}")
+        if self._task is not None or os.path.exists(self.state_path):
+            raise BroadcastBusy()
+        self.state = {
+            "audience": audience,
+            "text": text,
+            "admin_id": admin_id,
+            "last_id": 0,
+            "sent": 0,
+            "unreachable": 0,
+            "failed": 0,
+            "elapsed": 0.0,
+            "page_done": [],
+            "status": "running",
+            "error": None,
+        }
+        self._save()
+        self._launch(send, on_done)
+
+    def resume(self, send: Send, on_done: OnDone) -> bool:
+        """Продолжить рассылку, прерванную остановкой или падением процесса"""
+        if self._task is not None:
+            return False
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            return False
+        logging.info("Продолжаем рассылку «%s» после id %s", self.state['audience'], self.state['last_id'])
+        self._launch(send, on_done)
+        return True
+
+    async def stop(self) -> None:
+        """Прервать рассылку; файл прогресса остаётся, resume() продолжит её"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def progress(self) -> Optional[Dict[str, object]]:
+        if self.state is None or self._task is None:
+            return None
+        return {key: value for key, value in self.state.items() if key not in ("text", "page_done")}
+
+    # --- выполнение ---
+
+    def _launch(self, send: Send, on_done: OnDone) -> None:
+        self._send = send
+        self._on_done = on_done
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self) -> None:
+        state = self.state
+        query = AUDIENCES[state["audience"]]
+        # Получатели текущей страницы, которым отправка уже выполнена: после остановки не повторяем
+        page_done = set(state["page_done"])
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.monotonic() - state["elapsed"]
+
+        async def deliver(telegram_id: str) -> None:
+            async with semaphore:
+                try:
+                    await self._send(telegram_id, state["text"])
+                    state["sent"] += 1
+                except UNREACHABLE_ERRORS:
+                    state["unreachable"] += 1
+                except Exception as e:
+                    state["failed"] += 1
+                    logging.warning("Рассылка: не удалось отправить %s: %s", telegram_id, e)
+                page_done.add(telegram_id)
+
+        try:
+            while True:
+                page = await self._read_page(query, state["last_id"])
+                if page is None:
+                    state["status"] = "failed"
+                    break
+                recipients = [str(row["telegram_id"]) for row in page if str(row["telegram_id"]) not in page_done]
+
+                await asyncio.gather(*(deliver(telegram_id) for telegram_id in recipients))
+                if page:
+                    state["last_id"] = int(page[-1]["id"])
+                page_done.clear()
+                state["page_done"] = []
+                state["elapsed"] = time.monotonic() - started
+                self._save()
+                if len(page) < self.page_size:
+                    state["status"] = "done"
+                    break
+        except asyncio.CancelledError:
+            state["page_done"] = sorted(page_done)
+            state["elapsed"] = time.monotonic() - started
+            self._save()
+            raise
+
+        os.remove(self.state_path)
+        self._task = None
+        if state["status"] == "failed":
+            logging.error("Рассылка прервана после id %s: %s; %s", state['last_id'], state['error'],
+                          report_stats(state))
+        else:
+            logging.info("Рассылка завершена: %s", report_stats(state))
+        await self._on_done(state)
+
+    async def _read_page(self, query: str, last_id: int) -> Optional[List[Dict[str, object]]]:
+        """Страница целиком — соединение освобождается до начала отправки. None — не прочиталась"""
+        for attempt in range(self.read_retries + 1):
+            page: List[Dict[str, object]] = []
+            try:
+                async for rows in self.iter_rows(query, (last_id, self.page_size), self.page_size):
+                    page.extend(rows)
+                return page
+            except Exception as e:
+                self.state["error"] = str(e)
+                logging.warning("Рассылка: ошибка чтения получателей после id %s (попытка %s из %s): %s",
+                                last_id, attempt + 1, self.read_retries + 1, e)
+                if attempt < self.read_retries:
+                    await asyncio.sleep(self.retry_delay)
+        return None
+
+    def _save(self) -> None:
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+
+
+def report_stats(state: Dict[str, object]) -> Dict[str, object]:
+    total = state["sent"] + state["unreachable"] + state["failed"]
+    elapsed = state["elapsed"]
+    return {
+        "total": total,
+        "sent": state["sent"],
+        "unreachable": state["unreachable"],
+        "failed": state["failed"],
+        "elapsed": round(elapsed, 1),
+        "per_second": round(total / elapsed, 1) if elapsed > 0 else 0.0,
+    }
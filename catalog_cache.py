@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class CachedCatalog(Generic[T]):
+    """Кэш редко меняющегося справочника в памяти процесса.
+
+    Пока данные свежее ttl, get() отдаёт их без обращения к БД. Устаревшие
+    данные тоже отдаются сразу, а обновление идёт в фоне: сначала дешёвая
+    проверка probe() (контрольная сумма), и только если она изменилась —
+    полная загрузка load() с увеличением version.
+    """
+
+    def __init__(self, load: Callable[[], Awaitable[T]], probe: Callable[[], Awaitable[object]], *,
+                 ttl: float = 300.0, name: str = "catalog") -> None:
+        self._load = load
+        self._probe = probe
+        self.ttl = ttl
+        self.name = name
+
+        self._data: Optional[T] = None
+        self._fingerprint: object = None
+        self._checked_at = 0.0
+        self._force_reload = False
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._first_load: Optional[asyncio.Future] = None
+        self._periodic_task: Optional[asyncio.Task] = None
+
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.probes = 0
+        self.reloads = 0
+        self.errors = 0
+
+    async def get(self) -> T:
+        if self._data is None:
+            self.misses += 1
+            return await self._load_first()
+        self.hits += 1
+        if self._force_reload or time.monotonic() - self._checked_at > self.ttl:
+            self._schedule_refresh()
+        return self._data
+
+    def peek(self) -> Optional[T]:
+        """Текущие данные без обращения к БД (None, если ещё не загружены)"""
+        return self._data
+
+    def invalidate(self) -> None:
+        """Пометить справочник изменённым: следующий доступ запустит полную перезагрузку в фоне"""
+        self._force_reload = True
+        if self._data is not None:
+            self._schedule_refresh()
+
+    async def refresh(self) -> bool:
+        """Проверить изменения и при необходимости перезагрузить. True, если данные обновились"""
+        force = self._force_reload or self._data is None
+        self._force_reload = False
+        try:
+            self.probes += 1
+            fingerprint = await self._probe()
+            if not force and fingerprint == self._fingerprint:
+                self._checked_at = time.monotonic()
+                return False
+            data = await self._load()
+        except Exception:
+            self._force_reload = self._force_reload or force
+            raise
+        self._store(data, fingerprint)
+        return True
+
+    def start(self, interval: Optional[float] = None) -> None:
+        """Запустить периодическую фоновую проверку (по умолчанию раз в ttl)"""
+        if self._periodic_task is None:
+            self._periodic_task = asyncio.ensure_future(self._run_periodic(interval or self.ttl))
+
+    async def stop(self) -> None:
+        for task in (self._periodic_task, self._refresh_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._periodic_task = None
+        self._refresh_task = None
+
+    def stats(self) -> Dict[str, object]:
+        lookups = self.hits + self.misses
+        return {
+            "version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "probes": self.probes,
+            "reloads": self.reloads,
+            "errors": self.errors,
+            "age": round(time.monotonic() - self._checked_at, 1) if self._data is not None else None,
+        }
+
+    # --- внутреннее ---
+
+    def _store(self, data: T, fingerprint: object) -> None:
+        self._data = data
+        self._fingerprint = fingerprint
+        self._checked_at = time.monotonic()
+        self.version += 1
+        self.reloads += 1
+
+    async def _load_first(self) -> T:
+        # Параллельные первые обращения ждут одну и ту же загрузку
+        if self._first_load is None:
+            self._first_load = asyncio.ensure_future(self._initial_load())
+        first_load = self._first_load
+        try:
+            return await asyncio.shield(first_load)
+        finally:
+            if first_load.done() and self._first_load is first_load:
+                self._first_load = None
+
+    async def _initial_load(self) -> T:
+        await self.refresh()
+        return self._data
+
+    def _schedule_refresh(self) -> None:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._refresh_quietly())
+
+    async def _refresh_quietly(self) -> None:
+        try:
+            if await self.refresh():
+                logging.info("Справочник %s обновлён, версия %s", self.name, self.version)
+        except Exception as e:
+            self.errors += 1
+            # Оставляем старые данные, повторим при следующем обращении
+            self._checked_at = time.monotonic()
+            logging.warning("Не удалось обновить справочник %s: %s", self.name, e)
+
+    async def _run_periodic(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self._refresh_quietly()
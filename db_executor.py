@@ -0,0 +1,92 @@
+"""Отдельный пул потоков для блокирующих вызовов БД.
+
+asyncio.to_thread отдаёт работу в общий исполнитель цикла с неограниченной
+очередью: при медленной БД там копятся тысячи ожидающих задач. Здесь потоков
+столько же, сколько соединений в пуле, а очередь ограничена: когда она
+заполнена, вызов сразу получает DBOverloaded, и бот отвечает «попробуйте
+позже», вместо того чтобы копить апдейты в памяти.
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from metrics import Histogram
+
+
+class DBOverloaded(Exception):
+    """Очередь вызовов БД заполнена — запрос отклонён без ожидания"""
+
+
+class BoundedExecutor:
+    """Пул из max_workers потоков и очередь не длиннее max_queue вызовов"""
+
+    def __init__(self, max_workers: int, max_queue: int, *, queue_wait: Optional[Histogram] = None,
+                 backend: str = "thread", thread_name_prefix: str = "db") -> None:
+        if max_workers < 1 or max_queue < 0:
+            raise ValueError("Некорректные размеры исполнителя: max_workers=%s, max_queue=%s" % (max_workers, max_queue))
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.queue_wait = queue_wait
+        self.backend = backend
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix=thread_name_prefix)
+        self._lock = threading.Lock()
+
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self._wait_max = 0.0
+
+    async def run(self, op: str, func: Callable, *args, **kwargs):
+        """Выполнить func в пуле; op — имя операции для метрик"""
+        with self._lock:
+            # Свободный поток берёт вызов сразу, так что ждут только сверх max_workers
+            if self.queued + self.running >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise DBOverloaded(f"Очередь БД заполнена ({self.queued} вызовов ждут)")
+            self.queued += 1
+        submitted = time.perf_counter()
+        context = contextvars.copy_context()
+
+        def call():
+            waited = time.perf_counter() - submitted
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self._wait_max = max(self._wait_max, waited)
+            if self.queue_wait is not None:
+                self.queue_wait.observe(waited, op, self.backend)
+            try:
+                return context.run(func, *args, **kwargs)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        future = self._pool.submit(call)
+        future.add_done_callback(self._forget_cancelled)
+        return await asyncio.wrap_future(future)
+
+    def _forget_cancelled(self, future: Future) -> None:
+        # Задача отменена, пока вызов стоял в очереди: call() не запустится
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "wait_max": round(self._wait_max, 4),
+            }
@@ -0,0 +1,222 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterator, Optional
+
+import pymysql
+
+
+class PoolTimeout(Exception):
+    """Не удалось получить соединение из пула за отведённое время"""
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn: pymysql.connections.Connection) -> None:
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """Потокобезопасный пул соединений pymysql с ограничением размера.
+
+    Держит не меньше min_size открытых соединений и не больше max_size всего.
+    Соединения старше recycle секунд пересоздаются, а простаивавшие дольше
+    ping_interval проверяются ping() перед выдачей.
+    """
+
+    def __init__(self, connect: Callable[[], pymysql.connections.Connection], *,
+                 min_size: int = 1, max_size: int = 10, timeout: float = 5.0,
+                 recycle: float = 3600.0, ping_interval: float = 30.0,
+                 idle_timeout: float = 300.0) -> None:
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Некорректные размеры пула: min_size=%s, max_size=%s" % (min_size, max_size))
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+
+        self._lock = threading.Condition(threading.Lock())
+        self._idle: Deque[_PooledConnection] = deque()
+        self._in_use: Dict[int, _PooledConnection] = {}
+        self._size = 0  # открытые + резервированные под открытие
+        self._closed = False
+
+        self._created = 0
+        self._discarded = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    # --- выдача и возврат соединений ---
+
+    def acquire(self, timeout: Optional[float] = None) -> pymysql.connections.Connection:
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise PoolTimeout("Пул соединений закрыт")
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            "Нет свободных соединений в пуле за %.1f с (max_size=%s)" % (timeout, self.max_size)
+                        )
+                    waited = True
+                    self._lock.wait(remaining)
+                    if self._closed:
+                        raise PoolTimeout("Пул соединений закрыт")
+                if self._idle:
+                    pooled = self._idle.pop()
+                else:
+                    pooled = None
+                    self._size += 1
+
+            if pooled is None:
+                pooled = self._open_reserved()
+            elif not self._check(pooled):
+                self._discard(pooled)
+                continue
+
+            wait = time.monotonic() - started
+            with self._lock:
+                self._in_use[id(pooled.conn)] = pooled
+                self._checkouts += 1
+                if waited:
+                    self._waits += 1
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+            return pooled.conn
+
+    def release(self, conn: pymysql.connections.Connection, *, discard: bool = False) -> None:
+        with self._lock:
+            pooled = self._in_use.pop(id(conn), None)
+        if pooled is None:
+            return
+        if discard or self._closed or not conn.open:
+            self._discard(pooled)
+            return
+        pooled.last_used = time.monotonic()
+        with self._lock:
+            self._idle.append(pooled)
+            expired = self._collect_idle_locked(pooled.last_used)
+            self._lock.notify()
+        for item in expired:
+            self._discard(item)
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None) -> Iterator[pymysql.connections.Connection]:
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except Exception:
+            # Откатываем незавершённую транзакцию; если соединение сломано — выбрасываем его
+            try:
+                conn.rollback()
+            except Exception:
+                self.release(conn, discard=True)
+                raise
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    # --- обслуживание ---
+
+    def fill(self) -> int:
+        """Открыть соединения до min_size. Возвращает число открытых"""
+        opened = 0
+        while True:
+            with self._lock:
+                if self._closed or self._size >= self.min_size:
+                    return opened
+                self._size += 1
+            pooled = self._open_reserved()
+            with self._lock:
+                self._idle.append(pooled)
+                self._lock.notify()
+            opened += 1
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._lock.notify_all()
+        for pooled in idle:
+            self._discard(pooled)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "size": self._size,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "created": self._created,
+                "discarded": self._discarded,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "wait_total": round(self._wait_total, 6),
+                "wait_avg": round(self._wait_total / self._checkouts, 6) if self._checkouts else 0.0,
+                "wait_max": round(self._wait_max, 6),
+            }
+
+    # --- внутреннее ---
+
+    def _open_reserved(self) -> _PooledConnection:
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._lock:
+                self._size -= 1
+                self._lock.notify()
+            raise
+        with self._lock:
+            self._created += 1
+        return _PooledConnection(conn)
+
+    def _check(self, pooled: _PooledConnection) -> bool:
+        now = time.monotonic()
+        if self.recycle and now - pooled.created_at > self.recycle:
+            return False
+        if self.ping_interval is not None and now - pooled.last_used > self.ping_interval:
+            try:
+                pooled.conn.ping(reconnect=False)
+            except Exception as e:
+                logging.warning("Соединение с БД не отвечает, пересоздаём: %s", e)
+                return False
+        return True
+
+    def _collect_idle_locked(self, now: float) -> list:
+        expired = []
+        while len(self._idle) > self.min_size and now - self._idle[0].last_used > self.idle_timeout:
+            expired.append(self._idle.popleft())
+        return expired
+
+    def _discard(self, pooled: _PooledConnection) -> None:
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._size -= 1
+            self._discarded += 1
+            self._lock.notify()
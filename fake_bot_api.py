@@ -0,0 +1,226 @@
+"""Локальная заглушка Telegram Bot API для замеров и нагрузочных тестов.
+
+Бот подключается к ней через TELEGRAM_API_URL (или create_bot в bench.py).
+Заглушка отдаёт апдейты через getUpdates либо отправляет их на вебхук,
+запоминает все вызовы методов и позволяет дождаться ответа бота в чате.
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter, defaultdict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+
+from webhook_server import SECRET_TOKEN_HEADER
+
+BOT_USER = {"id": 1000000001, "is_bot": True, "first_name": "Test bot", "username": "test_bot"}
+
+
+class FakeBotAPI:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, *,
+                 global_limit: int = 0, chat_limit: int = 0) -> None:
+        self.host = host
+        self.port = port
+        self.calls: Counter = Counter()
+        self.sent: List[Dict[str, object]] = []
+        self.keep_sent = True
+        # Имитация лимитов Telegram: не больше N отправок за скользящую секунду, иначе 429
+        self.global_limit = global_limit
+        self.chat_limit = chat_limit
+        self.flood_errors = 0
+        self._global_window: Deque[float] = deque()
+        self._chat_windows: Dict[int, Deque[float]] = defaultdict(deque)
+
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._pending: List[Dict[str, object]] = []
+        self._has_updates = asyncio.Event()
+        self._reply_waiters: Dict[int, List[Tuple[str, asyncio.Future]]] = defaultdict(list)
+        self._webhook_url: Optional[str] = None
+        self._webhook_secret: Optional[str] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> "FakeBotAPI":
+        app = web.Application()
+        app.router.add_route("POST", "/bot{token}/{method}", self._handle)
+        app.router.add_route("GET", "/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._session = aiohttp.ClientSession()
+        return self
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def __aenter__(self) -> "FakeBotAPI":
+        return await self.start()
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    # --- апдейты от «пользователей» ---
+
+    def message_update(self, user_id: int, text: str) -> Dict[str, object]:
+        user = {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+        message = {
+            "message_id": next(self._message_ids),
+            "from": user,
+            "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]},
+            "date": int(time.time()),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def callback_update(self, user_id: int, data: str, message_id: int = 1) -> Dict[str, object]:
+        user = {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+        message = {
+            "message_id": message_id,
+            "from": BOT_USER,
+            "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]},
+            "date": int(time.time()),
+            "text": "...",
+        }
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": user,
+                "message": message,
+                "chat_instance": str(user_id),
+                "data": data,
+            },
+        }
+
+    async def push_update(self, update: Dict[str, object]) -> None:
+        if self._webhook_url:
+            headers = {SECRET_TOKEN_HEADER: self._webhook_secret} if self._webhook_secret else {}
+            async with self._session.post(self._webhook_url, json=update, headers=headers) as response:
+                response.raise_for_status()
+        else:
+            self._pending.append(update)
+            self._has_updates.set()
+
+    def wait_reply(self, chat_id: int, prefix: str = "") -> asyncio.Future:
+        """Future, который завершится при следующем ответе бота в чат chat_id,
+        текст которого начинается с prefix"""
+        future = asyncio.get_running_loop().create_future()
+        self._reply_waiters[chat_id].append((prefix, future))
+        return future
+
+    # --- Bot API ---
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        self.calls[method] += 1
+        if method.startswith(("send", "edit")) and self._flooded(int(params.get("chat_id") or 0)):
+            self.flood_errors += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1},
+            }, status=429)
+        handler = getattr(self, f"_api_{method}", None)
+        result = await handler(params) if handler else True
+        return web.json_response({"ok": True, "result": result})
+
+    def _flooded(self, chat_id: int) -> bool:
+        now = time.monotonic()
+        windows = []
+        if self.global_limit:
+            windows.append((self._global_window, self.global_limit))
+        if self.chat_limit:
+            windows.append((self._chat_windows[chat_id], self.chat_limit))
+        for window, limit in windows:
+            while window and window[0] <= now - 1:
+                window.popleft()
+            if len(window) >= limit:
+                return True
+        for window, _ in windows:
+            window.append(now)
+        return False
+
+    async def _api_getMe(self, params) -> Dict[str, object]:
+        return BOT_USER
+
+    async def _api_getUpdates(self, params) -> List[Dict[str, object]]:
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        self._pending = [u for u in self._pending if u["update_id"] >= offset]
+        if not self._pending and timeout:
+            self._has_updates.clear()
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._pending = [u for u in self._pending if u["update_id"] >= offset]
+        limit = int(params.get("limit") or 100)
+        return self._pending[:limit]
+
+    async def _api_setWebhook(self, params) -> bool:
+        self._webhook_url = params.get("url") or None
+        self._webhook_secret = params.get("secret_token") or None
+        if params.get("drop_pending_updates") in ("true", "True", True):
+            self._pending.clear()
+        return True
+
+    async def _api_deleteWebhook(self, params) -> bool:
+        self._webhook_url = None
+        self._webhook_secret = None
+        return True
+
+    async def _api_getWebhookInfo(self, params) -> Dict[str, object]:
+        return {"url": self._webhook_url or "", "has_custom_certificate": False, "pending_update_count": len(self._pending)}
+
+    async def _reply(self, method: str, params) -> Dict[str, object]:
+        chat_id = int(params.get("chat_id") or 0)
+        if self.keep_sent:
+            self.sent.append({"method": method, **params})
+        message = {
+            "message_id": int(params.get("message_id") or next(self._message_ids)),
+            "from": BOT_USER,
+            "chat": {"id": chat_id, "type": "private"},
+            "date": int(time.time()),
+            "text": params.get("text", ""),
+        }
+        if params.get("reply_markup"):
+            message["reply_markup"] = json.loads(params["reply_markup"])
+        waiters = self._reply_waiters.get(chat_id)
+        if waiters:
+            for prefix, future in list(waiters):
+                if message["text"].startswith(prefix):
+                    waiters.remove((prefix, future))
+                    if not future.done():
+                        future.set_result(message)
+            if not waiters:
+                del self._reply_waiters[chat_id]
+        return message
+
+    async def _api_sendMessage(self, params) -> Dict[str, object]:
+        return await self._reply("sendMessage", params)
+
+    async def _api_editMessageText(self, params) -> Dict[str, object]:
+        return await self._reply("editMessageText", params)
+
+    async def _api_editMessageReplyMarkup(self, params) -> Dict[str, object]:
+        return await self._reply("editMessageReplyMarkup", params)
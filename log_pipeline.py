@@ -0,0 +1,159 @@
+"""Журнал, который не тормозит обработчики.
+
+Обработчик в цикле событий только кладёт запись в очередь, а форматирует
+и пишет в stdout/файл отдельный поток (QueueListener). Сообщение собирается
+из шаблона и аргументов уже в этом потоке, поэтому в горячем пути пишем
+logger.info("... %s", value), а не f-строки. Каждой записи приписывается id
+апдейта, который сейчас обрабатывается, — по нему собирается вся цепочка
+записей одного нажатия. Подробные записи горячего пути (логгер bot.flow)
+сохраняются только для доли апдейтов.
+"""
+import contextvars
+import datetime
+import json
+import logging
+import queue
+import random
+import sys
+import zlib
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Sequence
+
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+# id апдейта в контексте задачи; задачи и потоки исполнителя БД получают копию контекста
+update_id: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("update_id", default=None)
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Стандартные поля LogRecord: всё остальное — переданное через extra= — попадает в JSON
+_STANDARD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "update_id"}
+
+_listener: Optional[QueueListener] = None
+
+
+class CorrelationFilter(logging.Filter):
+    """Запоминает id апдейта в записи — в потоке, который пишет, пока контекст ещё тот"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.update_id = update_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Записи ниже WARNING от логгеров prefixes оставляет для доли rate апдейтов"""
+
+    def __init__(self, prefixes: Sequence[str], rate: float) -> None:
+        super().__init__()
+        self.prefixes = tuple(prefixes)
+        self.threshold = int(rate * 10000)
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.threshold >= 10000 or not record.name.startswith(self.prefixes):
+            return True
+        key = getattr(record, "update_id", None)
+        # Решение по id апдейта: у выбранного апдейта в журнале вся цепочка, а не случайные строки
+        bucket = zlib.crc32(str(key).encode()) % 10000 if key is not None else random.randrange(10000)
+        if bucket < self.threshold:
+            return True
+        self.dropped += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, object] = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+        }
+        if getattr(record, "update_id", None) is not None:
+            entry["update_id"] = record.update_id
+        for key, value in vars(record).items():
+            if key not in _STANDARD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        if getattr(record, "update_id", None) is not None:
+            return f"{text} [update {record.update_id}]"
+        return text
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """QueueHandler без форматирования в вызывающем потоке; при полной очереди запись отбрасывается"""
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Очередь внутри процесса: запись не сериализуется, сообщение соберёт поток записи
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class CorrelationMiddleware(BaseMiddleware):
+    """Ставит id апдейта в контекст до всех обработчиков и остальных middleware"""
+
+    async def on_pre_process_update(self, update, data: dict) -> None:
+        update_id.set(update.update_id)
+
+
+def setup(*, level: str = "INFO", fmt: str = "json", path: str = "", queue_size: int = 10000,
+          sampled: Sequence[str] = ("bot.flow",), sample_rate: float = 1.0) -> QueueListener:
+    """Заменяет обработчики корневого логгера очередью и запускает поток записи"""
+    global _listener
+    stop()
+    formatter = JsonFormatter() if fmt == "json" else TextFormatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if path:
+        handlers.append(logging.FileHandler(path, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.Queue = queue.Queue(queue_size)
+    queue_handler = _DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(CorrelationFilter())
+    queue_handler.addFilter(SamplingFilter(sampled, sample_rate))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+
+    _listener = QueueListener(log_queue, *handlers)
+    _listener.start()
+    return _listener
+
+
+def stop() -> None:
+    """Дописать очередь и остановить поток записи (перед выходом из процесса)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.flush()
+        _listener = None
+
+
+def stats() -> Dict[str, int]:
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, _DeferredQueueHandler):
+            sampling = next(f for f in handler.filters if isinstance(f, SamplingFilter))
+            return {"queued": handler.queue.qsize(), "dropped": handler.dropped, "sampled_out": sampling.dropped}
+    return {}
@@ -1,18 +1,52 @@
 import asyncio
+import datetime
+import json
 import logging
+import multiprocessing
 import os
 import re
-from typing import Dict, List, Optional, Tuple
+import secrets
+import time
+import zlib
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import (AsyncIterator, Callable, Collection, ContextManager, Dict, Iterable, List, NamedTuple, Optional,
+                    Sequence, Tuple)
 
 import pymysql
+try:
+    import aiomysql
+except ImportError:  # асинхронный драйвер необязателен, без него работает потоковый бэкенд
+    aiomysql = None
 from aiogram import Bot, Dispatcher
+from aiogram.bot.api import TelegramAPIServer
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
 from aiogram.utils import executor
+from aiogram.utils.exceptions import MessageCantBeEdited, MessageNotModified, MessageToEditNotFound
+from aiohttp import web
 from dotenv import load_dotenv
 
+from broadcast import AUDIENCES, SQL_BROADCAST_PENDING, SQL_BROADCAST_USERS, Broadcaster, BroadcastBusy, report_stats
+from catalog_cache import CachedCatalog
+from db_executor import BoundedExecutor, DBOverloaded
+from db_pool import ConnectionPool
+import log_pipeline
+from log_pipeline import CorrelationMiddleware
+from metrics import HandlerMetrics, Registry, serve as serve_metrics, timed
+from outbox import ApiCallStats, EditCoalescer, ScheduledBot, SendScheduler, bulk
+from singleflight import KeyedLock, SingleFlight
+from sqlite_storage import SQLiteStorage
+from ttl_cache import MISSING, TTLCache
+from sharding import ShardRouter, create_router_app, poll_to_router
+from query_plans import PlanReport, Statement, check as check_plans, format_report
+from status_watcher import (SQL_WATCH_BOOTSTRAP, SQL_WATCH_BY_ID, SQL_WATCH_CLOSED, SQL_WATCH_NEW, SQL_WATCH_OPEN,
+                            SQL_WATCH_PROCESSED_DEPARTMENTS, StatusChange, StatusWatcher)
+from warm_start import StartupTimer, drain_backlog
+from webhook_server import FastAckWebhookHandler, create_webhook_app
+
 load_dotenv()
 
 local = False
@@ -33,7 +67,122 @@ else:
     DB_PASSWORD = 'Kfleirb_17$_'
 
 
-def get_db_connection() -> pymysql.connections.Connection:
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+DB_POOL_RECYCLE = float(os.getenv("DB_POOL_RECYCLE", "3600"))
+DB_POOL_PING_INTERVAL = float(os.getenv("DB_POOL_PING_INTERVAL", "30"))
+# Потоки для вызовов pymysql — по одному на соединение пула. Сверх них ждут не больше
+# DB_QUEUE_SIZE вызовов, остальные сразу получают «попробуйте позже»
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", str(DB_POOL_MAX_SIZE)))
+DB_QUEUE_SIZE = int(os.getenv("DB_QUEUE_SIZE", "100"))
+# aiomysql — запросы прямо в цикле событий; thread — pymysql в потоках (запасной вариант)
+DB_BACKEND = os.getenv("DB_BACKEND", "aiomysql")
+# Выполняется один раз при открытии соединения: списки отделов в GROUP_CONCAT не обрезаются
+DB_INIT_COMMAND = "SET SESSION group_concat_max_len = 1048576"
+# Как часто проверять, не изменился ли список отделов (секунды)
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", "300"))
+# Кэш последней заявки по telegram_id. TTL — насколько поздно пользователь может увидеть
+# изменение статуса, сделанное в админке; отсутствие заявок кэшируется отдельно
+REQUEST_CACHE_SIZE = int(os.getenv("REQUEST_CACHE_SIZE", "10000"))
+REQUEST_CACHE_TTL = float(os.getenv("REQUEST_CACHE_TTL", "15"))
+REQUEST_CACHE_NEGATIVE_TTL = float(os.getenv("REQUEST_CACHE_NEGATIVE_TTL", "5"))
+# Хранилище состояний анкет: sqlite — на диске, с удалением брошенных анкет (общее для воркеров
+# на одной машине); redis — общее для воркеров на разных машинах (нужен aioredis); memory — в памяти
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_SQLITE_PATH = os.getenv("FSM_SQLITE_PATH", "fsm_state.sqlite3")
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", "86400"))
+FSM_REDIS_HOST = os.getenv("FSM_REDIS_HOST", "localhost")
+FSM_REDIS_PORT = int(os.getenv("FSM_REDIS_PORT", "6379"))
+FSM_REDIS_DB = int(os.getenv("FSM_REDIS_DB", "0"))
+# Сколько готовых клавиатур отделов (версия справочника + выбор) держать в памяти
+DEPARTMENT_KEYBOARD_CACHE_SIZE = int(os.getenv("DEPARTMENT_KEYBOARD_CACHE_SIZE", "2048"))
+# Получение обновлений: polling (по умолчанию) или webhook — встроенный aiohttp-сервер.
+# WEBHOOK_URL — публичный адрес, по которому Telegram будет отправлять апдейты
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/tg/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+# Лимиты исходящих сообщений (в секунду): на бота, на личный чат (с запасом на короткую
+# серию ответов) и на группу. 0 отключает лимит. При нескольких воркерах общий лимит
+# бота делится между локальными воркерами
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "25"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", str(20 / 60)))
+# Несколько процессов-воркеров: фронт (polling или webhook) раскладывает апдейты по id чата.
+# Без BOT_WORKER_URLS фронт сам запускает BOT_WORKERS локальных воркеров на портах от
+# WORKER_BASE_PORT; BOT_MODE=worker запускает отдельный воркер (например, на другой машине)
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+BOT_WORKER_URLS = [url for url in os.getenv("BOT_WORKER_URLS", "").split(",") if url]
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", str(WEBAPP_PORT + 1)))
+WORKER_SECRET = os.getenv("WORKER_SECRET", "")
+# Другой сервер Bot API (локальный telegram-bot-api или тестовая заглушка)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+# Отделов на одной странице выбора: размер сообщения не растёт вместе со справочником
+DEPARTMENTS_PAGE_SIZE = int(os.getenv("DEPARTMENTS_PAGE_SIZE", "10"))
+# Частые нажатия на отделы склеиваются в одну правку сообщения после паузы (секунды);
+# 0 — править сообщение на каждое нажатие
+DEPARTMENT_EDIT_DELAY = float(os.getenv("DEPARTMENT_EDIT_DELAY", "0.4"))
+DEPARTMENT_EDIT_MAX_DELAY = float(os.getenv("DEPARTMENT_EDIT_MAX_DELAY", "1.5"))
+
+# Уведомления о смене статуса заявки; 0 — выключены. При нескольких воркерах работают только в первом
+STATUS_WATCH_INTERVAL = float(os.getenv("STATUS_WATCH_INTERVAL", "30"))
+STATUS_WATCH_BATCH = int(os.getenv("STATUS_WATCH_BATCH", "200"))
+STATUS_WATCH_STATE_PATH = os.getenv("STATUS_WATCH_STATE_PATH", "status_watch.json")
+
+# Рассылка /broadcast: кому можно, сколько отправок одновременно, размер страницы получателей
+BROADCAST_ADMIN_IDS = {admin_id for admin_id in os.getenv("BROADCAST_ADMIN_IDS", "").split(",") if admin_id}
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "200"))
+BROADCAST_STATE_PATH = os.getenv("BROADCAST_STATE_PATH", "broadcast.json")
+
+# Метрики Prometheus: отдельный сервер на METRICS_HOST:METRICS_PORT (0 — не запускать), не на
+# публичном порту вебхука. Локальные воркеры фронта — на METRICS_PORT + 1 + номер воркера
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+
+# EXPLAIN всех запросов бота при старте: off — не проверять, warn — предупреждения в лог
+QUERY_PLAN_CHECK = os.getenv("QUERY_PLAN_CHECK", "off")
+
+# Журнал: json — по записи JSON в строке, text — как раньше. Пишет отдельный поток;
+# если он не успевает и в очереди LOG_QUEUE_SIZE записей, новые отбрасываются
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_FILE = os.getenv("LOG_FILE", "")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Доля апдейтов, для которых пишутся подробные записи обработчиков (логгер bot.flow)
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+
+# on — до приёма апдейтов открыть соединения с БД, загрузить справочник отделов и клавиатуры
+WARM_START = os.getenv("WARM_START", "on")
+# Апдейты, пришедшие, пока бот не работал: skip — выбросить, process — разобрать. В polling
+# (и на фронте с воркерами) — не быстрее STARTUP_BACKLOG_RATE в секунду; в режиме вебхука
+# Telegram присылает их сам, и скорость здесь не ограничивается
+STARTUP_BACKLOG = os.getenv("STARTUP_BACKLOG", "skip")
+STARTUP_BACKLOG_RATE = float(os.getenv("STARTUP_BACKLOG_RATE", "20"))
+
+# Подробные записи горячего пути: в журнал попадают только для доли апдейтов (LOG_SAMPLE_RATE)
+flow_log = logging.getLogger("bot.flow")
+
+metrics_registry = Registry()
+handler_duration = metrics_registry.histogram(
+    "bot_handler_duration_seconds", "Время работы обработчика апдейта", ["handler"]
+)
+handler_errors = metrics_registry.counter("bot_handler_errors_total", "Необработанные исключения в обработчиках", ["error"])
+db_query_duration = metrics_registry.histogram(
+    "bot_db_query_duration_seconds", "Время обращения к БД по вспомогательным функциям", ["query", "backend"]
+)
+db_queue_wait = metrics_registry.histogram(
+    "bot_db_queue_wait_seconds", "Ожидание вызова БД в очереди до начала выполнения", ["query", "backend"]
+)
+
+
+def _open_db_connection() -> pymysql.connections.Connection:
+    # autocommit: соединения переиспользуются, и чтения не должны держать открытую транзакцию
     return pymysql.connect(
         host=DB_HOST,
         port=DB_PORT,
@@ -42,9 +191,25 @@ def get_db_connection() -> pymysql.connections.Connection:
         database=DB_NAME,
         charset="utf8mb4",
         cursorclass=pymysql.cursors.DictCursor,
+        autocommit=True,
+        init_command=DB_INIT_COMMAND,
     )
 
 
+db_pool = ConnectionPool(
+    _open_db_connection,
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    recycle=DB_POOL_RECYCLE,
+    ping_interval=DB_POOL_PING_INTERVAL,
+)
+
+
+def get_db_connection() -> ContextManager[pymysql.connections.Connection]:
+    return db_pool.connection()
+
+
 class InviteRequestForm(StatesGroup):
     waiting_first_name = State()
     waiting_last_name = State()
@@ -64,12 +229,30 @@ REGION_OPTIONS = [
 ]
 
 
+def serialize_keyboard(keyboard: InlineKeyboardMarkup) -> str:
+    # aiogram передаёт строковый reply_markup как есть, без повторного json.dumps на каждый запрос
+    return json.dumps(keyboard.to_python(), ensure_ascii=False, separators=(",", ":"))
+
+
+def static_keyboard(build: Callable[[], InlineKeyboardMarkup]) -> Callable[[], str]:
+    # Неизменяемые клавиатуры собираются и сериализуются один раз при импорте
+    markup = serialize_keyboard(build())
+
+    def keyboard() -> str:
+        return markup
+
+    keyboard.__name__ = build.__name__
+    return keyboard
+
+
+@static_keyboard
 def back_keyboard() -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup()
     keyboard.add(InlineKeyboardButton("⬅️ Назад", callback_data="back"))
     return keyboard
 
 
+@static_keyboard
 def confirmation_keyboard() -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup()
     keyboard.add(
@@ -79,6 +262,7 @@ def confirmation_keyboard() -> InlineKeyboardMarkup:
     return keyboard
 
 
+@static_keyboard
 def additional_decision_keyboard() -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup()
     keyboard.add(
@@ -88,6 +272,7 @@ def additional_decision_keyboard() -> InlineKeyboardMarkup:
     return keyboard
 
 
+@static_keyboard
 def region_keyboard() -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup()
     for region in REGION_OPTIONS:
@@ -96,21 +281,33 @@ def region_keyboard() -> InlineKeyboardMarkup:
     return keyboard
 
 
-def departments_keyboard(departments: List[Dict[str, object]], selected_departments: List[str] = None) -> InlineKeyboardMarkup:
-    if selected_departments is None:
-        selected_departments = []
+def department_pages(departments: List[Dict[str, object]], page_size: int = DEPARTMENTS_PAGE_SIZE) -> int:
+    return max(1, -(-len(departments) // page_size))
+
+
+def departments_keyboard(departments: List[Dict[str, object]], selected_ids: Collection[int] = (),
+                         page: int = 0, page_size: int = DEPARTMENTS_PAGE_SIZE) -> InlineKeyboardMarkup:
+    pages = department_pages(departments, page_size)
+    page = min(max(page, 0), pages - 1)
     
     keyboard = InlineKeyboardMarkup()
     
-    # Добавляем кнопки для каждого отдела
-    for dept in departments:
-        is_selected = dept['name'] in selected_departments
+    # Добавляем кнопки для отделов текущей страницы
+    for dept in departments[page * page_size:(page + 1) * page_size]:
+        is_selected = dept['id'] in selected_ids
         emoji = "✅" if is_selected else "📁"
         keyboard.add(InlineKeyboardButton(
             f"{emoji} {dept['name']}", 
             callback_data=f"dept_{dept['id']}"
         ))
     
+    if pages > 1:
+        keyboard.row(
+            InlineKeyboardButton("◀️", callback_data=f"deptpage_{(page - 1) % pages}"),
+            InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"deptpage_{page}"),
+            InlineKeyboardButton("▶️", callback_data=f"deptpage_{(page + 1) % pages}"),
+        )
+    
     # Кнопки управления
     keyboard.row(
         InlineKeyboardButton("✅ Подтвердить выбор", callback_data="confirm_departments"),
@@ -121,193 +318,707 @@ def departments_keyboard(departments: List[Dict[str, object]], selected_departme
     return keyboard
 
 
-def _fetch_departments_sync() -> List[Dict[str, object]]:
-    with get_db_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                """
-                SELECT g.id, g.name
-                FROM auth_group g
-                LEFT JOIN s3app_groupsettings gs ON g.id = gs.group_id
-                WHERE COALESCE(gs.show_in_bot, 1) = 1
-                ORDER BY COALESCE(gs.bot_order, 0), g.name
-                """
-            )
-            return cursor.fetchall()
+SQL_FETCH_DEPARTMENTS = """
+    SELECT g.id, g.name
+    FROM auth_group g
+    LEFT JOIN s3app_groupsettings gs ON g.id = gs.group_id
+    WHERE COALESCE(gs.show_in_bot, 1) = 1
+    ORDER BY COALESCE(gs.bot_order, 0), g.name
+"""
+
+# Дешёвая проверка изменений справочника: одна строка вместо всего списка
+SQL_DEPARTMENTS_CHECKSUM = """
+    SELECT COUNT(*) AS total,
+           COALESCE(BIT_XOR(CRC32(CONCAT_WS('|', g.id, g.name, COALESCE(gs.show_in_bot, 1), COALESCE(gs.bot_order, 0)))), 0) AS checksum
+    FROM auth_group g
+    LEFT JOIN s3app_groupsettings gs ON g.id = gs.group_id
+"""
+
+# Профиль вместе с отделами пользователя — одно обращение к БД
+SQL_USER_BY_TELEGRAM = """
+    SELECT u.id, u.first_name, u.last_name, u.middle_name, u.region, u.email,
+           (SELECT GROUP_CONCAT(g.name ORDER BY g.name SEPARATOR '\\n')
+            FROM auth_group g
+            JOIN s3app_user_groups ug ON g.id = ug.group_id
+            WHERE ug.user_id = u.id) AS departments
+    FROM s3app_user u
+    WHERE u.telegram_id = %s
+    LIMIT 1
+"""
+
+# Снимок последней заявки за один запрос: списки отделов склеиваются через GROUP_CONCAT
+# (лимит group_concat_max_len поднимается при открытии соединения, см. DB_INIT_COMMAND)
+SQL_LATEST_REQUEST_SNAPSHOT = """
+    SELECT r.id, r.status, r.region, r.is_additional, r.created_at,
+           (SELECT GROUP_CONCAT(g.name ORDER BY g.name SEPARATOR '\\n')
+            FROM auth_group g
+            JOIN s3app_userrequest_processed_departments pd ON g.id = pd.group_id
+            WHERE pd.userrequest_id = r.id) AS processed_departments,
+           (SELECT GROUP_CONCAT(g.name ORDER BY g.name SEPARATOR '\\n')
+            FROM auth_group g
+            JOIN s3app_userrequest_departments d ON g.id = d.group_id
+            WHERE d.userrequest_id = r.id) AS departments
+    FROM s3app_userrequest r
+    WHERE r.telegram_id = %s
+    ORDER BY r.created_at DESC
+    LIMIT 1
+"""
+
+SQL_LATEST_REQUEST_FOR_UPDATE = """
+    SELECT id, status, created_at
+    FROM s3app_userrequest
+    WHERE telegram_id = %s
+    ORDER BY created_at DESC
+    LIMIT 1
+    FOR UPDATE
+"""
+
+# Именованная блокировка на пользователя: проверку и вставку заявки не пересекают ни соседний
+# обработчик, ни другой процесс бота. Без неё FOR UPDATE при отсутствии строк берёт только
+# совместимую блокировку промежутка, и две вставки заканчиваются взаимоблокировкой
+SQL_REQUEST_LOCK = "SELECT GET_LOCK(CONCAT('s3bot_request:', %s), %s) AS acquired"
+SQL_REQUEST_UNLOCK = "SELECT RELEASE_LOCK(CONCAT('s3bot_request:', %s)) AS released"
+
+SQL_INSERT_REQUEST = """
+    INSERT INTO s3app_userrequest (full_name, telegram_id, region, is_additional, target_user_id, status, created_at, processed_at, processed_by_id)
+    VALUES (%s, %s, %s, %s, %s, 'new', NOW(), NULL, NULL)
+"""
+
+# Отделы ищутся по id из состояния анкеты: сравнение названий зависит от collation
+# (ё/е, акценты, пробелы в конце), а первичный ключ — нет
+SQL_FIND_GROUPS = "SELECT id FROM auth_group WHERE id IN ({placeholders})"
+
+SQL_INSERT_REQUEST_DEPARTMENT = """
+    INSERT IGNORE INTO s3app_userrequest_departments (userrequest_id, group_id)
+    VALUES (%s, %s)
+"""
+
+
+def _find_groups_query(departments: Dict[int, str]) -> Tuple[str, List[int]]:
+    ids = list(departments)
+    return SQL_FIND_GROUPS.format(placeholders=", ".join(["%s"] * len(ids))), ids
+
+
+def bot_statements() -> List[Statement]:
+    """Все чтения, которые выполняет бот, с примерными параметрами — для проверки планов EXPLAIN"""
+    find_groups, ids = _find_groups_query({0: "—"})
+    watermark = datetime.datetime(2000, 1, 1)
+    return [
+        Statement("fetch_departments", SQL_FETCH_DEPARTMENTS, ()),
+        Statement("departments_checksum", SQL_DEPARTMENTS_CHECKSUM, ()),
+        Statement("user_by_telegram", SQL_USER_BY_TELEGRAM, ("0",)),
+        Statement("latest_request_snapshot", SQL_LATEST_REQUEST_SNAPSHOT, ("0",)),
+        Statement("latest_request_for_update", SQL_LATEST_REQUEST_FOR_UPDATE, ("0",)),
+        Statement("find_groups", find_groups, ids),
+        Statement("watch_bootstrap", SQL_WATCH_BOOTSTRAP, ()),
+        Statement("watch_open", SQL_WATCH_OPEN, ()),
+        Statement("watch_new", SQL_WATCH_NEW, (0, STATUS_WATCH_BATCH)),
+        Statement("watch_by_id", SQL_WATCH_BY_ID.format(placeholders="%s"), (0,)),
+        Statement("watch_closed", SQL_WATCH_CLOSED, (watermark, watermark, 0, STATUS_WATCH_BATCH)),
+        Statement("watch_processed_departments", SQL_WATCH_PROCESSED_DEPARTMENTS.format(placeholders="%s"), (0,)),
+        Statement("broadcast_users", SQL_BROADCAST_USERS, (0, BROADCAST_PAGE_SIZE)),
+        Statement("broadcast_pending", SQL_BROADCAST_PENDING, (0, BROADCAST_PAGE_SIZE)),
+    ]
 
 
-async def fetch_departments() -> List[Dict[str, object]]:
-    return await asyncio.to_thread(_fetch_departments_sync)
+def _match_groups(departments: Dict[int, str], rows: List[Dict[str, object]]) -> Tuple[List[int], List[str]]:
+    # Разбираем ответ одного IN-запроса: id найденных отделов и имена удалённых в исходном порядке
+    found = {int(row["id"]) for row in rows}
+    group_ids = [group_id for group_id in departments if group_id in found]
+    missing = [name for group_id, name in departments.items() if group_id not in found]
+    return group_ids, missing
 
 
-async def send_departments_prompt(target, state: FSMContext) -> None:
-    departments = await fetch_departments()
-    await state.update_data(departments_catalog=departments, selected_departments=[])
+def _split_names(value: object) -> List[str]:
+    if not value:
+        return []
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+    return str(value).split("\n")
 
-    if not departments:
-        await target.answer("Отделы не найдены в системе. Свяжитесь с администратором для уточнения.", reply_markup=back_keyboard())
-    else:
-        await target.answer("Выберите отделы:\n\nВыбрано: ничего", reply_markup=departments_keyboard(departments, []))
 
+def _decode_request_snapshot(row: Optional[Dict[str, object]]) -> Optional[Dict[str, object]]:
+    if not row:
+        return None
+    row["is_additional"] = bool(row.get("is_additional"))
+    row["processed_departments"] = _split_names(row.get("processed_departments"))
+    row["departments"] = _split_names(row.get("departments"))
+    return row
 
-def send_region_prompt_text() -> str:
-    lines = [f"{idx}. {name}" for idx, name in enumerate(REGION_OPTIONS, start=1)]
-    numbered_list = "\n".join(lines)
-    return (
-        "Выберите регион, отправив номер или название из списка:\n\n"
-        f"{numbered_list}"
-    )
 
+def _decode_user(row: Optional[Dict[str, object]]) -> Optional[Dict[str, object]]:
+    if not row:
+        return None
+    row["departments"] = _split_names(row.get("departments"))
+    return row
 
-async def send_region_prompt(target, state: FSMContext) -> None:
-    await target.answer("Выберите регион:", reply_markup=region_keyboard())
 
+def _request_conflict(existing: Optional[Dict[str, object]], allow_processed: bool) -> Optional[Tuple[int, List[str]]]:
+    # Общая для обоих бэкендов проверка: нельзя подать новую заявку поверх активной или обработанной
+    if existing and existing["status"] in {"new", "pending"}:
+        return existing["id"], ["__active__"]
+    if existing and existing["status"] == "processed" and not allow_processed:
+        return existing["id"], ["__processed__"]
+    return None
 
-def _get_user_by_telegram_sync(telegram_id: str) -> Optional[Dict[str, object]]:
+
+def _check_query_plans_sync() -> PlanReport:
+    # Отдельное соединение: пул pymysql при бэкенде aiomysql не используется
+    conn = _open_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            return check_plans(cursor, bot_statements())
+    finally:
+        conn.close()
+
+
+async def warn_about_query_plans() -> None:
+    """Режим QUERY_PLAN_CHECK=warn: проблемы планов в лог, запуск бота не останавливается"""
+    try:
+        report = await db.run_blocking("query_plans", _check_query_plans_sync)
+    except Exception as e:
+        logging.warning("Проверка планов запросов не выполнена: %s", e)
+        return
+    if report.ok:
+        logging.info("Планы запросов в порядке: полных проходов и сортировок без индекса нет")
+    for line in format_report(report):
+        logging.warning("Планы запросов: %s", line)
+
+
+@timed(db_query_duration, "fetch_departments", "thread")
+def _fetch_departments_sync() -> List[Dict[str, object]]:
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
-            cursor.execute(
-                """
-                SELECT id, first_name, last_name, middle_name, region, email
-                FROM s3app_user
-                WHERE telegram_id = %s
-                LIMIT 1
-                """,
-                (telegram_id,),
-            )
-            user = cursor.fetchone()
+            cursor.execute(SQL_FETCH_DEPARTMENTS)
+            return cursor.fetchall()
 
-            if user:
-                # Получаем отделы (группы) пользователя
-                cursor.execute(
-                    """
-                    SELECT g.name
-                    FROM auth_group g
-                    JOIN s3app_user_groups ug ON g.id = ug.group_id
-                    WHERE ug.user_id = %s
-                    ORDER BY g.name
-                    """,
-                    (user['id'],),
-                )
-                user['departments'] = [row['name'] for row in cursor.fetchall()]
 
-            return user
+@timed(db_query_duration, "probe_departments", "thread")
+def _probe_departments_sync() -> Tuple[int, int]:
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(SQL_DEPARTMENTS_CHECKSUM)
+            row = cursor.fetchone()
+            return int(row["total"]), int(row["checksum"])
 
 
-async def get_user_by_telegram(telegram_id: str) -> Optional[Dict[str, object]]:
-    return await asyncio.to_thread(_get_user_by_telegram_sync, telegram_id)
+@timed(db_query_duration, "get_user_by_telegram", "thread")
+def _get_user_by_telegram_sync(telegram_id: str) -> Optional[Dict[str, object]]:
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(SQL_USER_BY_TELEGRAM, (telegram_id,))
+            return _decode_user(cursor.fetchone())
 
 
-def _create_request_sync(full_name: str, telegram_id: str, region: str, departments: List[str], *,
+@timed(db_query_duration, "create_request", "thread")
+def _create_request_sync(full_name: str, telegram_id: str, region: str, departments: Dict[int, str], *,
                          is_additional: bool = False, target_user_id: Optional[int] = None,
                          allow_processed: bool = False) -> Tuple[int, List[str]]:
     missing: List[str] = []
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
-            cursor.execute(
-                """
-                SELECT id, status, created_at
-                FROM s3app_userrequest
-                WHERE telegram_id = %s
-                ORDER BY created_at DESC
-                LIMIT 1
-                """,
-                (telegram_id,),
-            )
-            existing = cursor.fetchone()
-            if existing and existing["status"] in {"new", "pending"}:
-                return existing["id"], ["__active__"]
-            if existing and existing["status"] == "processed" and not allow_processed:
-                return existing["id"], ["__processed__"]
-
-            cursor.execute(
-                """
-                INSERT INTO s3app_userrequest (full_name, telegram_id, region, is_additional, target_user_id, status, created_at, processed_at, processed_by_id)
-                VALUES (%s, %s, %s, %s, %s, 'new', NOW(), NULL, NULL)
-                """,
-                (full_name, telegram_id, region, is_additional, target_user_id),
-            )
-            request_id = cursor.lastrowid
-
-            for dept in departments:
-                cursor.execute(
-                    "SELECT id FROM auth_group WHERE LOWER(name) = LOWER(%s) LIMIT 1",
-                    (dept,),
-                )
-                row = cursor.fetchone()
-                if not row:
-                    missing.append(dept)
-                    continue
-                cursor.execute(
-                    """
-                    INSERT IGNORE INTO s3app_userrequest_departments (userrequest_id, group_id)
-                    VALUES (%s, %s)
-                    """,
-                    (request_id, row["id"]),
-                )
-
-        conn.commit()
+            cursor.execute(SQL_REQUEST_LOCK, (telegram_id, DB_POOL_TIMEOUT))
+            if not cursor.fetchone()["acquired"]:
+                raise DBOverloaded(f"Не дождались блокировки заявок пользователя {telegram_id}")
+            try:
+                conn.begin()
+                cursor.execute(SQL_LATEST_REQUEST_FOR_UPDATE, (telegram_id,))
+                conflict = _request_conflict(cursor.fetchone(), allow_processed)
+                if conflict:
+                    conn.rollback()
+                    return conflict
+
+                cursor.execute(SQL_INSERT_REQUEST, (full_name, telegram_id, region, is_additional, target_user_id))
+                request_id = cursor.lastrowid
+
+                if departments:
+                    cursor.execute(*_find_groups_query(departments))
+                    group_ids, missing = _match_groups(departments, cursor.fetchall())
+                    if group_ids:
+                        # executemany собирает INSERT ... VALUES в один многострочный запрос
+                        cursor.executemany(SQL_INSERT_REQUEST_DEPARTMENT,
+                                           [(request_id, group_id) for group_id in group_ids])
+
+                conn.commit()
+            finally:
+                # Блокировка живёт до конца сессии, а соединение вернётся в пул
+                cursor.execute(SQL_REQUEST_UNLOCK, (telegram_id,))
     return request_id, missing
 
 
+@timed(db_query_duration, "get_latest_request", "thread")
 def _get_latest_request_sync(telegram_id: str) -> Optional[Dict[str, object]]:
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
-            cursor.execute(
-                """
-                SELECT id, status, region, is_additional, created_at
-                FROM s3app_userrequest
-                WHERE telegram_id = %s
-                ORDER BY created_at DESC
-                LIMIT 1
-                """,
-                (telegram_id,),
-            )
-            request = cursor.fetchone()
-            if not request:
-                return None
-            request["is_additional"] = bool(request.get("is_additional"))
-            cursor.execute(
-                """
-                SELECT g.name
-                FROM auth_group g
-                JOIN s3app_userrequest_processed_departments pd ON g.id = pd.group_id
-                WHERE pd.userrequest_id = %s
-                ORDER BY g.name
-                """,
-                (request["id"],),
-            )
-            request["processed_departments"] = [row["name"] for row in cursor.fetchall()]
-            cursor.execute(
-                """
-                SELECT g.name
-                FROM auth_group g
-                JOIN s3app_userrequest_departments d ON g.id = d.group_id
-                WHERE d.userrequest_id = %s
-                ORDER BY g.name
-                """,
-                (request["id"],),
-            )
-            request["departments"] = [row["name"] for row in cursor.fetchall()]
-            return request
-
-
-async def create_request(full_name: str, telegram_id: str, region: str, departments: List[str], *,
-                         is_additional: bool = False, target_user_id: Optional[int] = None) -> Tuple[int, List[str]]:
-    return await asyncio.to_thread(
-        _create_request_sync,
-        full_name,
-        telegram_id,
-        region,
-        departments,
-        is_additional=is_additional,
-        target_user_id=target_user_id,
-        allow_processed=is_additional,
+            cursor.execute(SQL_LATEST_REQUEST_SNAPSHOT, (telegram_id,))
+            return _decode_request_snapshot(cursor.fetchone())
+
+
+@timed(db_query_duration, "fetch_all", "thread")
+def _fetch_all_sync(query: str, args: Sequence[object] = ()) -> List[Dict[str, object]]:
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(query, args)
+            return list(cursor.fetchall())
+
+
+class ThreadDatabase:
+    """Блокирующий pymysql через пул соединений, вызовы — в собственном ограниченном пуле потоков"""
+
+    name = "thread"
+
+    def __init__(self) -> None:
+        self.executor = BoundedExecutor(DB_EXECUTOR_WORKERS, DB_QUEUE_SIZE, queue_wait=db_queue_wait)
+
+    async def _call(self, op: str, func: Callable, *args, **kwargs):
+        return await self.executor.run(op, func, *args, **kwargs)
+
+    async def run_blocking(self, op: str, func: Callable, *args, **kwargs):
+        """Блокирующий вызов pymysql вне обычных запросов — в том же ограниченном пуле потоков"""
+        return await self._call(op, func, *args, **kwargs)
+
+    async def start(self) -> None:
+        # Открываем min_size соединений заранее, чтобы первые пользователи не ждали подключения
+        await self._call("fill_pool", db_pool.fill)
+
+    async def close(self) -> None:
+        self.executor.shutdown()
+        db_pool.close()
+
+    def stats(self) -> Dict[str, object]:
+        executor_stats = self.executor.stats()
+        return {
+            **db_pool.stats(),
+            "queued": executor_stats["queued"],
+            "running": executor_stats["running"],
+            "rejected": executor_stats["rejected"],
+        }
+
+    async def fetch_departments(self) -> List[Dict[str, object]]:
+        return await self._call("fetch_departments", _fetch_departments_sync)
+
+    async def probe_departments(self) -> Tuple[int, int]:
+        return await self._call("probe_departments", _probe_departments_sync)
+
+    async def get_user_by_telegram(self, telegram_id: str) -> Optional[Dict[str, object]]:
+        return await self._call("get_user_by_telegram", _get_user_by_telegram_sync, telegram_id)
+
+    async def create_request(self, full_name: str, telegram_id: str, region: str, departments: Dict[int, str], *,
+                             is_additional: bool = False, target_user_id: Optional[int] = None,
+                             allow_processed: bool = False) -> Tuple[int, List[str]]:
+        return await self._call(
+            "create_request",
+            _create_request_sync,
+            full_name,
+            telegram_id,
+            region,
+            departments,
+            is_additional=is_additional,
+            target_user_id=target_user_id,
+            allow_processed=allow_processed,
+        )
+
+    async def get_latest_request(self, telegram_id: str) -> Optional[Dict[str, object]]:
+        return await self._call("get_latest_request", _get_latest_request_sync, telegram_id)
+
+    async def fetch_all(self, query: str, args: Sequence[object] = ()) -> List[Dict[str, object]]:
+        return await self._call("fetch_all", _fetch_all_sync, query, args)
+
+    async def iter_rows(self, query: str, args: Sequence[object] = (),
+                        chunk_size: int = 500) -> AsyncIterator[List[Dict[str, object]]]:
+        """Чтение серверным курсором: в памяти не больше chunk_size строк"""
+        conn = await self._call("iter_rows", db_pool.acquire)
+        cursor = conn.cursor(pymysql.cursors.SSDictCursor)
+        finished = False
+        try:
+            await self._call("iter_rows", cursor.execute, query, args)
+            while True:
+                rows = await self._call("iter_rows", cursor.fetchmany, chunk_size)
+                if not rows:
+                    break
+                yield list(rows)
+            cursor.close()
+            finished = True
+        finally:
+            # Недочитанный серверный курсор занимает соединение — такое в пул не возвращаем
+            db_pool.release(conn, discard=not finished)
+
+
+class AioMySQLDatabase:
+    """Асинхронный драйвер aiomysql: запросы выполняются прямо в цикле событий"""
+
+    name = "aiomysql"
+
+    def __init__(self) -> None:
+        self._pool = None
+        self._pool_lock = asyncio.Lock()
+        # Запросы, которые держат или ждут соединение; сверх maxsize + DB_QUEUE_SIZE — отказ
+        self.pending = 0
+        self.rejected = 0
+        # Редкие блокирующие вызовы pymysql (проверка планов при запуске) — не в общем исполнителе цикла
+        self.executor = BoundedExecutor(1, DB_QUEUE_SIZE, queue_wait=db_queue_wait, backend=self.name,
+                                        thread_name_prefix="db-blocking")
+
+    async def run_blocking(self, op: str, func: Callable, *args, **kwargs):
+        return await self.executor.run(op, func, *args, **kwargs)
+
+    async def start(self) -> None:
+        await self._get_pool()
+
+    async def close(self) -> None:
+        self.executor.shutdown()
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+
+    def stats(self) -> Dict[str, object]:
+        if self._pool is None:
+            return {"size": 0, "idle": 0, "in_use": 0, "min_size": DB_POOL_MIN_SIZE, "max_size": DB_POOL_MAX_SIZE,
+                    "queued": 0, "rejected": self.rejected}
+        in_use = self._pool.size - self._pool.freesize
+        return {
+            "size": self._pool.size,
+            "idle": self._pool.freesize,
+            "in_use": in_use,
+            "min_size": self._pool.minsize,
+            "max_size": self._pool.maxsize,
+            "queued": max(self.pending - in_use, 0),
+            "rejected": self.rejected,
+        }
+
+    async def _get_pool(self):
+        if self._pool is None:
+            async with self._pool_lock:
+                if self._pool is None:
+                    self._pool = await aiomysql.create_pool(
+                        host=DB_HOST,
+                        port=DB_PORT,
+                        user=DB_USER,
+                        password=DB_PASSWORD,
+                        db=DB_NAME,
+                        charset="utf8mb4",
+                        autocommit=True,
+                        init_command=DB_INIT_COMMAND,
+                        minsize=DB_POOL_MIN_SIZE,
+                        maxsize=DB_POOL_MAX_SIZE,
+                        pool_recycle=int(DB_POOL_RECYCLE),
+                    )
+        return self._pool
+
+    @asynccontextmanager
+    async def _acquire(self, op: str):
+        if self.pending >= DB_POOL_MAX_SIZE + DB_QUEUE_SIZE:
+            self.rejected += 1
+            raise DBOverloaded(f"Очередь БД заполнена ({self.pending} запросов ждут или выполняются)")
+        self.pending += 1
+        try:
+            pool = await self._get_pool()
+            started = time.perf_counter()
+            conn = await asyncio.wait_for(pool.acquire(), timeout=DB_POOL_TIMEOUT)
+            db_queue_wait.observe(time.perf_counter() - started, op, self.name)
+            try:
+                yield conn
+            finally:
+                pool.release(conn)
+        finally:
+            self.pending -= 1
+
+    @timed(db_query_duration, "fetch_departments", "aiomysql")
+    async def fetch_departments(self) -> List[Dict[str, object]]:
+        async with self._acquire("fetch_departments") as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(SQL_FETCH_DEPARTMENTS)
+                return list(await cursor.fetchall())
+
+    @timed(db_query_duration, "probe_departments", "aiomysql")
+    async def probe_departments(self) -> Tuple[int, int]:
+        async with self._acquire("probe_departments") as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(SQL_DEPARTMENTS_CHECKSUM)
+                row = await cursor.fetchone()
+                return int(row["total"]), int(row["checksum"])
+
+    @timed(db_query_duration, "get_user_by_telegram", "aiomysql")
+    async def get_user_by_telegram(self, telegram_id: str) -> Optional[Dict[str, object]]:
+        async with self._acquire("get_user_by_telegram") as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(SQL_USER_BY_TELEGRAM, (telegram_id,))
+                return _decode_user(await cursor.fetchone())
+
+    @timed(db_query_duration, "create_request", "aiomysql")
+    async def create_request(self, full_name: str, telegram_id: str, region: str, departments: Dict[int, str], *,
+                             is_additional: bool = False, target_user_id: Optional[int] = None,
+                             allow_processed: bool = False) -> Tuple[int, List[str]]:
+        missing: List[str] = []
+        async with self._acquire("create_request") as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(SQL_REQUEST_LOCK, (telegram_id, DB_POOL_TIMEOUT))
+                if not (await cursor.fetchone())["acquired"]:
+                    raise DBOverloaded(f"Не дождались блокировки заявок пользователя {telegram_id}")
+                try:
+                    await conn.begin()
+                    try:
+                        await cursor.execute(SQL_LATEST_REQUEST_FOR_UPDATE, (telegram_id,))
+                        conflict = _request_conflict(await cursor.fetchone(), allow_processed)
+                        if conflict:
+                            await conn.rollback()
+                            return conflict
+
+                        await cursor.execute(SQL_INSERT_REQUEST,
+                                             (full_name, telegram_id, region, is_additional, target_user_id))
+                        request_id = cursor.lastrowid
+
+                        if departments:
+                            await cursor.execute(*_find_groups_query(departments))
+                            group_ids, missing = _match_groups(departments, await cursor.fetchall())
+                            if group_ids:
+                                await cursor.executemany(
+                                    SQL_INSERT_REQUEST_DEPARTMENT, [(request_id, group_id) for group_id in group_ids]
+                                )
+
+                        await conn.commit()
+                    except BaseException:
+                        try:
+                            await conn.rollback()
+                        except Exception:
+                            conn.close()
+                        raise
+                finally:
+                    # Блокировка живёт до конца сессии, а соединение вернётся в пул; у закрытого её снял сервер
+                    if not conn.closed:
+                        await cursor.execute(SQL_REQUEST_UNLOCK, (telegram_id,))
+        return request_id, missing
+
+    @timed(db_query_duration, "get_latest_request", "aiomysql")
+    async def get_latest_request(self, telegram_id: str) -> Optional[Dict[str, object]]:
+        async with self._acquire("get_latest_request") as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(SQL_LATEST_REQUEST_SNAPSHOT, (telegram_id,))
+                return _decode_request_snapshot(await cursor.fetchone())
+
+    @timed(db_query_duration, "fetch_all", "aiomysql")
+    async def fetch_all(self, query: str, args: Sequence[object] = ()) -> List[Dict[str, object]]:
+        async with self._acquire("fetch_all") as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(query, args)
+                return list(await cursor.fetchall())
+
+    async def iter_rows(self, query: str, args: Sequence[object] = (),
+                        chunk_size: int = 500) -> AsyncIterator[List[Dict[str, object]]]:
+        """Чтение серверным курсором: в памяти не больше chunk_size строк"""
+        async with self._acquire("iter_rows") as conn:
+            async with conn.cursor(aiomysql.SSDictCursor) as cursor:
+                await cursor.execute(query, args)
+                while True:
+                    rows = await cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield list(rows)
+
+
+def create_database(backend: str = DB_BACKEND):
+    if backend == "aiomysql":
+        if aiomysql is None:
+            logging.warning("aiomysql не установлен, используем потоковый бэкенд pymysql")
+            return ThreadDatabase()
+        return AioMySQLDatabase()
+    if backend == "thread":
+        return ThreadDatabase()
+    raise RuntimeError(f"Неизвестный DB_BACKEND: {backend}")
+
+
+db = create_database()
+
+class Departments(NamedTuple):
+    items: List[Dict[str, object]]
+    names: Dict[int, str]
+    # Версия по содержимому: одинакова во всех процессах и после перезапуска
+    version: int
+
+    def resolve(self, selected_ids: Iterable[int]) -> List[str]:
+        return list(self.select(selected_ids).values())
+
+    def select(self, selected_ids: Iterable[int]) -> Dict[int, str]:
+        """Выбранные отделы справочника: id -> название, в порядке выбора"""
+        return {dept_id: self.names[dept_id] for dept_id in selected_ids if dept_id in self.names}
+
+
+async def _load_departments() -> Departments:
+    items = await db.fetch_departments()
+    version = zlib.crc32(json.dumps([[dept["id"], dept["name"]] for dept in items], ensure_ascii=False).encode("utf-8"))
+    return Departments(items=items, names={dept["id"]: dept["name"] for dept in items}, version=version)
+
+
+# Общий для всех пользователей список отделов; в состоянии FSM хранятся только id выбранных
+department_catalog: CachedCatalog[Departments] = CachedCatalog(
+    _load_departments,
+    lambda: db.probe_departments(),
+    ttl=CATALOG_TTL,
+    name="отделов",
+)
+
+
+async def fetch_departments() -> Departments:
+    return await department_catalog.get()
+
+
+department_keyboards: TTLCache[str] = TTLCache(maxsize=DEPARTMENT_KEYBOARD_CACHE_SIZE, ttl=float("inf"))
+
+
+def cached_departments_keyboard(departments: Departments, selected_ids: Collection[int] = (), page: int = 0) -> str:
+    page = min(max(page, 0), department_pages(departments.items) - 1)
+    page_items = departments.items[page * DEPARTMENTS_PAGE_SIZE:(page + 1) * DEPARTMENTS_PAGE_SIZE]
+    # На вид страницы влияет только выбор среди её отделов
+    page_selected = frozenset(dept["id"] for dept in page_items if dept["id"] in selected_ids)
+    key = (departments.version, page, page_selected)
+    markup = department_keyboards.get(key)
+    if markup is MISSING:
+        markup = serialize_keyboard(departments_keyboard(departments.items, page_selected, page))
+        department_keyboards.set(key, markup)
+    return markup
+
+
+# Одинаковые одновременные чтения выполняются один раз; записи одного пользователя — по очереди
+db_reads = SingleFlight()
+db_writes = SingleFlight()
+user_write_locks = KeyedLock()
+
+
+async def get_user_by_telegram(telegram_id: str) -> Optional[Dict[str, object]]:
+    user = await db_reads.run(("user", telegram_id), db.get_user_by_telegram, telegram_id)
+    return dict(user) if user is not None else None
+
+
+request_cache: TTLCache[Dict[str, object]] = TTLCache(
+    maxsize=REQUEST_CACHE_SIZE,
+    ttl=REQUEST_CACHE_TTL,
+    negative_ttl=REQUEST_CACHE_NEGATIVE_TTL,
+)
+
+
+async def create_request(full_name: str, telegram_id: str, region: str, departments: Dict[int, str], *,
+                         is_additional: bool = False, target_user_id: Optional[int] = None,
+                         idempotency_key: Optional[str] = None) -> Tuple[int, List[str]]:
+    """Повтор с тем же idempotency_key (или теми же данными), пока первый не завершён, получает его результат"""
+    key = (telegram_id, idempotency_key or (full_name, region, tuple(departments), is_additional, target_user_id))
+    return await db_writes.run(
+        key, _create_request_serialized, full_name, telegram_id, region, departments,
+        is_additional=is_additional, target_user_id=target_user_id,
     )
 
 
+async def _create_request_serialized(full_name: str, telegram_id: str, region: str, departments: Dict[int, str], *,
+                                     is_additional: bool, target_user_id: Optional[int]) -> Tuple[int, List[str]]:
+    async with user_write_locks.hold(telegram_id):
+        try:
+            return await db.create_request(
+                full_name,
+                telegram_id,
+                region,
+                departments,
+                is_additional=is_additional,
+                target_user_id=target_user_id,
+                allow_processed=is_additional,
+            )
+        finally:
+            invalidate_latest_request(telegram_id)
+
+
+def invalidate_latest_request(telegram_id: str) -> None:
+    request_cache.invalidate(telegram_id)
+    # Чтение, начатое до изменения, вернёт старую заявку — новые к нему не присоединяются
+    db_reads.forget(("latest_request", telegram_id))
+
+
 async def get_latest_request(telegram_id: str) -> Optional[Dict[str, object]]:
-    return await asyncio.to_thread(_get_latest_request_sync, telegram_id)
+    cached = request_cache.get(telegram_id)
+    if cached is not MISSING:
+        return dict(cached) if cached is not None else None
+    generation = request_cache.generation()
+    request = await db_reads.run(("latest_request", telegram_id), db.get_latest_request, telegram_id)
+    # Если заявку сбросили, пока шло чтение (новая заявка, смена статуса), снимок в кэш не кладём
+    request_cache.set(telegram_id, request, generation)
+    return dict(request) if request is not None else None
+
+
+class UserContext(NamedTuple):
+    latest_request: Optional[Dict[str, object]]
+    user: Optional[Dict[str, object]]
+
+
+async def load_user_context(telegram_id: str) -> UserContext:
+    # Заявка и профиль загружаются параллельно: задержка — одно обращение к БД, а не сумма
+    latest_request, user = await asyncio.gather(
+        get_latest_request(telegram_id),
+        get_user_by_telegram(telegram_id),
+    )
+    return UserContext(latest_request=latest_request, user=user)
+
+
+def departments_prompt_text(selected_names: List[str]) -> str:
+    return f"Выберите отделы:\n\nВыбрано: {', '.join(selected_names) if selected_names else 'ничего'}"
+
+
+edit_coalescer = EditCoalescer(DEPARTMENT_EDIT_DELAY, DEPARTMENT_EDIT_MAX_DELAY)
+# Что сейчас показано в сообщениях бота (chat_id, message_id) -> (текст, клавиатура):
+# правка, которая ничего не меняет, не отправляется
+shown_messages: TTLCache[Tuple[str, Optional[str]]] = TTLCache(maxsize=10000, ttl=3600)
+
+
+def message_key(message: Message) -> Tuple[int, int]:
+    return message.chat.id, message.message_id
+
+
+async def edit_or_answer(message: Message, text: str, reply_markup=None) -> None:
+    """Заменить сообщение бота новым текстом и кнопками одним запросом.
+
+    Если сообщение уже нельзя отредактировать (слишком старое или удалено),
+    отправляем новое.
+    """
+    key = message_key(message)
+    # Отложенная правка этого сообщения не должна затереть новую
+    await edit_coalescer.settle(key)
+    content = (text, reply_markup) if reply_markup is None or isinstance(reply_markup, str) else None
+    if content is not None and shown_messages.get(key, None) == content:
+        return
+    try:
+        await message.edit_text(text, reply_markup=reply_markup)
+    except MessageNotModified:
+        pass
+    except (MessageCantBeEdited, MessageToEditNotFound):
+        shown_messages.invalidate(key)
+        await message.answer(text, reply_markup=reply_markup)
+        return
+    if content is not None:
+        shown_messages.set(key, content)
+    else:
+        shown_messages.invalidate(key)
+
+
+async def send_departments_prompt(target, state: FSMContext, *, edit: bool = False) -> None:
+    departments = await fetch_departments()
+    await state.update_data(catalog_version=departments.version, selected_department_ids=[], department_page=0)
+
+    reply = partial(edit_or_answer, target) if edit else target.answer
+    if not departments.items:
+        await reply("Отделы не найдены в системе. Свяжитесь с администратором для уточнения.", reply_markup=back_keyboard())
+    else:
+        await reply(departments_prompt_text([]), reply_markup=cached_departments_keyboard(departments))
+
+
+def send_region_prompt_text() -> str:
+    lines = [f"{idx}. {name}" for idx, name in enumerate(REGION_OPTIONS, start=1)]
+    numbered_list = "\n".join(lines)
+    return (
+        "Выберите регион, отправив номер или название из списка:\n\n"
+        f"{numbered_list}"
+    )
+
+
+async def send_region_prompt(target, state: FSMContext, *, edit: bool = False) -> None:
+    reply = partial(edit_or_answer, target) if edit else target.answer
+    await reply("Выберите регион:", reply_markup=region_keyboard())
 
 
 STATUS_DISPLAY = {
@@ -317,9 +1028,13 @@ STATUS_DISPLAY = {
     "rejected": "❌ Отклонена",
 }
 
+DB_BUSY_TEXT = "⏳ Сейчас много обращений, бот не успевает их обработать. Попробуйте через минуту."
+# Нажатие на кнопку анкеты, которой уже нет: заполнена, сброшена или удалена по сроку хранения
+FORM_EXPIRED_TEXT = "⌛ Эта анкета устарела. Начните заново командой /start."
+
 
 async def cmd_start(message: Message, state: FSMContext) -> None:
-    logging.info(f"Команда /start от пользователя {message.from_user.id}")
+    logging.info("Команда /start от пользователя %s", message.from_user.id)
     await state.finish()
     await message.answer(
         "Привет! Я бот для оформления заявок. Используйте /post_invate, чтобы отправить новую заявку, или /help для справки."
@@ -327,7 +1042,7 @@ async def cmd_start(message: Message, state: FSMContext) -> None:
 
 
 async def cmd_help(message: Message) -> None:
-    logging.info(f"Команда /help от пользователя {message.from_user.id}")
+    logging.info("Команда /help от пользователя %s", message.from_user.id)
     await message.answer(
         "📋 Доступные команды:\n"
         "/start - Начать работу с ботом\n"
@@ -338,19 +1053,28 @@ async def cmd_help(message: Message) -> None:
 
 
 async def cmd_post_invate(message: Message, state: FSMContext) -> None:
-    logging.info(f"Команда /post_invate от пользователя {message.from_user.id}")
+    flow_log.info("Команда /post_invate от пользователя %s", message.from_user.id)
 
-    logging.info("Получаем последнюю заявку из БД...")
     try:
-        existing = await get_latest_request(str(message.from_user.id))
-        logging.info(f"Заявка получена: {existing}")
+        context = await load_user_context(str(message.from_user.id))
+        flow_log.info(
+            "Последняя заявка: %s, статус %s; профиль пользователя: %s",
+            context.latest_request and context.latest_request["id"],
+            context.latest_request and context.latest_request.get("status"),
+            context.user and context.user["id"],
+        )
+    except DBOverloaded:
+        await message.answer(DB_BUSY_TEXT)
+        return
     except Exception as e:
-        logging.error(f"Ошибка при получении заявки: {e}")
+        logging.error("Ошибка при получении заявки: %s", e)
         await message.answer("Произошла ошибка при проверке ваших заявок. Попробуйте позже.")
         return
 
+    existing = context.latest_request
+    existing_user = context.user
+
     if existing:
-        logging.info(f"Найдена существующая заявка со статусом: {existing.get('status')}")
         status = existing.get("status")
         if status in {"new", "pending"}:
             departments = ", ".join(existing.get("departments", [])) or "не указаны"
@@ -369,25 +1093,12 @@ async def cmd_post_invate(message: Message, state: FSMContext) -> None:
             await message.answer("\n".join(lines))
             return
         if status == "processed":
-            logging.info("Статус processed, проверяем пользователя в системе...")
-            try:
-                existing_user = await get_user_by_telegram(str(message.from_user.id))
-                logging.info(f"Пользователь найден: {existing_user}")
-            except Exception as e:
-                logging.error(f"Ошибка при получении пользователя: {e}")
-                await message.answer("Произошла ошибка. Попробуйте позже.")
-                return
-
             if existing_user:
-                logging.info("Предлагаем дополнительную заявку...")
+                flow_log.info("Заявка обработана, предлагаем дополнительную")
                 try:
-                    logging.info("Сбрасываем состояние...")
                     await state.reset_state(with_data=False)
-                    logging.info("Обновляем данные состояния...")
                     await state.update_data(existing_user=existing_user)
-                    logging.info("Устанавливаем состояние waiting_additional_decision...")
                     await state.set_state(InviteRequestForm.waiting_additional_decision.state)
-                    logging.info("Формируем текст сообщения...")
                     summary_region = existing.get("region") or existing_user.get("region") or "—"
                     # Показываем текущие отделы пользователя из БД, а не из заявки
                     summary_departments = ", ".join(existing_user.get("departments", [])) or "не указаны"
@@ -398,21 +1109,15 @@ async def cmd_post_invate(message: Message, state: FSMContext) -> None:
                         "",
                         "Подать заявку на доступ к дополнительным отделам?",
                     ]
-                    logging.info(f"Отправляем сообщение: {summary_text}")
                     await message.answer("\n".join(summary_text), reply_markup=additional_decision_keyboard())
-                    logging.info("Сообщение отправлено!")
                     return
-                except Exception as e:
-                    logging.error(f"Ошибка при отправке сообщения о дополнительной заявке: {e}")
-                    import traceback
-                    traceback.print_exc()
+                except Exception:
+                    logging.exception("Ошибка при отправке сообщения о дополнительной заявке")
                     await message.answer("Произошла ошибка. Попробуйте позже.")
                     return
 
-    logging.info("Заявок не найдено, проверяем пользователя...")
-    existing_user = await get_user_by_telegram(str(message.from_user.id))
-    logging.info(f"Пользователь: {existing_user}")
     if existing_user:
+        flow_log.info("Заявок нет, пользователь уже есть в системе — предлагаем дополнительную заявку")
         await state.reset_state(with_data=False)
         await state.update_data(existing_user=existing_user)
         await state.set_state(InviteRequestForm.waiting_additional_decision.state)
@@ -428,19 +1133,14 @@ async def cmd_post_invate(message: Message, state: FSMContext) -> None:
         await message.answer("\n".join(summary_text), reply_markup=additional_decision_keyboard())
         return
 
-    logging.info("Начинаем новую заявку, запрашиваем имя...")
+    flow_log.info("Начинаем новую заявку")
     await state.reset_state(with_data=False)
     await state.set_state(InviteRequestForm.waiting_first_name.state)
     await message.answer("Введите имя.", reply_markup=back_keyboard())
-    logging.info("Запрос имени отправлен!")
 
 
 async def handle_additional_decision(query: CallbackQuery, state: FSMContext) -> None:
     await query.answer()
-    try:
-        await query.message.edit_reply_markup()
-    except Exception:
-        pass
 
     data = await state.get_data()
     if query.data == "additional_yes":
@@ -455,18 +1155,19 @@ async def handle_additional_decision(query: CallbackQuery, state: FSMContext) ->
                 target_user_id=existing_user.get("id"),
             )
         await state.set_state(InviteRequestForm.waiting_departments.state)
-        await send_departments_prompt(query.message, state)
+        # Сообщение с вопросом превращается в выбор отделов — одна правка вместо двух запросов
+        await send_departments_prompt(query.message, state, edit=True)
     else:
         await state.finish()
-        await query.message.answer("Операция отменена.")
+        await edit_or_answer(query.message, "Операция отменена.")
 
 
 async def handle_confirmation(query: CallbackQuery, state: FSMContext) -> None:
+    if await state.get_state() != InviteRequestForm.waiting_confirmation.state:
+        # Повторное нажатие после сохранения заявки или анкета, удалённая из хранилища по сроку хранения
+        await query.answer(FORM_EXPIRED_TEXT, show_alert=True)
+        return
     await query.answer()
-    try:
-        await query.message.edit_reply_markup()
-    except Exception:
-        pass
 
     data = await state.get_data()
     if query.data == "confirm_yes":
@@ -474,7 +1175,8 @@ async def handle_confirmation(query: CallbackQuery, state: FSMContext) -> None:
         last_name = data.get("last_name", "").strip()
         middle_name = data.get("middle_name", "").strip()
         region = data.get("region", "")
-        departments = data.get("departments", [])
+        selected = (await fetch_departments()).select(data.get("selected_department_ids", []))
+        departments = list(selected.values())
         is_additional = data.get("is_additional", False)
         target_user_id = data.get("target_user_id")
 
@@ -488,15 +1190,17 @@ async def handle_confirmation(query: CallbackQuery, state: FSMContext) -> None:
             full_name=full_name,
             telegram_id=str(query.from_user.id),
             region=region_to_save,
-            departments=departments,
+            departments=selected,
             is_additional=is_additional,
             target_user_id=target_user_id,
+            # Все нажатия на кнопки одного сообщения с подтверждением — одна заявка
+            idempotency_key=f"{query.message.chat.id}:{query.message.message_id}",
         )
         await state.finish()
 
         if missing == ["__active__"]:
-            await query.message.answer(
-                "У вас уже есть активная заявка. Проверьте статус командой /status."
+            await edit_or_answer(
+                query.message, "У вас уже есть активная заявка. Проверьте статус командой /status."
             )
             return
         if missing == ["__processed__"]:
@@ -513,9 +1217,9 @@ async def handle_confirmation(query: CallbackQuery, state: FSMContext) -> None:
                     f"Отделы: {departments_summary}",
                     f"Дата: {created_at}",
                 ]
-                await query.message.answer("\n".join(lines))
+                await edit_or_answer(query.message, "\n".join(lines))
             else:
-                await query.message.answer("✅ Ваша заявка уже обработана.")
+                await edit_or_answer(query.message, "✅ Ваша заявка уже обработана.")
             return
 
         lines = [f"📝 Заявка №{request_id} успешно сохранена."]
@@ -530,11 +1234,10 @@ async def handle_confirmation(query: CallbackQuery, state: FSMContext) -> None:
             lines.append("⚠️ Не найдены отделы: " + ", ".join(filtered_missing))
         lines.append("")
         lines.append("Проверить статус можно командой /status")
-        await query.message.answer("\n".join(lines))
+        await edit_or_answer(query.message, "\n".join(lines))
     else:
-        await state.update_data(departments=[])
         await state.set_state(InviteRequestForm.waiting_departments.state)
-        await send_departments_prompt(query.message, state)
+        await send_departments_prompt(query.message, state, edit=True)
 
 
 async def process_first_name(message: Message, state: FSMContext) -> None:
@@ -570,153 +1273,165 @@ async def process_middle_name(message: Message, state: FSMContext) -> None:
 # Обработчики для инлайн кнопок регионов и отделов
 async def handle_region_selection(query: CallbackQuery, state: FSMContext) -> None:
     await query.answer()
-    try:
-        await query.message.edit_reply_markup()
-    except Exception:
-        pass
 
     region = query.data.replace("region_", "")
     await state.update_data(region=region)
     await state.set_state(InviteRequestForm.waiting_departments.state)
-    await send_departments_prompt(query.message, state)
+    await send_departments_prompt(query.message, state, edit=True)
 
 
 async def handle_department_selection(query: CallbackQuery, state: FSMContext) -> None:
+    if await state.get_state() != InviteRequestForm.waiting_departments.state:
+        # Клавиатура от прошлой анкеты: выбор в текущем состоянии не трогаем
+        await query.answer(FORM_EXPIRED_TEXT, show_alert=True)
+        return
     await query.answer()
-    try:
-        await query.message.edit_reply_markup()
-    except Exception:
-        pass
 
     dept_id = int(query.data.replace("dept_", ""))
     data = await state.get_data()
-    catalog: List[Dict[str, object]] = data.get("departments_catalog", [])
-    selected_departments: List[str] = data.get("selected_departments", [])
-    
-    # Находим отдел по ID
-    dept_name = None
-    for dept in catalog:
-        if dept['id'] == dept_id:
-            dept_name = dept['name']
-            break
-    
-    if dept_name:
-        if dept_name in selected_departments:
+    departments = await fetch_departments()
+    # dict как упорядоченное множество: порядок выбора сохраняется, переключение за O(1)
+    selected = dict.fromkeys(data.get("selected_department_ids", []))
+    if data.get("catalog_version") != departments.version:
+        # Справочник обновился — выбрасываем отделы, которых в нём больше нет
+        selected = dict.fromkeys(d for d in selected if d in departments.names)
+
+    # Отдела нет в справочнике (кнопка от старой версии) — просто перерисовываем клавиатуру
+    if dept_id in departments.names:
+        if dept_id in selected:
             # Убираем отдел из выбранных
-            selected_departments.remove(dept_name)
+            del selected[dept_id]
         else:
             # Добавляем отдел к выбранным
-            selected_departments.append(dept_name)
-        
-        await state.update_data(selected_departments=selected_departments)
-        
-        # Обновляем клавиатуру с новым состоянием
-        updated_keyboard = departments_keyboard(catalog, selected_departments)
-        await query.message.edit_text(
-            f"Выберите отделы:\n\nВыбрано: {', '.join(selected_departments) if selected_departments else 'ничего'}",
-            reply_markup=updated_keyboard
-        )
+            selected[dept_id] = None
 
+    await state.update_data(catalog_version=departments.version, selected_department_ids=list(selected))
 
-async def handle_departments_confirm(query: CallbackQuery, state: FSMContext) -> None:
+    # Состояние уже сохранено; сообщение перерисуется один раз после серии быстрых нажатий
+    message = query.message
+    await edit_coalescer.submit(message_key(message), lambda: show_department_selection(message, state))
+
+
+async def show_department_selection(message: Message, state: FSMContext) -> None:
+    """Перерисовать выбор отделов по текущему состоянию анкеты"""
+    if await state.get_state() != InviteRequestForm.waiting_departments.state:
+        return
+    data = await state.get_data()
+    departments = await fetch_departments()
+    selected = [d for d in data.get("selected_department_ids", []) if d in departments.names]
+    keyboard = cached_departments_keyboard(departments, selected, data.get("department_page", 0))
+    await edit_or_answer(message, departments_prompt_text(departments.resolve(selected)), keyboard)
+
+
+async def handle_department_page(query: CallbackQuery, state: FSMContext) -> None:
+    if await state.get_state() != InviteRequestForm.waiting_departments.state:
+        await query.answer(FORM_EXPIRED_TEXT, show_alert=True)
+        return
     await query.answer()
-    try:
-        await query.message.edit_reply_markup()
-    except Exception:
-        pass
+    data = await state.get_data()
+    departments = await fetch_departments()
+    # Номер из кнопки старой клавиатуры может не существовать, если отделов стало меньше
+    page = min(max(int(query.data.replace("deptpage_", "")), 0), department_pages(departments.items) - 1)
+    if page == data.get("department_page", 0):
+        return
+
+    selected = [d for d in data.get("selected_department_ids", []) if d in departments.names]
+    await state.update_data(department_page=page)
+    # Выбор хранится в состоянии целиком, на странице отображается только её часть
+    await edit_or_answer(
+        query.message,
+        departments_prompt_text(departments.resolve(selected)),
+        cached_departments_keyboard(departments, selected, page)
+    )
+
 
+async def handle_departments_confirm(query: CallbackQuery, state: FSMContext) -> None:
     data = await state.get_data()
-    selected_departments: List[str] = data.get("selected_departments", [])
-    
+    departments = await fetch_departments()
+    selected_departments = departments.resolve(data.get("selected_department_ids", []))
+
     if not selected_departments:
-        await query.message.answer("Выберите хотя бы один отдел.", reply_markup=departments_keyboard(data.get("departments_catalog", []), []))
+        # Подсказка во всплывающем окне, клавиатура выбора остаётся на месте
+        await query.answer("Выберите хотя бы один отдел.", show_alert=True)
         return
-    
-    await state.update_data(departments=selected_departments)
+
+    await query.answer()
     await state.set_state(InviteRequestForm.waiting_confirmation.state)
     selected_text = ", ".join(selected_departments)
-    await query.message.answer(
-        f"Вы выбрали отделы: {selected_text}. Подтвердить?",
-        reply_markup=confirmation_keyboard(),
-    )
+    await edit_or_answer(query.message, f"Вы выбрали отделы: {selected_text}. Подтвердить?", confirmation_keyboard())
 
 
 async def handle_departments_reset(query: CallbackQuery, state: FSMContext) -> None:
     await query.answer()
-    try:
-        await query.message.edit_reply_markup()
-    except Exception:
-        pass
 
     data = await state.get_data()
-    catalog: List[Dict[str, object]] = data.get("departments_catalog", [])
-    await state.update_data(selected_departments=[])
-    await query.message.edit_text(
-        "Выберите отделы:\n\nВыбрано: ничего",
-        reply_markup=departments_keyboard(catalog, [])
+    departments = await fetch_departments()
+    await state.update_data(catalog_version=departments.version, selected_department_ids=[])
+    await edit_or_answer(
+        query.message,
+        departments_prompt_text([]),
+        cached_departments_keyboard(departments, (), data.get("department_page", 0))
     )
 
 
 async def handle_back(query: CallbackQuery, state: FSMContext) -> None:
     current_state = await state.get_state()
     await query.answer()
-    try:
-        await query.message.delete()
-    except Exception:
-        pass
 
+    # Сообщение с кнопкой «Назад» заменяется предыдущим шагом одной правкой
     if current_state == InviteRequestForm.waiting_first_name.state:
         # Отменяем заполнение заявки
         await state.finish()
-        await query.message.answer("❌ Заполнение заявки отменено.")
+        await edit_or_answer(query.message, "❌ Заполнение заявки отменено.")
     elif current_state == InviteRequestForm.waiting_last_name.state:
         await state.set_state(InviteRequestForm.waiting_first_name.state)
-        await query.message.answer("Введите имя.", reply_markup=back_keyboard())
+        await edit_or_answer(query.message, "Введите имя.", back_keyboard())
     elif current_state == InviteRequestForm.waiting_middle_name.state:
         await state.set_state(InviteRequestForm.waiting_last_name.state)
-        await query.message.answer("Введите фамилию.", reply_markup=back_keyboard())
+        await edit_or_answer(query.message, "Введите фамилию.", back_keyboard())
     elif current_state == InviteRequestForm.waiting_region.state:
         await state.set_state(InviteRequestForm.waiting_middle_name.state)
-        await query.message.answer("Введите отчество.", reply_markup=back_keyboard())
+        await edit_or_answer(query.message, "Введите отчество.", back_keyboard())
     elif current_state == InviteRequestForm.waiting_departments.state:
         data = await state.get_data()
         if data.get("is_additional"):
-            await state.update_data(departments=[], selected_departments=[])
+            await state.update_data(selected_department_ids=[])
             await state.set_state(InviteRequestForm.waiting_additional_decision.state)
-            await query.message.answer(
+            await edit_or_answer(
+                query.message,
                 "Хотите подать заявку на доступ к дополнительным отделам?",
-                reply_markup=additional_decision_keyboard()
+                additional_decision_keyboard()
             )
         else:
             await state.set_state(InviteRequestForm.waiting_region.state)
-            await state.update_data(departments=[], selected_departments=[])
-            await send_region_prompt(query.message, state)
+            await state.update_data(selected_department_ids=[])
+            await send_region_prompt(query.message, state, edit=True)
     elif current_state == InviteRequestForm.waiting_confirmation.state:
         await state.set_state(InviteRequestForm.waiting_departments.state)
-        await send_departments_prompt(query.message, state)
+        await send_departments_prompt(query.message, state, edit=True)
     else:
         await state.finish()
-        await query.message.answer("❌ Заполнение заявки отменено.")
+        await edit_or_answer(query.message, "❌ Заполнение заявки отменено.")
 
 
 async def cmd_status(message: Message, state: FSMContext) -> None:
-    logging.info(f"Команда /status от пользователя {message.from_user.id}")
+    flow_log.info("Команда /status от пользователя %s", message.from_user.id)
 
-    logging.info("Получаем заявку из БД...")
     try:
         request = await get_latest_request(str(message.from_user.id))
-        logging.info(f"Заявка получена: {request}")
+        flow_log.info("Последняя заявка: %s, статус %s", request and request["id"], request and request["status"])
+    except DBOverloaded:
+        await message.answer(DB_BUSY_TEXT)
+        return
     except Exception as e:
-        logging.error(f"Ошибка при получении статуса заявки: {e}")
+        logging.error("Ошибка при получении статуса заявки: %s", e)
         await message.answer("Произошла ошибка при проверке статуса. Попробуйте позже.")
         return
 
     if not request:
-        logging.info("Заявок не найдено")
         await message.answer("📭 Заявок не найдено.")
         return
 
-    logging.info("Формируем ответ со статусом...")
     departments = ", ".join(request.get("departments", [])) or "не указаны"
     created_at = request["created_at"].strftime("%d.%m.%Y %H:%M") if request["created_at"] else "—"
     raw_status = request["status"]
@@ -744,28 +1459,286 @@ async def cmd_status(message: Message, state: FSMContext) -> None:
     lines.append("")
     lines.append(f"🕒 Создана: {created_at}")
 
-    logging.info(f"Отправляем статус заявки...")
     await message.answer("\n".join(lines))
-    logging.info("Статус отправлен!")
 
     # Сбрасываем состояние FSM после показа статуса
     await state.finish()
-    logging.info("Состояние FSM сброшено")
 
 
-def main() -> None:
-    token = API_TOKEN
-    if not token:
-        raise RuntimeError("TELEGRAM_BOT_TOKEN is not set")
+async def handle_db_overloaded(update, error: DBOverloaded) -> bool:
+    """Очередь БД заполнена: отвечаем сразу, состояние формы не трогаем — действие можно повторить"""
+    logging.warning("Запрос отклонён: %s", error)
+    query = update.callback_query
+    if query is not None:
+        # Без ответа на нажатие у пользователя крутятся «часики» на кнопке до таймаута Telegram
+        try:
+            await query.answer(DB_BUSY_TEXT, show_alert=True)
+            return True
+        except Exception as e:
+            logging.warning("Не удалось ответить на нажатие о перегрузке: %s", e)
+    message = update.message or (query and query.message)
+    if message is not None:
+        try:
+            await message.answer(DB_BUSY_TEXT)
+        except Exception as e:
+            logging.warning("Не удалось ответить о перегрузке: %s", e)
+    return True
+
+
+def status_change_text(change: StatusChange) -> str:
+    status = STATUS_DISPLAY.get(change.status, change.status)
+    lines = [f"🔔 Статус вашей заявки №{change.request_id} изменился: {status}"]
+    if change.status == "processed" and change.processed_departments:
+        lines.append("✅ Доступ выдан: " + ", ".join(change.processed_departments))
+    lines.append("")
+    lines.append("Подробнее — /status")
+    return "\n".join(lines)
+
+
+async def send_status_notifications(bot: Bot, changes: List[StatusChange]) -> None:
+    """Разослать пачку уведомлений. Идут с низким приоритетом и не задерживают ответы на команды"""
+    async def send(change: StatusChange) -> None:
+        # Кэш заявок этого воркера мог запомнить старый статус
+        invalidate_latest_request(change.telegram_id)
+        try:
+            await bot.send_message(change.telegram_id, status_change_text(change))
+        except Exception as e:
+            logging.warning("Не удалось уведомить %s о заявке №%s: %s", change.telegram_id, change.request_id, e)
+
+    with bulk():
+        await asyncio.gather(*(send(change) for change in changes))
+    logging.info("Отправлено уведомлений о смене статуса: %s", len(changes))
 
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+BROADCAST_USAGE = (
+    "📣 Рассылка: /broadcast <аудитория> <текст>\n"
+    "Аудитории: all — все пользователи с Telegram, pending — у кого есть незавершённая заявка."
+)
+
+
+def broadcast_report_text(state: Dict[str, object]) -> str:
+    report = report_stats(state)
+    if state.get("status") == "failed":
+        title = (f"⚠️ Рассылка «{state['audience']}» прервана: не удалось прочитать получателей "
+                 f"после id {state['last_id']} ({state['error']})")
+    else:
+        title = f"📣 Рассылка «{state['audience']}» завершена"
+    return (
+        f"{title}\n"
+        f"Всего: {report['total']}\n"
+        f"✅ Доставлено: {report['sent']}\n"
+        f"🚫 Недоступны (бот заблокирован, чат удалён): {report['unreachable']}\n"
+        f"❌ Ошибки: {report['failed']}\n"
+        f"⏱ {report['elapsed']} с, {report['per_second']} сообщ./с"
     )
 
-    bot = Bot(token=token)
-    storage = MemoryStorage()
+
+async def send_broadcast_message(bot: Bot, telegram_id: str, text: str) -> None:
+    # Низкий приоритет: ответы пользователям не ждут окончания рассылки
+    with bulk():
+        await bot.send_message(telegram_id, text)
+
+
+async def send_broadcast_report(bot: Bot, state: Dict[str, object]) -> None:
+    try:
+        await bot.send_message(state["admin_id"], broadcast_report_text(state))
+    except Exception as e:
+        logging.warning("Не удалось отправить отчёт о рассылке: %s", e)
+
+
+async def cmd_broadcast(message: Message) -> None:
+    admin_id = str(message.from_user.id)
+    logging.info("Команда /broadcast от пользователя %s", admin_id)
+    if admin_id not in BROADCAST_ADMIN_IDS:
+        await message.answer("⛔ Команда доступна только администраторам.")
+        return
+
+    audience, _, text = message.get_args().partition(" ")
+    text = text.strip()
+    if audience not in AUDIENCES or not text:
+        progress = broadcaster.progress()
+        if progress:
+            await message.answer(
+                f"⏳ Идёт рассылка «{progress['audience']}»: доставлено {progress['sent']}, "
+                f"недоступны {progress['unreachable']}, ошибки {progress['failed']}."
+            )
+        else:
+            await message.answer(BROADCAST_USAGE)
+        return
+
+    try:
+        broadcaster.start(audience, text, admin_id, partial(send_broadcast_message, message.bot),
+                          partial(send_broadcast_report, message.bot))
+    except BroadcastBusy:
+        await message.answer("⏳ Предыдущая рассылка ещё не завершена.")
+        return
+    await message.answer("📣 Рассылка запущена. Отчёт придёт по её завершении.")
+
+
+def create_storage(kind: str = FSM_STORAGE):
+    if kind == "sqlite":
+        return SQLiteStorage(FSM_SQLITE_PATH, ttl=FSM_STATE_TTL)
+    if kind == "redis":
+        from aiogram.contrib.fsm_storage.redis import RedisStorage2  # требует пакет aioredis
+        return RedisStorage2(FSM_REDIS_HOST, FSM_REDIS_PORT, db=FSM_REDIS_DB,
+                             state_ttl=int(FSM_STATE_TTL), data_ttl=int(FSM_STATE_TTL))
+    if kind == "memory":
+        return MemoryStorage()
+    raise RuntimeError(f"Неизвестный FSM_STORAGE: {kind}")
+
+
+async def warm_up(bot: Bot) -> None:
+    """WARM_START=off: ничего не открываем заранее — пул и справочник загрузятся при первом обращении"""
+    if WARM_START != "on":
+        logging.info("База данных: бэкенд %s, тёплый запуск отключён", db.name)
+        return
+    async with startup_timer.phase("db_pool"):
+        await db.start()
+    logging.info("База данных: бэкенд %s, соединений открыто: %s", db.name, db.stats().get('size', 0))
+    async with startup_timer.phase("catalog"):
+        await department_catalog.get()
+    departments = department_catalog.peek()
+    if departments is not None:
+        # Постоянные клавиатуры собраны при импорте; здесь — страницы выбора отделов без отметок
+        async with startup_timer.phase("keyboards"):
+            for page in range(department_pages(departments.items)):
+                cached_departments_keyboard(departments, (), page)
+    async with startup_timer.phase("bot_api"):
+        # Сессия и соединение с Bot API открываются до первого ответа пользователю
+        await bot.get_me()
+
+
+async def start_metrics_server(dp: Dispatcher) -> None:
+    port = dp.get("metrics_port", METRICS_PORT)
+    if not port:
+        return
+    try:
+        dp["metrics_runner"] = await serve_metrics(metrics_registry, METRICS_HOST, port, METRICS_PATH)
+    except OSError as e:
+        # Без метрик бот работает; занятый порт не должен мешать запуску
+        logging.warning("Сервер метрик не запущен на %s:%s: %s", METRICS_HOST, port, e)
+        return
+    logging.info("Метрики: http://%s:%s%s", METRICS_HOST, port, METRICS_PATH)
+
+
+async def on_startup(dp: Dispatcher) -> None:
+    await start_metrics_server(dp)
+    if isinstance(dp.storage, SQLiteStorage):
+        dp.storage.start_cleanup()
+    await warm_up(dp.bot)
+    department_catalog.start()
+    if dp.get("primary", True):
+        if QUERY_PLAN_CHECK == "warn":
+            async with startup_timer.phase("query_plans"):
+                await warn_about_query_plans()
+        if STATUS_WATCH_INTERVAL > 0:
+            status_watcher.start(partial(send_status_notifications, dp.bot))
+        broadcaster.resume(partial(send_broadcast_message, dp.bot), partial(send_broadcast_report, dp.bot))
+    logging.info("Запуск за %s", startup_timer.report())
+
+
+async def process_backlog(dp: Dispatcher) -> None:
+    """STARTUP_BACKLOG=process в режиме polling: накопившиеся апдейты — с ограниченной скоростью"""
+    async with startup_timer.phase("backlog"):
+        await dp.bot.delete_webhook()
+        stats = await drain_backlog(dp, rate=STARTUP_BACKLOG_RATE)
+        logging.info("Накопившиеся апдейты разобраны: %s", stats)
+
+
+async def on_shutdown(dp: Dispatcher) -> None:
+    if dp.get("metrics_runner"):
+        await dp["metrics_runner"].cleanup()
+    await status_watcher.stop()
+    await broadcaster.stop()
+    await edit_coalescer.close()
+    logging.info("Статистика пула БД: %s", db.stats())
+    logging.info("Кэш справочника отделов: %s", department_catalog.stats())
+    logging.info("Кэш заявок: %s", request_cache.stats())
+    logging.info("Склейка чтений БД: %s, записей: %s, очередь записей пользователей: %s",
+                 db_reads.stats(), db_writes.stats(), user_write_locks.stats())
+    logging.info("Очередь отправки: %s", send_scheduler.stats())
+    logging.info("Запросы к Bot API по обработчикам: %s", api_call_stats.stats())
+    logging.info("Склейка правок выбора отделов: %s", edit_coalescer.stats())
+    logging.info("Уведомления о статусах: %s", status_watcher.stats())
+    logging.info("Журнал: %s", log_pipeline.stats())
+    await department_catalog.stop()
+    await send_scheduler.close()
+    await db.close()
+
+
+# Фазы запуска процесса и их длительность — в журнал и в метрики
+startup_timer = StartupTimer()
+send_scheduler = SendScheduler(
+    global_rate=SEND_GLOBAL_RATE,
+    chat_rate=SEND_CHAT_RATE,
+    chat_burst=SEND_CHAT_BURST,
+    group_rate=SEND_GROUP_RATE,
+)
+# Число запросов к Bot API по обработчикам — видно, во что обходится каждое действие
+api_call_stats = ApiCallStats()
+status_watcher = StatusWatcher(
+    lambda query, args: db.fetch_all(query, args),
+    state_path=STATUS_WATCH_STATE_PATH,
+    interval=STATUS_WATCH_INTERVAL,
+    batch_size=STATUS_WATCH_BATCH,
+)
+broadcaster = Broadcaster(
+    lambda query, args, chunk_size: db.iter_rows(query, args, chunk_size),
+    state_path=BROADCAST_STATE_PATH,
+    concurrency=BROADCAST_CONCURRENCY,
+    page_size=BROADCAST_PAGE_SIZE,
+)
+
+
+def _api_requests_by_method() -> Dict[Tuple[str, ...], int]:
+    totals: Dict[Tuple[str, ...], int] = {}
+    for (_, method), count in api_call_stats.calls.items():
+        totals[(method,)] = totals.get((method,), 0) + count
+    return totals
+
+
+metrics_registry.gauge("bot_db_pool_connections", "Соединения пула БД", ["state"],
+                       lambda: {(state,): db.stats().get(state, 0) for state in ("idle", "in_use")})
+metrics_registry.gauge("bot_db_pool_max_size", "Предельный размер пула БД", (), lambda: db.stats().get("max_size", 0))
+metrics_registry.gauge("bot_db_executor_queue", "Вызовы БД, ждущие свободного потока или соединения", (),
+                       lambda: db.stats().get("queued", 0))
+metrics_registry.counter_func("bot_db_rejected_total", "Вызовы БД, отклонённые из-за заполненной очереди", (),
+                              lambda: db.stats().get("rejected", 0))
+metrics_registry.gauge("bot_startup_phase_seconds", "Длительность фаз запуска процесса", ["phase"],
+                       startup_timer.seconds)
+fsm_records = metrics_registry.gauge("bot_fsm_records", "Записей в хранилище состояний FSM")
+metrics_registry.gauge("bot_send_queue", "Отправки в очереди к Bot API", ["stage"],
+                       lambda: {(stage,): send_scheduler.stats()[stage] for stage in ("queued", "waiting_global")})
+metrics_registry.counter_func("bot_send_retries_total", "Повторы отправки после RetryAfter", (),
+                              lambda: send_scheduler.retries)
+metrics_registry.counter_func("bot_api_requests_total", "Запросы к Bot API", ["method"], _api_requests_by_method)
+metrics_registry.counter_func("bot_api_errors_total", "Ошибки запросов к Bot API", ["method", "error"],
+                              lambda: dict(api_call_stats.errors))
+
+
+def fsm_storage_records(storage) -> Dict[Tuple[str, ...], int]:
+    if isinstance(storage, SQLiteStorage):
+        return {(): storage.stats()["records"]}
+    if isinstance(storage, MemoryStorage):
+        return {(): sum(len(users) for users in storage.data.values())}
+    # Размер внешнего хранилища (Redis) смотрится его собственными средствами
+    return {}
+
+
+def create_bot(token: str) -> Bot:
+    # Все ответы, правки и уведомления проходят через send_scheduler
+    if TELEGRAM_API_URL:
+        return ScheduledBot(token=token, server=TelegramAPIServer.from_base(TELEGRAM_API_URL),
+                            scheduler=send_scheduler, api_stats=api_call_stats)
+    return ScheduledBot(token=token, scheduler=send_scheduler, api_stats=api_call_stats)
+
+
+def create_dispatcher(bot: Bot, storage) -> Dispatcher:
     dp = Dispatcher(bot, storage=storage)
+    dp.middleware.setup(CorrelationMiddleware())
+    dp.middleware.setup(api_call_stats.middleware())
+    dp.middleware.setup(HandlerMetrics(handler_duration, handler_errors))
+    fsm_records.collect = partial(fsm_storage_records, storage)
 
     logging.info("Регистрация обработчиков команд...")
 
@@ -782,6 +1755,9 @@ def main() -> None:
     dp.register_message_handler(cmd_status, commands=["status"], state="*")
     logging.info("✓ Зарегистрирована команда /status")
 
+    dp.register_message_handler(cmd_broadcast, commands=["broadcast"], state="*")
+    logging.info("✓ Зарегистрирована команда /broadcast")
+
     # Обработчики callback запросов
     dp.register_callback_query_handler(handle_additional_decision,
                                        lambda c: c.data in {"additional_yes", "additional_no"}, state="*")
@@ -789,23 +1765,193 @@ def main() -> None:
                                        state="*")
     dp.register_callback_query_handler(handle_region_selection, lambda c: c.data.startswith("region_"), state="*")
     dp.register_callback_query_handler(handle_department_selection, lambda c: c.data.startswith("dept_"), state="*")
+    dp.register_callback_query_handler(handle_department_page, lambda c: c.data.startswith("deptpage_"), state="*")
     dp.register_callback_query_handler(handle_departments_confirm, text="confirm_departments", state="*")
     dp.register_callback_query_handler(handle_departments_reset, text="reset_departments", state="*")
     dp.register_callback_query_handler(handle_back, text="back", state="*")
 
+    dp.register_errors_handler(handle_db_overloaded, exception=DBOverloaded)
+
     # Обработчики состояний (должны быть после команд)
     dp.register_message_handler(process_first_name, state=InviteRequestForm.waiting_first_name)
     dp.register_message_handler(process_last_name, state=InviteRequestForm.waiting_last_name)
     dp.register_message_handler(process_middle_name, state=InviteRequestForm.waiting_middle_name)
     # process_region и process_departments удалены - теперь используются инлайн кнопки
 
+    return dp
+
+
+def setup_logging() -> None:
+    log_pipeline.setup(level=LOG_LEVEL, fmt=LOG_FORMAT, path=LOG_FILE, queue_size=LOG_QUEUE_SIZE,
+                       sampled=("bot.flow",), sample_rate=LOG_SAMPLE_RATE)
+
+
+def run_worker(host: str, port: int, secret: str, primary: bool = True, metrics_port: int = METRICS_PORT) -> None:
+    """Воркер: принимает апдейты от фронта на своём вебхуке, вебхук в Telegram не ставит.
+
+    Фоновые задачи (уведомления о статусах, продолжение прерванной рассылки)
+    выполняет только основной воркер.
+    """
+    setup_logging()
+    dp = create_dispatcher(create_bot(API_TOKEN), create_storage())
+    dp["primary"] = primary
+    dp["metrics_port"] = metrics_port
+    worker_executor = executor.Executor(dp)
+    worker_executor.on_startup(on_startup)
+    worker_executor.on_shutdown(on_shutdown)
+    worker_executor.set_webhook(
+        webhook_path=WEBHOOK_PATH,
+        request_handler=FastAckWebhookHandler,
+        web_app=create_webhook_app(secret),
+    )
+    logging.info("Воркер слушает %s:%s%s", host, port, WEBHOOK_PATH)
+    try:
+        worker_executor.run_app(host=host, port=port, print=None)
+    finally:
+        # Дочерний процесс завершается без atexit — дописываем очередь журнала сами
+        log_pipeline.stop()
+
+
+def start_local_workers(count: int, secret: str, *, base_port: int = WORKER_BASE_PORT,
+                        target: Callable[[str, int, str, bool, int], None] = run_worker,
+                        ) -> Tuple[List[str], List[multiprocessing.Process]]:
+    context = multiprocessing.get_context("spawn")
+    urls, processes = [], []
+    for index in range(count):
+        port = base_port + index
+        metrics_port = METRICS_PORT + 1 + index if METRICS_PORT else 0
+        process = context.Process(target=target, args=("127.0.0.1", port, secret, index == 0, metrics_port),
+                                  name=f"bot-worker-{index}", daemon=True)
+        process.start()
+        urls.append(f"http://127.0.0.1:{port}{WEBHOOK_PATH}")
+        processes.append(process)
+    return urls, processes
+
+
+def run_front(token: str) -> None:
+    """Фронт: сам апдейты не обрабатывает, а раздаёт их воркерам по id чата"""
+    if FSM_STORAGE == "memory":
+        logging.warning("FSM_STORAGE=memory: при смене числа воркеров анкеты в процессе заполнения потеряются")
+    worker_secret = WORKER_SECRET or secrets.token_urlsafe(32)
+    processes: List[multiprocessing.Process] = []
+    if BOT_WORKER_URLS:
+        if not WORKER_SECRET:
+            raise RuntimeError("WORKER_SECRET is not set")
+        worker_urls = BOT_WORKER_URLS
+    else:
+        # Лимит Telegram общий на токен, поэтому каждому воркеру — его доля
+        os.environ["SEND_GLOBAL_RATE"] = str(SEND_GLOBAL_RATE / BOT_WORKERS)
+        worker_urls, processes = start_local_workers(BOT_WORKERS, worker_secret)
+    logging.info("Воркеров: %s", len(worker_urls))
+
+    router = ShardRouter(worker_urls, worker_secret)
+    bot = create_bot(token)
+    try:
+        if BOT_MODE == "webhook":
+            if not WEBHOOK_URL:
+                raise RuntimeError("WEBHOOK_URL is not set")
+            secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+            app = create_router_app(router, WEBHOOK_PATH, secret)
+
+            async def on_startup_front(app) -> None:
+                await router.wait_ready()
+                await bot.set_webhook(WEBHOOK_URL, secret_token=secret,
+                                      drop_pending_updates=STARTUP_BACKLOG != "process")
+                logging.info("Вебхук установлен: %s", WEBHOOK_URL)
+
+            async def on_cleanup_front(app) -> None:
+                await (await bot.get_session()).close()
+
+            app.on_startup.append(on_startup_front)
+            app.on_cleanup.append(on_cleanup_front)
+            web.run_app(app, host=WEBAPP_HOST, port=WEBAPP_PORT, print=None)
+        else:
+            async def poll() -> None:
+                await router.wait_ready()
+                await bot.delete_webhook(drop_pending_updates=STARTUP_BACKLOG != "process")
+                try:
+                    await poll_to_router(bot, router, backlog_rate=STARTUP_BACKLOG_RATE
+                                         if STARTUP_BACKLOG == "process" else 0.0)
+                finally:
+                    logging.info("Статистика распределения апдейтов: %s", router.stats())
+                    await router.close()
+                    await (await bot.get_session()).close()
+
+            try:
+                asyncio.run(poll())
+            except KeyboardInterrupt:
+                pass
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(10)
+
+
+def main() -> None:
+    token = API_TOKEN
+    if not token:
+        raise RuntimeError("TELEGRAM_BOT_TOKEN is not set")
+
+    setup_logging()
+    try:
+        run_bot(token)
+    finally:
+        log_pipeline.stop()
+
+
+def run_bot(token: str) -> None:
+    if BOT_MODE == "worker":
+        if not WORKER_SECRET:
+            raise RuntimeError("WORKER_SECRET is not set")
+        run_worker(WEBAPP_HOST, WEBAPP_PORT, WORKER_SECRET)
+        return
+    if BOT_WORKERS > 1 or BOT_WORKER_URLS:
+        run_front(token)
+        return
+
+    bot = create_bot(token)
+    storage = create_storage()
+    dp = create_dispatcher(bot, storage)
+
     logging.info("=" * 60)
     logging.info("🚀 БОТ ЗАПУЩЕН И ГОТОВ К РАБОТЕ")
     logging.info("=" * 60)
-    logging.info(f"Доступные команды: /start, /help, /post_invate, /status")
+    logging.info("Доступные команды: /start, /help, /post_invate, /status")
+    logging.info("Режим получения обновлений: %s", BOT_MODE)
     logging.info("=" * 60)
 
-    executor.start_polling(dp, skip_updates=True)
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL:
+            raise RuntimeError("WEBHOOK_URL is not set")
+        # Без заданного секрета генерируем новый при каждом запуске — он же передаётся в setWebhook
+        secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+
+        async def on_startup_webhook(dp: Dispatcher) -> None:
+            await on_startup(dp)
+            await dp.bot.set_webhook(WEBHOOK_URL, secret_token=secret,
+                                     drop_pending_updates=STARTUP_BACKLOG != "process")
+            logging.info("Вебхук установлен: %s", WEBHOOK_URL)
+
+        webhook_executor = executor.Executor(dp)
+        webhook_executor.on_startup(on_startup_webhook)
+        webhook_executor.on_shutdown(on_shutdown)
+        webhook_executor.set_webhook(
+            webhook_path=WEBHOOK_PATH,
+            request_handler=FastAckWebhookHandler,
+            web_app=create_webhook_app(secret),
+        )
+        webhook_executor.run_app(host=WEBAPP_HOST, port=WEBAPP_PORT)
+    elif BOT_MODE == "polling":
+        async def on_startup_polling(dp: Dispatcher) -> None:
+            await on_startup(dp)
+            if STARTUP_BACKLOG == "process":
+                await process_backlog(dp)
+
+        executor.start_polling(dp, skip_updates=STARTUP_BACKLOG != "process", on_startup=on_startup_polling,
+                               on_shutdown=on_shutdown)
+    else:
+        raise RuntimeError(f"Неизвестный BOT_MODE: {BOT_MODE}")
 
 
 if __name__ == "__main__":
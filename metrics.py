@@ -0,0 +1,245 @@
+"""Метрики бота в текстовом формате Prometheus.
+
+Счётчики и гистограммы обновляются в коде бота (в том числе из потоков
+пула БД), значения вида «сколько сейчас» снимаются функциями в момент
+запроса /metrics. Зависимостей, кроме aiohttp, нет.
+"""
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from aiohttp import web
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Границы корзин в секундах: от быстрого ответа из кэша до медленного запроса к БД
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [число наблюдений по корзинам (последняя — +Inf), сумма]
+        self._values: Dict[Labels, List[object]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def time(self, *labels: str) -> "_Timer":
+        return _Timer(self, labels)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: Labels) -> None:
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class GaugeFunc(_Metric):
+    """Значение снимается при каждом запросе метрик: число или {метки: число}"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 collect: Callable[[], Union[float, Dict[Labels, float]]] = lambda: 0) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def samples(self) -> Iterable[str]:
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class CounterFunc(GaugeFunc):
+    """Счётчик, который ведёт сам объект (статистика очереди, вызовов API), снимается при запросе"""
+
+    kind = "counter"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+              collect: Callable[[], Union[float, Dict[Labels, float]]] = lambda: 0) -> GaugeFunc:
+        return self.register(GaugeFunc(name, documentation, labelnames, collect))
+
+    def counter_func(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                     collect: Callable[[], Union[float, Dict[Labels, float]]] = lambda: 0) -> CounterFunc:
+        return self.register(CounterFunc(name, documentation, labelnames, collect))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+
+def timed(histogram: Histogram, *labels: str) -> Callable:
+    """Декоратор: время выполнения функции (обычной или async) в гистограмму"""
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with histogram.time(*labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with histogram.time(*labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class HandlerMetrics(BaseMiddleware):
+    """Время работы обработчиков сообщений и нажатий, ошибки обработчиков"""
+
+    def __init__(self, durations: Histogram, errors: Optional[Counter] = None) -> None:
+        super().__init__()
+        self.durations = durations
+        self.errors = errors
+
+    @staticmethod
+    def _start(data: dict) -> None:
+        data["metrics_handler"] = current_handler.get().__name__
+        data["metrics_started"] = time.perf_counter()
+
+    def _finish(self, data: dict) -> None:
+        if "metrics_handler" in data:
+            self.durations.observe(time.perf_counter() - data["metrics_started"], data["metrics_handler"])
+
+    async def on_process_message(self, message, data: dict) -> None:
+        self._start(data)
+
+    async def on_process_callback_query(self, query, data: dict) -> None:
+        self._start(data)
+
+    async def on_post_process_message(self, message, results, data: dict) -> None:
+        self._finish(data)
+
+    async def on_post_process_callback_query(self, query, results, data: dict) -> None:
+        self._finish(data)
+
+    async def on_pre_process_error(self, update, error, data: dict) -> None:
+        if self.errors is not None:
+            self.errors.inc(type(error).__name__)
+
+
+async def serve(registry: Registry, host: str, port: int, path: str = "/metrics") -> web.AppRunner:
+    """Отдельный HTTP-сервер метрик, не на публичном порту вебхука"""
+    app = web.Application()
+    app.router.add_get(path, registry.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
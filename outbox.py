@@ -0,0 +1,386 @@
+"""Очередь исходящих вызовов Bot API с учётом лимитов Telegram.
+
+Все отправки и правки сообщений проходят через SendScheduler: общий лимит
+бота (около 30 сообщений в секунду), лимит на чат (около 1 в секунду, в
+группах — 20 в минуту) и паузы по RetryAfter. Ответы пользователям идут
+вперёд массовых рассылок: рассылка оборачивается в `with bulk():`.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Deque, Dict, Hashable, Iterator, List, Optional, Tuple, TypeVar, Union
+
+from aiogram import Bot
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.utils.exceptions import RetryAfter
+
+T = TypeVar("T")
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+_priority: ContextVar[int] = ContextVar("send_priority", default=PRIORITY_INTERACTIVE)
+_flushing: ContextVar[bool] = ContextVar("edit_flushing", default=False)
+
+# Методы, на которые распространяются лимиты отправки
+_LIMITED_PREFIXES = ("send", "edit", "copy", "forward")
+
+
+@contextmanager
+def bulk() -> Iterator[None]:
+    """Отправки внутри блока уступают очередь ответам пользователям"""
+    token = _priority.set(PRIORITY_BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """Корзина токенов с резервированием: токен можно взять «в долг»,
+    reserve() возвращает, сколько ждать до его появления."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        self._refill(time.monotonic())
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def reserve(self) -> float:
+        self._refill(time.monotonic())
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def pause(self, seconds: float) -> None:
+        """Следующий токен появится не раньше, чем через seconds"""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+def _chat_key(chat_id: Union[int, str]) -> Union[int, str]:
+    """Один ключ для id чата числом и строкой: наблюдатель статусов и рассылка передают строку"""
+    if isinstance(chat_id, str) and chat_id.lstrip("-").isdigit():
+        return int(chat_id)
+    return chat_id
+
+
+class SendScheduler:
+    """Планировщик исходящих вызовов: лимиты на бота и на чат, приоритеты, RetryAfter.
+
+    Вызовы одного чата выполняются в порядке постановки; общий лимит раздаётся
+    по приоритету, внутри приоритета — по очереди. Лимит с rate <= 0 отключён.
+    """
+
+    def __init__(self, *, global_rate: float = 25.0, chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 group_rate: float = 20 / 60, max_retries: int = 3, max_chats: int = 10000) -> None:
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+
+        # Небольшой запас на всплеск: за любую секунду уходит не больше 1.2 * global_rate
+        self._global = TokenBucket(global_rate, max(1.0, global_rate / 5)) if global_rate > 0 else None
+        self._chats: Dict[Union[int, str], TokenBucket] = {}
+        self._waiting: List[Tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+        self.queued = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.sent_by_priority = [0, 0]
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._latencies: Deque[float] = deque(maxlen=1000)
+
+    async def submit(self, chat_id: Union[int, str, None], call: Callable[[], Awaitable[T]],
+                     priority: Optional[int] = None) -> T:
+        """Выполнить вызов Bot API, когда это позволят лимиты"""
+        if priority is None:
+            priority = _priority.get()
+        if priority not in (PRIORITY_INTERACTIVE, PRIORITY_BULK):
+            raise ValueError("Неизвестный приоритет отправки: %r" % (priority,))
+        started = time.monotonic()
+        self.queued += 1
+        try:
+            for attempt in range(self.max_retries + 1):
+                bucket = self._chat_bucket(chat_id)
+                if bucket is not None:
+                    delay = bucket.reserve()
+                    if delay:
+                        await asyncio.sleep(delay)
+                await self._global_slot(priority)
+                if attempt == 0:
+                    waited = time.monotonic() - started
+                    self.wait_total += waited
+                    self.wait_max = max(self.wait_max, waited)
+                try:
+                    result = await call()
+                except RetryAfter as e:
+                    self.retries += 1
+                    logging.warning("Telegram просит подождать %s с (чат %s)", e.timeout, chat_id)
+                    # Пауза и для чата, и для всего бота: по ответу не отличить, какой лимит превышен
+                    if bucket is not None:
+                        bucket.pause(e.timeout)
+                    if self._global is not None:
+                        self._global.pause(e.timeout)
+                    if attempt == self.max_retries:
+                        self.failed += 1
+                        raise
+                    continue
+                except Exception:
+                    self.failed += 1
+                    raise
+                self.sent += 1
+                self.sent_by_priority[priority] += 1
+                self._latencies.append(time.monotonic() - started)
+                return result
+        finally:
+            self.queued -= 1
+
+    async def close(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+
+    def stats(self) -> Dict[str, object]:
+        latencies = sorted(self._latencies)
+
+        def pct(value: float) -> float:
+            return round(latencies[min(len(latencies) - 1, int(value * len(latencies)))], 4) if latencies else 0.0
+
+        return {
+            "queued": self.queued,
+            "waiting_global": len(self._waiting),
+            "sent": self.sent,
+            "sent_interactive": self.sent_by_priority[PRIORITY_INTERACTIVE],
+            "sent_bulk": self.sent_by_priority[PRIORITY_BULK],
+            "retries": self.retries,
+            "failed": self.failed,
+            "wait_avg": round(self.wait_total / self.sent, 4) if self.sent else 0.0,
+            "wait_max": round(self.wait_max, 4),
+            "latency_p50": pct(0.50),
+            "latency_p95": pct(0.95),
+            "latency_p99": pct(0.99),
+            "chats": len(self._chats),
+        }
+
+    # --- внутреннее ---
+
+    def _chat_bucket(self, chat_id: Union[int, str, None]) -> Optional[TokenBucket]:
+        if chat_id is None:
+            return None
+        chat_id = _chat_key(chat_id)
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательные id и @username — группы и каналы, у них лимит строже
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            rate = self.group_rate if is_group else self.chat_rate
+            if rate <= 0:
+                return None
+            if len(self._chats) >= self.max_chats:
+                self._chats = {key: b for key, b in self._chats.items() if not b.idle()}
+            bucket = self._chats[chat_id] = TokenBucket(rate, 1 if is_group else self.chat_burst)
+        return bucket
+
+    async def _global_slot(self, priority: int) -> None:
+        if self._global is None:
+            return
+        if self._dispatcher is None:
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._order), future))
+        self._wakeup.set()
+        await future
+
+    async def _dispatch(self) -> None:
+        while True:
+            if not self._waiting:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = self._global.delay()
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiting)
+            if future.cancelled():
+                continue
+            self._global.reserve()
+            future.set_result(None)
+
+
+class EditCoalescer:
+    """Склейка частых правок одного сообщения в одну.
+
+    submit() откладывает правку до паузы длиной delay (но не дольше max_delay
+    от первой отложенной); новая правка того же сообщения заменяет ожидающую.
+    settle() отменяет ожидающую правку и дожидается выполняемой — её вызывают
+    перед любой другой правкой сообщения, чтобы отложенная не затёрла новую.
+    """
+
+    def __init__(self, delay: float = 0.4, max_delay: float = 1.5) -> None:
+        self.delay = delay
+        self.max_delay = max_delay
+        self._pending: Dict[Hashable, Tuple[asyncio.TimerHandle, float, Callable[[], Awaitable[object]]]] = {}
+        self._running: Dict[Hashable, asyncio.Task] = {}
+        self.submitted = 0
+        self.flushed = 0
+
+    async def submit(self, key: Hashable, call: Callable[[], Awaitable[object]]) -> None:
+        self.submitted += 1
+        if self.delay <= 0:
+            self.flushed += 1
+            await call()
+            return
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        first = now
+        pending = self._pending.pop(key, None)
+        if pending is not None:
+            pending[0].cancel()
+            first = pending[1]
+        when = min(now + self.delay, first + self.max_delay)
+        handle = loop.call_at(when, self._flush, key)
+        self._pending[key] = (handle, first, call)
+
+    async def settle(self, key: Hashable) -> None:
+        if _flushing.get():
+            # Правку выполняет сама отложенная задача — новые отложенные не трогаем
+            return
+        running = self._running.get(key)
+        pending = self._pending.pop(key, None)
+        if pending is not None:
+            pending[0].cancel()
+        if running is not None:
+            await asyncio.gather(running, return_exceptions=True)
+
+    async def close(self) -> None:
+        """Выполнить все отложенные правки"""
+        for key in list(self._pending):
+            self._pending[key][0].cancel()
+            self._flush(key)
+        if self._running:
+            await asyncio.gather(*self._running.values(), return_exceptions=True)
+
+    def stats(self) -> Dict[str, object]:
+        return {"submitted": self.submitted, "flushed": self.flushed,
+                "coalesced": self.submitted - self.flushed - len(self._pending), "pending": len(self._pending)}
+
+    def _flush(self, key: Hashable) -> None:
+        _, _, call = self._pending.pop(key)
+        self.flushed += 1
+        task = asyncio.ensure_future(self._run(key, call, self._running.get(key)))
+        self._running[key] = task
+
+    async def _run(self, key: Hashable, call: Callable[[], Awaitable[object]],
+                   previous: Optional[asyncio.Task]) -> None:
+        _flushing.set(True)
+        try:
+            if previous is not None:
+                await asyncio.gather(previous, return_exceptions=True)
+            await call()
+        except Exception as e:
+            logging.warning("Не удалось выполнить отложенную правку %s: %s", key, e)
+        finally:
+            if self._running.get(key) is asyncio.current_task():
+                del self._running[key]
+
+
+def _handler_name() -> str:
+    handler = current_handler.get(None)
+    return getattr(handler, "__name__", "-") if handler is not None else "-"
+
+
+class ApiCallStats:
+    """Сколько запросов к Bot API делает каждый обработчик на одно действие пользователя"""
+
+    def __init__(self) -> None:
+        self.invocations: Counter = Counter()
+        self.calls: Counter = Counter()
+        # (метод, класс исключения) -> число ошибок
+        self.errors: Counter = Counter()
+
+    def record_call(self, method: str) -> None:
+        self.calls[(_handler_name(), method)] += 1
+
+    def record_error(self, method: str, error: Exception) -> None:
+        self.errors[(method, type(error).__name__)] += 1
+
+    def middleware(self) -> BaseMiddleware:
+        stats = self
+
+        class CountHandlers(BaseMiddleware):
+            async def on_process_message(self, message, data) -> None:
+                stats.invocations[_handler_name()] += 1
+
+            async def on_process_callback_query(self, query, data) -> None:
+                stats.invocations[_handler_name()] += 1
+
+        return CountHandlers()
+
+    def reset(self) -> None:
+        self.invocations.clear()
+        self.calls.clear()
+        self.errors.clear()
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        result: Dict[str, Dict[str, object]] = {}
+        for (handler, method), count in sorted(self.calls.items()):
+            entry = result.setdefault(handler, {"invocations": self.invocations.get(handler, 0), "calls": 0, "methods": {}})
+            entry["calls"] += count
+            entry["methods"][method] = count
+        for handler, entry in result.items():
+            if entry["invocations"]:
+                entry["calls_per_invocation"] = round(entry["calls"] / entry["invocations"], 2)
+        return result
+
+
+class ScheduledBot(Bot):
+    """Bot, у которого отправки и правки сообщений идут через SendScheduler"""
+
+    def __init__(self, *args, scheduler: SendScheduler, api_stats: Optional[ApiCallStats] = None, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.scheduler = scheduler
+        self.api_stats = api_stats
+
+    async def request(self, method: str, data: Optional[Dict] = None, files: Optional[Dict] = None, **kwargs):
+        if self.api_stats is None:
+            return await self._request(method, data, files, **kwargs)
+        self.api_stats.record_call(method)
+        try:
+            return await self._request(method, data, files, **kwargs)
+        except Exception as e:
+            self.api_stats.record_error(method, e)
+            raise
+
+    async def _request(self, method: str, data: Optional[Dict], files: Optional[Dict], **kwargs):
+        send = super().request
+        if not method.startswith(_LIMITED_PREFIXES):
+            return await send(method, data, files, **kwargs)
+        chat_id = (data or {}).get("chat_id")
+        return await self.scheduler.submit(chat_id, lambda: send(method, data, files, **kwargs))
@@ -0,0 +1,191 @@
+"""Проверка планов запросов бота и рекомендации по индексам.
+
+Для каждого запроса бота выполняется EXPLAIN и отмечаются полные проходы по
+таблицам и индексам, сортировки filesort и временные таблицы. Отдельно
+проверяется, есть ли в БД индексы, на которые рассчитаны горячие запросы,
+и не обёрнуты ли столбцы условий в функции (LOWER(name) = ... индекс не
+использует). Для всего найденного печатается готовый DDL.
+
+Работает с обычным курсором pymysql (DictCursor): из test_db_connection.py
+и из main.py при старте с QUERY_PLAN_CHECK=warn.
+"""
+import re
+from typing import Dict, Iterable, List, NamedTuple, Sequence, Tuple
+
+# Полный проход по таблице меньше этого числа строк (справочник отделов) проблемой не считается
+SMALL_TABLE_ROWS = 1000
+
+
+class Statement(NamedTuple):
+    name: str
+    sql: str
+    args: Sequence[object]
+
+
+class PlanIssue(NamedTuple):
+    statement: str
+    table: str
+    kind: str
+    rows: int
+    detail: str
+
+
+class IndexAdvice(NamedTuple):
+    table: str
+    columns: Tuple[str, ...]
+    name: str
+    reason: str
+
+    @property
+    def ddl(self) -> str:
+        return f"CREATE INDEX {self.name} ON {self.table} ({', '.join(self.columns)});"
+
+
+# Индексы, на которые рассчитаны запросы бота. Достаточно индекса, который начинается с этих столбцов
+RECOMMENDED_INDEXES = [
+    IndexAdvice("s3app_userrequest", ("telegram_id", "created_at"), "s3app_userrequest_tg_created",
+                "последняя заявка пользователя: WHERE telegram_id = ? ORDER BY created_at DESC LIMIT 1"),
+    IndexAdvice("s3app_userrequest", ("processed_at",), "s3app_userrequest_processed_at",
+                "уведомления о статусах: водяная метка (processed_at, id)"),
+    IndexAdvice("s3app_userrequest", ("status",), "s3app_userrequest_status",
+                "незавершённые заявки при первом запуске наблюдателя статусов"),
+    IndexAdvice("s3app_user", ("telegram_id",), "s3app_user_telegram_id",
+                "профиль пользователя по telegram_id"),
+]
+
+_PROBLEM_EXTRA = {
+    "Using filesort": ("filesort", "сортировка без индекса"),
+    "Using temporary": ("temporary", "временная таблица"),
+}
+
+# Функция над столбцом слева от сравнения: LOWER(g.name) = ..., DATE(created_at) IN (...)
+_WRAPPED_COLUMN = re.compile(r"\b(LOWER|UPPER|TRIM|DATE|YEAR)\s*\(\s*((?:\w+\.)?\w+)\s*[,)]\s*(=|<|>|IN\b|LIKE\b)",
+                             re.IGNORECASE)
+_TABLE_ALIAS = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(?!(?:WHERE|JOIN|ON|LEFT|INNER|ORDER|GROUP|LIMIT|USING)\b)(\w+))?",
+                          re.IGNORECASE)
+
+
+def explain(cursor, statement: Statement, small_table_rows: int = SMALL_TABLE_ROWS) -> List[PlanIssue]:
+    """EXPLAIN одного запроса: полные проходы, filesort, временные таблицы"""
+    cursor.execute("EXPLAIN " + statement.sql, statement.args)
+    issues = []
+    for row in cursor.fetchall():
+        table = row.get("table") or "—"
+        rows = int(row.get("rows") or 0)
+        access = (row.get("type") or "").upper()
+        extra = row.get("Extra") or ""
+        if access in ("ALL", "INDEX") and rows < small_table_rows:
+            continue
+        if access == "ALL":
+            issues.append(PlanIssue(statement.name, table, "full_scan", rows, "полный проход по таблице"))
+        elif access == "INDEX":
+            issues.append(PlanIssue(statement.name, table, "full_index_scan", rows, "полный проход по индексу"))
+        for marker, (kind, detail) in _PROBLEM_EXTRA.items():
+            if marker in extra:
+                issues.append(PlanIssue(statement.name, table, kind, rows, detail))
+    return issues
+
+
+def _aliases(sql: str) -> Dict[str, str]:
+    aliases: Dict[str, str] = {}
+    for table, alias in _TABLE_ALIAS.findall(sql):
+        aliases[table] = table
+        if alias:
+            aliases[alias] = table
+    return aliases
+
+
+def wrapped_columns(statement: Statement) -> List[Tuple[str, str, str]]:
+    """Столбцы под функцией в условии: (функция, таблица, столбец)"""
+    aliases = _aliases(statement.sql)
+    tables = set(aliases.values())
+    found = []
+    for function, column, _ in _WRAPPED_COLUMN.findall(statement.sql):
+        alias, _, name = column.rpartition(".")
+        table = aliases.get(alias) if alias else (next(iter(tables)) if len(tables) == 1 else None)
+        if table:
+            found.append((function.upper(), table, name))
+    return found
+
+
+def generated_column_ddl(cursor, function: str, table: str, column: str) -> List[str]:
+    """Функциональный индекс (MySQL 8.0.13+) и вариант со сгенерированным столбцом для старых версий"""
+    cursor.execute(
+        "SELECT COLUMN_TYPE FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+        (table, column),
+    )
+    row = cursor.fetchone()
+    column_type = row["COLUMN_TYPE"] if row else "VARCHAR(255)"
+    generated = f"{column}_{function.lower()}"
+    return [
+        f"CREATE INDEX {table}_{generated} ON {table} (({function}({column})));",
+        f"ALTER TABLE {table} ADD COLUMN {generated} {column_type} GENERATED ALWAYS AS ({function}({column})) STORED, "
+        f"ADD INDEX {table}_{generated} ({generated});",
+    ]
+
+
+def existing_indexes(cursor, table: str) -> List[Tuple[str, ...]]:
+    cursor.execute(
+        "SELECT INDEX_NAME, COLUMN_NAME FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ORDER BY INDEX_NAME, SEQ_IN_INDEX",
+        (table,),
+    )
+    indexes: Dict[str, List[str]] = {}
+    for row in cursor.fetchall():
+        indexes.setdefault(row["INDEX_NAME"], []).append(row["COLUMN_NAME"].lower())
+    return [tuple(columns) for columns in indexes.values()]
+
+
+def missing_indexes(cursor, advice: Iterable[IndexAdvice] = RECOMMENDED_INDEXES) -> List[IndexAdvice]:
+    missing = []
+    cache: Dict[str, List[Tuple[str, ...]]] = {}
+    for item in advice:
+        if item.table not in cache:
+            cache[item.table] = existing_indexes(cursor, item.table)
+        wanted = tuple(column.lower() for column in item.columns)
+        if not any(columns[:len(wanted)] == wanted for columns in cache[item.table]):
+            missing.append(item)
+    return missing
+
+
+class PlanReport(NamedTuple):
+    issues: List[PlanIssue]
+    missing: List[IndexAdvice]
+    wrapped: List[Tuple[str, List[str]]]
+    errors: List[Tuple[str, str]]
+
+    @property
+    def ok(self) -> bool:
+        return not (self.issues or self.missing or self.wrapped or self.errors)
+
+
+def check(cursor, statements: Iterable[Statement], small_table_rows: int = SMALL_TABLE_ROWS) -> PlanReport:
+    issues: List[PlanIssue] = []
+    wrapped: List[Tuple[str, List[str]]] = []
+    errors: List[Tuple[str, str]] = []
+    for statement in statements:
+        try:
+            issues.extend(explain(cursor, statement, small_table_rows))
+        except Exception as e:
+            errors.append((statement.name, str(e)))
+            continue
+        for function, table, column in wrapped_columns(statement):
+            wrapped.append((f"{statement.name}: {function}({column}) в условии по {table}",
+                            generated_column_ddl(cursor, function, table, column)))
+    return PlanReport(issues, missing_indexes(cursor), wrapped, errors)
+
+
+def format_report(report: PlanReport) -> List[str]:
+    lines: List[str] = []
+    for issue in report.issues:
+        lines.append(f"⚠️  {issue.statement}: {issue.detail} ({issue.table}, ~{issue.rows} строк)")
+    for name, error in report.errors:
+        lines.append(f"❌ {name}: EXPLAIN не выполнен: {error}")
+    for item in report.missing:
+        lines.append(f"📌 Нет индекса для «{item.reason}»:")
+        lines.append(f"   {item.ddl}")
+    for title, ddl in report.wrapped:
+        lines.append(f"📌 {title} — индекс не используется. Сравнивайте столбец без функции или добавьте:")
+        lines.extend(f"   {line}" for line in ddl)
+    return lines
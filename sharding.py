@@ -0,0 +1,167 @@
+"""Распределение апдейтов между несколькими процессами-воркерами.
+
+Фронт (вебхук или polling) принимает апдейт, вычисляет номер воркера по id
+чата и пересылает сырой JSON на вебхук этого воркера. Апдейты одного чата
+всегда попадают к одному воркеру и обрабатываются строго по очереди, поэтому
+локальные кэши воркера (заявки пользователя) остаются согласованными, а
+состояния анкет хранятся в общем хранилище (SQLite или Redis).
+"""
+import asyncio
+import hmac
+import logging
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+from webhook_server import SECRET_TOKEN_HEADER, WEBHOOK_SECRET_KEY, ChatLanes, update_chat_id
+
+SHARD_ROUTER_KEY = "SHARD_ROUTER"
+
+
+def shard_for(key: int, workers: int) -> int:
+    return key % workers
+
+
+class ShardRouter:
+    """Пересылка апдейтов на вебхуки воркеров с сохранением порядка внутри чата"""
+
+    def __init__(self, worker_urls: List[str], secret: str, *, timeout: float = 10.0, retries: int = 3) -> None:
+        if not worker_urls:
+            raise ValueError("Нужен хотя бы один воркер")
+        self.worker_urls = list(worker_urls)
+        self.secret = secret
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.lanes = ChatLanes()
+        self.forwarded = [0] * len(self.worker_urls)
+        self.failed = 0
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self) -> None:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=self.timeout)
+
+    async def close(self) -> None:
+        await self.lanes.drain(timeout=10)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def wait_ready(self, timeout: float = 30.0) -> None:
+        """Дождаться, пока все воркеры начнут отвечать на своих адресах"""
+        await self.start()
+        deadline = asyncio.get_running_loop().time() + timeout
+        for index, url in enumerate(self.worker_urls):
+            while True:
+                try:
+                    async with self._session.get(url) as response:
+                        if response.status == 200:
+                            break
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    pass
+                if asyncio.get_running_loop().time() > deadline:
+                    raise RuntimeError(f"Воркер {index} ({url}) не запустился за {timeout:.0f} с")
+                await asyncio.sleep(0.2)
+
+    async def route(self, update: Dict[str, object]) -> bool:
+        """Переслать апдейт воркеру. Возвращает False, если воркер не принял апдейт"""
+        key = update_chat_id(update)
+        index = shard_for(key, len(self.worker_urls))
+        return await self.lanes.submit(key, lambda: self._forward(index, update))
+
+    async def _forward(self, index: int, update: Dict[str, object]) -> bool:
+        await self.start()
+        # Повторяем внутри очереди чата, чтобы следующие апдейты не обогнали этот
+        for attempt in range(1, self.retries + 1):
+            try:
+                async with self._session.post(self.worker_urls[index], json=update,
+                                              headers={SECRET_TOKEN_HEADER: self.secret}) as response:
+                    if response.status == 200:
+                        self.forwarded[index] += 1
+                        return True
+                    logging.warning("Воркер %s ответил %s на апдейт %s", index, response.status,
+                                    update.get('update_id'))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.warning("Воркер %s недоступен: %s", index, e)
+            if attempt < self.retries:
+                await asyncio.sleep(0.5 * attempt)
+        self.failed += 1
+        return False
+
+    def stats(self) -> Dict[str, object]:
+        return {"workers": len(self.worker_urls), "forwarded": list(self.forwarded),
+                "failed": self.failed, "active_chats": len(self.lanes)}
+
+
+class ShardRouterHandler(web.View):
+    """Вебхук фронта: проверяет секрет Telegram и отдаёт апдейт воркеру.
+
+    Ответ Telegram задерживается до подтверждения воркера (он сам отвечает
+    сразу), при сбое воркера Telegram получает 502 и повторит доставку.
+    """
+
+    async def post(self) -> web.Response:
+        secret = self.request.app.get(WEBHOOK_SECRET_KEY)
+        received = self.request.headers.get(SECRET_TOKEN_HEADER, "")
+        if secret and not hmac.compare_digest(received.encode(), secret.encode()):
+            logging.warning("Отклонён запрос на вебхук с неверным секретным токеном от %s", self.request.remote)
+            return web.Response(status=401, text="unauthorized")
+        router: ShardRouter = self.request.app[SHARD_ROUTER_KEY]
+        if await router.route(await self.request.json()):
+            return web.Response(text="ok")
+        return web.Response(status=502, text="worker unavailable")
+
+
+def create_router_app(router: ShardRouter, path: str, secret: str) -> web.Application:
+    app = web.Application()
+    app[WEBHOOK_SECRET_KEY] = secret
+    app[SHARD_ROUTER_KEY] = router
+    app.router.add_route("POST", path, ShardRouterHandler)
+
+    async def _close(app: web.Application) -> None:
+        logging.info("Статистика распределения апдейтов: %s", router.stats())
+        await router.close()
+
+    app.on_shutdown.append(_close)
+    return app
+
+
+async def poll_to_router(bot, router: ShardRouter, *, timeout: int = 20, backlog_rate: float = 0.0,
+                         batch_size: int = 100) -> None:
+    """Фронт в режиме polling: забирает апдейты у Telegram и раздаёт воркерам.
+
+    Следующая пачка запрашивается после того, как разослана текущая; апдейты,
+    которые воркер так и не принял, остаются в статистике failed. С backlog_rate
+    апдейты, накопившиеся до запуска, раздаются не быстрее backlog_rate в секунду —
+    до первой неполной пачки, дальше без ограничения.
+    """
+    offset = None
+    interval = 1.0 / backlog_rate if backlog_rate > 0 else 0.0
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, limit=batch_size, timeout=0 if interval else timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning("Ошибка getUpdates: %s", e)
+            await asyncio.sleep(1)
+            continue
+        if interval:
+            routes = []
+            next_at = time.monotonic()
+            for update in updates:
+                delay = next_at - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                next_at = max(next_at, time.monotonic()) + interval
+                routes.append(asyncio.ensure_future(router.route(update.to_python())))
+            await asyncio.gather(*routes)
+            if len(updates) < batch_size:
+                logging.info("Накопившиеся апдейты разосланы воркерам")
+                interval = 0.0
+        else:
+            await asyncio.gather(*(router.route(update.to_python()) for update in updates))
+        if updates:
+            offset = updates[-1].update_id + 1
@@ -0,0 +1,78 @@
+"""Склейка одинаковых одновременных вызовов и очередь записей по ключу.
+
+Двойное нажатие «✅ Да» или несколько /status подряд запускают одинаковые
+обращения к БД параллельно. SingleFlight выполняет такой вызов один раз,
+остальные ждут его результата. KeyedLock выстраивает в очередь записи одного
+пользователя, чтобы проверка «нет ли активной заявки» и вставка не
+пересекались с такой же парой из соседнего обработчика.
+
+Рассчитано на один цикл событий, как и TTLCache.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, List, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Один выполняющийся вызов на ключ; отмена одного из ждущих вызов не прерывает"""
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def run(self, key: Hashable, func: Callable[..., Awaitable[T]], *args, **kwargs) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def forget(self, key: Hashable) -> None:
+        """Следующий вызов с этим ключом не присоединится к уже идущему (данные изменились)"""
+        self._calls.pop(key, None)
+
+    def _finished(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Ошибку забирают ждущие; если все они отменены, не оставляем её «неполученной»
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._calls)}
+
+
+class KeyedLock:
+    """asyncio.Lock на ключ; запись удаляется, когда замок больше никто не ждёт"""
+
+    def __init__(self) -> None:
+        # ключ -> [замок, сколько обработчиков держат или ждут его]
+        self._locks: Dict[Hashable, List[object]] = {}
+        self.waits = 0
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        lock: asyncio.Lock = entry[0]
+        entry[1] += 1
+        if lock.locked():
+            self.waits += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {"keys": len(self._locks), "waits": self.waits}
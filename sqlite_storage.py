@@ -0,0 +1,236 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+import typing
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from aiogram.dispatcher.storage import BaseStorage
+
+# Данные длиннее порога сжимаются zlib; первый байт записи — формат
+_COMPRESS_THRESHOLD = 256
+_RAW = b"j"
+_ZLIB = b"z"
+
+
+def _dump(value: typing.Dict) -> typing.Optional[bytes]:
+    if not value:
+        return None
+    raw = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if len(raw) > _COMPRESS_THRESHOLD:
+        return _ZLIB + zlib.compress(raw)
+    return _RAW + raw
+
+
+def _load(blob: typing.Optional[bytes]) -> typing.Dict:
+    if not blob:
+        return {}
+    blob = bytes(blob)
+    payload = zlib.decompress(blob[1:]) if blob[:1] == _ZLIB else blob[1:]
+    return json.loads(payload.decode("utf-8"))
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище состояний FSM в файле SQLite.
+
+    Состояния переживают перезапуск бота и не занимают память процесса.
+    Брошенные анкеты (без изменений дольше ttl секунд) удаляются фоновой
+    очисткой и не возвращаются при чтении. Запрос к локальному файлу в режиме
+    WAL обычно занимает доли миллисекунды, но файл общий для воркеров: запись
+    ждёт, пока другой процесс держит блокировку, до busy_timeout секунд. Поэтому
+    все обращения к SQLite идут в отдельном потоке (один поток — одно соединение,
+    запросы выполняются по очереди), а цикл событий только ждёт результата.
+    """
+
+    def __init__(self, path: str = "fsm_state.sqlite3", *, ttl: float = 86400.0,
+                 cleanup_interval: float = 600.0, busy_timeout: float = 5.0) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+        self.evicted = 0
+        self._closed = False
+        self._cleanup_task: typing.Optional[asyncio.Task] = None
+
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="fsm-sqlite")
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS fsm (
+                chat TEXT NOT NULL,
+                user TEXT NOT NULL,
+                state TEXT,
+                data BLOB,
+                bucket BLOB,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (chat, user)
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS fsm_updated_at ON fsm (updated_at)")
+        # Первый подсчёт делается сразу, чтобы stats() до фонового подсчёта не показывал пустое хранилище
+        self.records = self.count_records()
+
+    # --- жизненный цикл ---
+
+    async def close(self):
+        if self._closed:
+            return
+        if self._cleanup_task is not None:
+            self._cleanup_task.cancel()
+            self._cleanup_task = None
+        self._closed = True
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+
+    async def wait_closed(self):
+        pass
+
+    def start_cleanup(self) -> None:
+        """Запустить периодическое удаление брошенных анкет"""
+        if self._cleanup_task is None:
+            self._cleanup_task = asyncio.ensure_future(self._run_cleanup())
+
+    def evict_expired(self) -> int:
+        cursor = self._conn.execute("DELETE FROM fsm WHERE updated_at < ?", (time.time() - self.ttl,))
+        self.evicted += cursor.rowcount
+        return cursor.rowcount
+
+    def count_records(self) -> int:
+        self.records = self._conn.execute("SELECT COUNT(*) FROM fsm").fetchone()[0]
+        return self.records
+
+    def stats(self) -> typing.Dict[str, object]:
+        # Вызывается из цикла событий (метрики): подсчёт уходит в поток хранилища,
+        # а в ответ идёт результат предыдущего подсчёта
+        if not self._closed:
+            self._executor.submit(self.count_records)
+        size = 0
+        for suffix in ("", "-wal"):
+            try:
+                size += os.path.getsize(self.path + suffix)
+            except OSError:
+                pass
+        return {"records": self.records, "evicted": self.evicted, "file_bytes": size}
+
+    # --- состояние и данные ---
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        row = await self._run(self._read, chat, user)
+        if row is None or row[0] is None:
+            return self.resolve_state(default)
+        return row[0]
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[typing.Dict] = None) -> typing.Dict:
+        row = await self._run(self._read, chat, user)
+        if row is None or row[1] is None:
+            return dict(default or {})
+        return _load(row[1])
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.AnyStr = None):
+        await self._run(self._modify, chat, user, lambda record: record.__setitem__("state", self.resolve_state(state)))
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        await self._run(self._modify, chat, user, lambda record: record.__setitem__("data", dict(data or {})))
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None, **kwargs):
+        await self._run(self._modify, chat, user, lambda record: record["data"].update(data or {}, **kwargs))
+
+    # --- bucket ---
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        row = await self._run(self._read, chat, user)
+        if row is None or row[2] is None:
+            return dict(default or {})
+        return _load(row[2])
+
+    async def set_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        await self._run(self._modify, chat, user, lambda record: record.__setitem__("bucket", dict(bucket or {})))
+
+    async def update_bucket(self, *,
+                            chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None,
+                            bucket: typing.Dict = None, **kwargs):
+        await self._run(self._modify, chat, user, lambda record: record["bucket"].update(bucket or {}, **kwargs))
+
+    # --- внутреннее ---
+
+    async def _run(self, func: typing.Callable, *args) -> typing.Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(func, *args))
+
+    def _key(self, chat, user) -> typing.Tuple[str, str]:
+        chat, user = self.check_address(chat=chat, user=user)
+        return str(chat), str(user)
+
+    def _read(self, chat, user) -> typing.Optional[tuple]:
+        key = self._key(chat, user)
+        return self._conn.execute(
+            "SELECT state, data, bucket FROM fsm WHERE chat = ? AND user = ? AND updated_at >= ?",
+            key + (time.time() - self.ttl,),
+        ).fetchone()
+
+    def _modify(self, chat, user, change: typing.Callable[[typing.Dict], None]) -> None:
+        key = self._key(chat, user)
+        # Чтение и запись в одной транзакции: параллельные update_data не теряют ключи
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute(
+                "SELECT state, data, bucket FROM fsm WHERE chat = ? AND user = ? AND updated_at >= ?",
+                key + (time.time() - self.ttl,),
+            ).fetchone()
+            record = {
+                "state": row[0] if row else None,
+                "data": _load(row[1]) if row else {},
+                "bucket": _load(row[2]) if row else {},
+            }
+            change(record)
+            if record["state"] is None and not record["data"] and not record["bucket"]:
+                self._conn.execute("DELETE FROM fsm WHERE chat = ? AND user = ?", key)
+            else:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO fsm (chat, user, state, data, bucket, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    key + (record["state"], _dump(record["data"]), _dump(record["bucket"]), time.time()),
+                )
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    async def _run_cleanup(self) -> None:
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                evicted = await self._run(self.evict_expired)
+                if evicted:
+                    logging.info("Удалено брошенных анкет: %s", evicted)
+            except sqlite3.Error as e:
+                logging.warning("Не удалось очистить хранилище состояний: %s", e)
@@ -0,0 +1,260 @@
+"""Уведомления об изменении статуса заявок.
+
+Фоновая задача раз в interval секунд забирает из БД только изменившиеся
+заявки и сообщает о них пользователям:
+
+* новые заявки — по id больше запомненного (диапазон по первичному ключу);
+* незакрытые заявки (new/pending) — точечно по id, так видно переход в pending;
+* закрытые — по водяной метке (processed_at, id), на processed_at нужен индекс.
+
+Метки и список незакрытых заявок сохраняются в файл, после перезапуска
+наблюдатель продолжает с того же места и не пересылает старые уведомления.
+"""
+import asyncio
+import datetime
+import json
+import logging
+import os
+from typing import Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+NOTIFY_STATUSES = {"pending", "processed", "rejected"}
+OPEN_STATUSES = {"new", "pending"}
+
+SQL_WATCH_BOOTSTRAP = """
+    SELECT COALESCE(MAX(id), 0) AS last_id, MAX(processed_at) AS processed_at
+    FROM s3app_userrequest
+"""
+
+SQL_WATCH_OPEN = """
+    SELECT id, telegram_id, status
+    FROM s3app_userrequest
+    WHERE status IN ('new', 'pending')
+"""
+
+SQL_WATCH_NEW = """
+    SELECT id, telegram_id, status, processed_at
+    FROM s3app_userrequest
+    WHERE id > %s
+    ORDER BY id
+    LIMIT %s
+"""
+
+SQL_WATCH_BY_ID = "SELECT id, telegram_id, status, processed_at FROM s3app_userrequest WHERE id IN ({placeholders})"
+
+# Строки после водяной метки в порядке (processed_at, id): одинаковые processed_at не теряются
+SQL_WATCH_CLOSED = """
+    SELECT id, telegram_id, status, processed_at
+    FROM s3app_userrequest
+    WHERE processed_at > %s OR (processed_at = %s AND id > %s)
+    ORDER BY processed_at, id
+    LIMIT %s
+"""
+
+SQL_WATCH_PROCESSED_DEPARTMENTS = """
+    SELECT pd.userrequest_id AS id, GROUP_CONCAT(g.name ORDER BY g.name SEPARATOR '\\n') AS departments
+    FROM s3app_userrequest_processed_departments pd
+    JOIN auth_group g ON g.id = pd.group_id
+    WHERE pd.userrequest_id IN ({placeholders})
+    GROUP BY pd.userrequest_id
+"""
+
+# Начало отсчёта, пока ни одной заявки не закрыто (datetime.min MySQL не принимает)
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+FetchAll = Callable[[str, Sequence[object]], Awaitable[List[Dict[str, object]]]]
+
+
+class StatusChange(NamedTuple):
+    request_id: int
+    telegram_id: str
+    status: str
+    processed_departments: List[str]
+
+
+def _in_query(template: str, ids: Sequence[int]) -> str:
+    return template.format(placeholders=", ".join(["%s"] * len(ids)))
+
+
+def _chunks(items: List[int], size: int) -> Iterable[List[int]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class StatusWatcher:
+    def __init__(self, fetch_all: FetchAll, *, state_path: str = "status_watch.json",
+                 interval: float = 30.0, batch_size: int = 200) -> None:
+        self.fetch_all = fetch_all
+        self.state_path = state_path
+        self.interval = interval
+        self.batch_size = batch_size
+
+        self.last_id = 0
+        self.processed_at: Optional[datetime.datetime] = None
+        self.processed_id = 0
+        # Незакрытые заявки: id -> [telegram_id, статус]
+        self.open: Dict[int, List[str]] = {}
+        # Последний проход упёрся в batch_size: в БД остались непрочитанные строки
+        self.behind = False
+        self._loaded = False
+        self._task: Optional[asyncio.Task] = None
+
+        self.cycles = 0
+        self.queries = 0
+        self.notified = 0
+        self.errors = 0
+
+    # --- жизненный цикл ---
+
+    def start(self, notify: Callable[[List[StatusChange]], Awaitable[None]]) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run(notify))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "cycles": self.cycles,
+            "queries": self.queries,
+            "notified": self.notified,
+            "errors": self.errors,
+            "open": len(self.open),
+            "last_id": self.last_id,
+            "processed_at": self.processed_at.isoformat() if self.processed_at else None,
+        }
+
+    # --- один проход ---
+
+    async def poll(self) -> List[StatusChange]:
+        """Найти изменения с прошлого прохода. Метки сдвигаются в памяти; save() — после отправки.
+
+        self.behind — новые или закрытые заявки пришли полной пачкой, даже если уведомлять
+        по ним не о чем: следующий проход нужен сразу.
+        """
+        if not self._loaded:
+            await self._load()
+
+        changes: List[StatusChange] = []
+        notified_ids = set()
+
+        # 1. Новые заявки: начинаем следить за незакрытыми
+        new_rows = await self._fetch(SQL_WATCH_NEW, (self.last_id, self.batch_size))
+        for row in new_rows:
+            request_id = int(row["id"])
+            self.last_id = max(self.last_id, request_id)
+            status = row["status"]
+            if status in OPEN_STATUSES:
+                self.open[request_id] = [str(row["telegram_id"]), status]
+            # Статус успел смениться до первого прохода (закрытые с processed_at вернёт шаг 3)
+            if status in NOTIFY_STATUSES and (status in OPEN_STATUSES or row["processed_at"] is None):
+                changes.append(StatusChange(request_id, str(row["telegram_id"]), status, []))
+                notified_ids.add(request_id)
+
+        # 2. Незакрытые заявки по первичному ключу
+        for ids in _chunks(sorted(self.open), self.batch_size):
+            for row in await self._fetch(_in_query(SQL_WATCH_BY_ID, ids), ids):
+                request_id = int(row["id"])
+                telegram_id, known_status = self.open[request_id]
+                status = row["status"]
+                if status == known_status:
+                    continue
+                if status in OPEN_STATUSES:
+                    self.open[request_id][1] = status
+                else:
+                    del self.open[request_id]
+                    if row["processed_at"] is not None:
+                        # Закрытую с processed_at заявку вернёт шаг 3 — без дублей
+                        continue
+                if status in NOTIFY_STATUSES:
+                    changes.append(StatusChange(request_id, telegram_id, status, []))
+                    notified_ids.add(request_id)
+
+        # 3. Закрытые после водяной метки
+        since = self.processed_at or _EPOCH
+        rows = await self._fetch(SQL_WATCH_CLOSED, (since, since, self.processed_id, self.batch_size))
+        self.behind = len(new_rows) >= self.batch_size or len(rows) >= self.batch_size
+        for row in rows:
+            request_id = int(row["id"])
+            self.processed_at, self.processed_id = row["processed_at"], request_id
+            self.open.pop(request_id, None)
+            if row["status"] in NOTIFY_STATUSES and request_id not in notified_ids:
+                changes.append(StatusChange(request_id, str(row["telegram_id"]), row["status"], []))
+
+        # Отделы, к которым выдан доступ, — одним запросом на всю пачку
+        processed = [change.request_id for change in changes if change.status == "processed"]
+        if processed:
+            names = {
+                int(row["id"]): [name for name in str(row["departments"] or "").split("\n") if name]
+                for row in await self._fetch(_in_query(SQL_WATCH_PROCESSED_DEPARTMENTS, processed), processed)
+            }
+            changes = [
+                change._replace(processed_departments=names.get(change.request_id, []))
+                if change.status == "processed" else change
+                for change in changes
+            ]
+        self.cycles += 1
+        return changes
+
+    def save(self) -> None:
+        state = {
+            "last_id": self.last_id,
+            "processed_at": self.processed_at.isoformat() if self.processed_at else None,
+            "processed_id": self.processed_id,
+            "open": {str(request_id): value for request_id, value in self.open.items()},
+        }
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+
+    # --- внутреннее ---
+
+    async def _fetch(self, query: str, args: Sequence[object]) -> List[Dict[str, object]]:
+        self.queries += 1
+        return await self.fetch_all(query, args)
+
+    async def _load(self) -> None:
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            # Первый запуск: уведомляем только об изменениях, сделанных после него
+            row = (await self._fetch(SQL_WATCH_BOOTSTRAP, ()))[0]
+            self.last_id = int(row["last_id"])
+            self.processed_at = row["processed_at"]
+            self.processed_id = self.last_id
+            self.open = {
+                int(row["id"]): [str(row["telegram_id"]), row["status"]]
+                for row in await self._fetch(SQL_WATCH_OPEN, ())
+            }
+            logging.info("Наблюдатель статусов: начальное состояние, незакрытых заявок %s", len(self.open))
+            self.save()
+        else:
+            self.last_id = int(state["last_id"])
+            self.processed_at = datetime.datetime.fromisoformat(state["processed_at"]) if state["processed_at"] else None
+            self.processed_id = int(state["processed_id"])
+            self.open = {int(request_id): value for request_id, value in state["open"].items()}
+        self._loaded = True
+
+    async def _run(self, notify: Callable[[List[StatusChange]], Awaitable[None]]) -> None:
+        while True:
+            try:
+                changes = await self.poll()
+                if changes:
+                    await notify(changes)
+                    self.notified += len(changes)
+                # Метки сохраняются после отправки: при сбое уведомления повторятся, а не потеряются
+                self.save()
+                # Полная пачка строк — изменений может быть больше, следующий проход сразу
+                if self.behind:
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                self._loaded = False
+                logging.warning("Наблюдатель статусов: ошибка прохода: %s", e)
+            await asyncio.sleep(self.interval)
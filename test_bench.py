@@ -0,0 +1,45 @@
+import asyncio
+
+import bench
+import main
+
+
+def test_memory_database_rejects_second_active_request():
+    async def run():
+        db = bench.MemoryDatabase(departments=3)
+        first = await db.create_request("Иванов Иван", "7", "Москва", {1: "Отдел 01", 99: "Удалённый"})
+        second = await db.create_request("Иванов Иван", "7", "Москва", {2: "Отдел 02"})
+        return first, second, await db.get_latest_request("7"), db.stats()
+
+    first, second, latest, stats = asyncio.run(run())
+    assert first == (1, ["Удалённый"])
+    assert second == (1, ["__active__"])
+    assert latest["departments"] == ["Отдел 01"]
+    assert latest["status"] == "new" and stats == {"create_request": 2, "get_latest_request": 1}
+
+
+def test_percentile():
+    assert bench.percentile([], 50) == 0.0
+    assert bench.percentile([3, 1, 2], 50) == 2
+    assert bench.percentile(list(range(101)), 95) == 95
+
+
+def test_load_test_runs_without_mysql(capsys, monkeypatch):
+    databases = []
+
+    class RecordingDatabase(bench.MemoryDatabase):
+        def __init__(self, *args, **kwargs) -> None:
+            super().__init__(*args, **kwargs)
+            databases.append(self)
+
+    monkeypatch.setattr(bench, "MemoryDatabase", RecordingDatabase)
+    real_db = main.db
+    args = bench.build_parser().parse_args(["load-test", "--users", "20", "--concurrency", "5", "--db-latency", "0"])
+    asyncio.run(args.handler(args))
+    output = capsys.readouterr().out
+    assert "Анкет пройдено: 20 из 20" in output
+    assert "не дождались ответа: 0" in output
+    assert main.db is real_db
+    stored = [request for database in databases for request in database.requests.values()]
+    assert len(stored) == 20
+    assert all(request["region"] in main.REGION_OPTIONS for request in stored)
@@ -0,0 +1,85 @@
+import asyncio
+import json
+import os
+
+from aiogram.utils.exceptions import BotBlocked
+
+from broadcast import Broadcaster, report_stats
+
+# У пользователя по несколько заявок: SQL отдаёт одну строку на telegram_id с первой из них
+REQUESTS = [{"id": i, "telegram_id": str(1000 + i % 70)} for i in range(1, 301)]
+
+
+def grouped_pages(reads):
+    async def iter_rows(query, args, chunk_size):
+        last_id, limit = args
+        first = {}
+        for row in REQUESTS:
+            first.setdefault(row["telegram_id"], row["id"])
+        rows = sorted(({"id": row_id, "telegram_id": tid} for tid, row_id in first.items() if row_id > last_id),
+                      key=lambda row: row["id"])[:limit]
+        reads.append(last_id)
+        for start in range(0, len(rows), chunk_size):
+            yield rows[start:start + chunk_size]
+    return iter_rows
+
+
+def run_broadcast(tmp_path, iter_rows, send, *, stop_after=None, **kwargs):
+    path = str(tmp_path / "broadcast.json")
+
+    async def run():
+        done = asyncio.get_running_loop().create_future()
+
+        async def on_done(state):
+            done.set_result(state)
+
+        broadcaster = Broadcaster(iter_rows, state_path=path, concurrency=4, page_size=16, **kwargs)
+        broadcaster.start("pending", "привет", "1", send, on_done)
+        if stop_after is not None:
+            await asyncio.sleep(stop_after)
+            await broadcaster.stop()
+            with open(path, encoding="utf-8") as f:
+                checkpoint = json.load(f)
+            # В файле только курсор и получатели текущей страницы
+            assert len(checkpoint["page_done"]) <= 16
+            broadcaster = Broadcaster(iter_rows, state_path=path, concurrency=4, page_size=16, **kwargs)
+            assert broadcaster.resume(send, on_done)
+        return await asyncio.wait_for(done, 10)
+
+    return asyncio.run(run()), path
+
+
+def test_resume_delivers_once_per_user(tmp_path):
+    sent = []
+
+    async def send(telegram_id, text):
+        await asyncio.sleep(0.005)
+        if telegram_id.endswith("7"):
+            raise BotBlocked("Forbidden: bot was blocked by the user")
+        sent.append(telegram_id)
+
+    reads = []
+    state, path = run_broadcast(tmp_path, grouped_pages(reads), send, stop_after=0.03)
+
+    assert state["status"] == "done"
+    assert len(sent) == len(set(sent)) == 63
+    assert report_stats(state)["total"] == 70 and state["unreachable"] == 7
+    assert not os.path.exists(path)
+
+
+def test_read_failures_mark_job_failed(tmp_path):
+    attempts = []
+
+    async def broken(query, args, chunk_size):
+        attempts.append(args[0])
+        raise ConnectionError("MySQL server has gone away")
+        yield []
+
+    async def send(telegram_id, text):
+        raise AssertionError("нечего отправлять")
+
+    state, path = run_broadcast(tmp_path, broken, send, retry_delay=0, read_retries=2)
+
+    assert len(attempts) == 3
+    assert state["status"] == "failed" and "gone away" in state["error"]
+    assert not os.path.exists(path)
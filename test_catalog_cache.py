@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from catalog_cache import CachedCatalog
+
+
+class FakeSource:
+    def __init__(self) -> None:
+        self.data = ["Отдел 01"]
+        self.checksum = 1
+        self.loads = 0
+        self.fail = False
+
+    async def load(self):
+        self.loads += 1
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise RuntimeError("db down")
+        return list(self.data)
+
+    async def probe(self):
+        if self.fail:
+            raise RuntimeError("db down")
+        return self.checksum
+
+
+def test_concurrent_first_gets_share_one_load():
+    async def run():
+        source = FakeSource()
+        catalog = CachedCatalog(source.load, source.probe)
+        results = await asyncio.gather(*(catalog.get() for _ in range(5)))
+        return results, source.loads, catalog.version
+
+    results, loads, version = asyncio.run(run())
+    assert results == [["Отдел 01"]] * 5 and loads == 1 and version == 1
+
+
+def test_stale_data_is_served_while_refresh_checks_probe():
+    async def run():
+        source = FakeSource()
+        catalog = CachedCatalog(source.load, source.probe, ttl=60)
+        await catalog.get()
+
+        # Устарело, но контрольная сумма та же: без перезагрузки
+        catalog._checked_at -= 61
+        await catalog.get()
+        await catalog._refresh_task
+        unchanged = source.loads, catalog.version
+
+        source.checksum, source.data = 2, ["Отдел 01", "Отдел 02"]
+        catalog._checked_at -= 61
+        stale = await catalog.get()
+        await catalog._refresh_task
+        return unchanged, stale, await catalog.get(), catalog.version
+
+    unchanged, stale, fresh, version = asyncio.run(run())
+    assert unchanged == (1, 1)
+    assert stale == ["Отдел 01"]
+    assert fresh == ["Отдел 01", "Отдел 02"] and version == 2
+
+
+def test_invalidate_forces_reload_even_with_same_probe():
+    async def run():
+        source = FakeSource()
+        catalog = CachedCatalog(source.load, source.probe)
+        await catalog.get()
+        source.data = ["Отдел 03"]
+        catalog.invalidate()
+        await catalog._refresh_task
+        return await catalog.get(), source.loads
+
+    assert asyncio.run(run()) == (["Отдел 03"], 2)
+
+
+def test_failed_refresh_keeps_old_data_and_retries_forced_reload():
+    async def run():
+        source = FakeSource()
+        catalog = CachedCatalog(source.load, source.probe)
+        await catalog.get()
+        source.fail = True
+        catalog.invalidate()
+        await catalog._refresh_task
+        kept = await catalog.get(), catalog.errors
+        source.fail, source.data = False, ["Отдел 04"]
+        # Принудительная перезагрузка не потерялась после ошибки
+        assert await catalog.refresh() is True
+        return kept, await catalog.get()
+
+    (data, errors), after = asyncio.run(run())
+    assert data == ["Отдел 01"] and errors == 1
+    assert after == ["Отдел 04"]
+
+
+def test_first_load_error_reaches_caller_and_is_retried():
+    async def run():
+        source = FakeSource()
+        source.fail = True
+        catalog = CachedCatalog(source.load, source.probe)
+        with pytest.raises(RuntimeError):
+            await catalog.get()
+        source.fail = False
+        return await catalog.get()
+
+    assert asyncio.run(run()) == ["Отдел 01"]
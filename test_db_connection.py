@@ -1,6 +1,8 @@
 import pymysql
 from datetime import datetime
 
+from db_pool import ConnectionPool
+
 # Те же настройки что и в main.py
 DB_HOST = 'localhost'
 DB_PORT = 3307
@@ -10,8 +12,8 @@ DB_PASSWORD = 'Kfleirb_17$_'
 
 TELEGRAM_ID = '323049682'
 
-def get_db_connection():
-    """Получить подключение к БД"""
+def _open_db_connection():
+    """Открыть новое подключение к БД"""
     return pymysql.connect(
         host=DB_HOST,
         port=DB_PORT,
@@ -20,8 +22,18 @@ def get_db_connection():
         database=DB_NAME,
         charset="utf8mb4",
         cursorclass=pymysql.cursors.DictCursor,
+        autocommit=True,
+        init_command="SET SESSION group_concat_max_len = 1048576",
     )
 
+
+db_pool = ConnectionPool(_open_db_connection, min_size=1, max_size=2)
+
+
+def get_db_connection():
+    """Получить подключение к БД из пула"""
+    return db_pool.connection()
+
 def test_connection():
     """Проверка подключения к БД"""
     print("=" * 60)
@@ -114,13 +126,21 @@ def get_latest_request():
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
-                # Запрос из функции _get_latest_request_sync
+                # Запрос из функции _get_latest_request_sync: вся заявка за одно обращение
                 cursor.execute(
                     """
-                    SELECT id, status, region, is_additional, created_at
-                    FROM s3app_userrequest
-                    WHERE telegram_id = %s
-                    ORDER BY created_at DESC
+                    SELECT r.id, r.status, r.region, r.is_additional, r.created_at,
+                           (SELECT GROUP_CONCAT(g.name ORDER BY g.name SEPARATOR '\\n')
+                            FROM auth_group g
+                            JOIN s3app_userrequest_processed_departments pd ON g.id = pd.group_id
+                            WHERE pd.userrequest_id = r.id) AS processed_departments,
+                           (SELECT GROUP_CONCAT(g.name ORDER BY g.name SEPARATOR '\\n')
+                            FROM auth_group g
+                            JOIN s3app_userrequest_departments d ON g.id = d.group_id
+                            WHERE d.userrequest_id = r.id) AS departments
+                    FROM s3app_userrequest r
+                    WHERE r.telegram_id = %s
+                    ORDER BY r.created_at DESC
                     LIMIT 1
                     """,
                     (TELEGRAM_ID,),
@@ -132,34 +152,10 @@ def get_latest_request():
                     print()
                     return None
                 
-                # Преобразуем is_additional в bool как в боте
+                # Преобразуем поля так же, как в боте
                 request["is_additional"] = bool(request.get("is_additional"))
-                
-                # Получаем обработанные отделы
-                cursor.execute(
-                    """
-                    SELECT g.name
-                    FROM auth_group g
-                    JOIN s3app_userrequest_processed_departments pd ON g.id = pd.group_id
-                    WHERE pd.userrequest_id = %s
-                    ORDER BY g.name
-                    """,
-                    (request["id"],),
-                )
-                request["processed_departments"] = [row["name"] for row in cursor.fetchall()]
-                
-                # Получаем запрошенные отделы
-                cursor.execute(
-                    """
-                    SELECT g.name
-                    FROM auth_group g
-                    JOIN s3app_userrequest_departments d ON g.id = d.group_id
-                    WHERE d.userrequest_id = %s
-                    ORDER BY g.name
-                    """,
-                    (request["id"],),
-                )
-                request["departments"] = [row["name"] for row in cursor.fetchall()]
+                request["processed_departments"] = request["processed_departments"].split("\n") if request.get("processed_departments") else []
+                request["departments"] = request["departments"].split("\n") if request.get("departments") else []
                 
                 # Выводим результат
                 print(f"✅ Заявка найдена!")
@@ -265,6 +261,33 @@ def get_departments():
         print()
         return []
 
+def check_query_plans():
+    """EXPLAIN всех запросов бота: полные проходы, filesort и недостающие индексы"""
+    print("=" * 60)
+    print("ПЛАНЫ ЗАПРОСОВ БОТА")
+    print("=" * 60)
+
+    from main import bot_statements
+    from query_plans import check, format_report
+
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                statements = bot_statements()
+                report = check(cursor, statements)
+    except Exception as e:
+        print(f"❌ Ошибка при проверке планов: {e}")
+        print()
+        return None
+
+    print(f"Проверено запросов: {len(statements)}")
+    if report.ok:
+        print("✅ Полных проходов, сортировок без индекса и недостающих индексов нет")
+    for line in format_report(report):
+        print(line)
+    print()
+    return report
+
 if __name__ == "__main__":
     print()
     print("🔍 ТЕСТИРОВАНИЕ ЗАПРОСОВ К БАЗЕ ДАННЫХ")
@@ -287,10 +310,15 @@ if __name__ == "__main__":
     
     # 5. Список отделов
     departments = get_departments()
+
+    # 6. Планы запросов бота и рекомендации по индексам
+    plan_report = check_query_plans()
     
     print("=" * 60)
     print("ТЕСТИРОВАНИЕ ЗАВЕРШЕНО")
     print("=" * 60)
+    print(f"Пул соединений: {db_pool.stats()}")
+    db_pool.close()
     print()
     
     # Резюме
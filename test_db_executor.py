@@ -0,0 +1,71 @@
+import asyncio
+import contextvars
+import threading
+
+import pytest
+
+from db_executor import BoundedExecutor, DBOverloaded
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+def test_rejects_beyond_workers_and_queue():
+    async def run():
+        executor = BoundedExecutor(1, 1)
+        release = threading.Event()
+        running = executor.run("slow", release.wait)
+        queued = executor.run("slow", release.wait)
+        tasks = [asyncio.ensure_future(running), asyncio.ensure_future(queued)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(DBOverloaded):
+            await executor.run("slow", release.wait)
+        during = executor.stats()
+        release.set()
+        await asyncio.gather(*tasks)
+        after = executor.stats()
+        executor.shutdown()
+        return during, after
+
+    during, after = asyncio.run(run())
+    assert (during["running"], during["queued"], during["rejected"]) == (1, 1, 1)
+    assert (after["running"], after["queued"], after["completed"]) == (0, 0, 2)
+
+
+def test_cancelled_queued_call_frees_its_slot():
+    async def run():
+        executor = BoundedExecutor(1, 1)
+        release = threading.Event()
+        running = asyncio.ensure_future(executor.run("slow", release.wait))
+        queued = asyncio.ensure_future(executor.run("slow", release.wait))
+        await asyncio.sleep(0.05)
+        queued.cancel()
+        await asyncio.sleep(0.05)
+        stats = executor.stats()
+        release.set()
+        await running
+        executor.shutdown()
+        return stats
+
+    stats = asyncio.run(run())
+    assert (stats["running"], stats["queued"]) == (1, 0)
+
+
+def test_call_sees_caller_context_and_errors_propagate():
+    def fail():
+        raise ValueError(request_id.get())
+
+    async def run():
+        executor = BoundedExecutor(2, 0)
+        request_id.set(42)
+        seen = await executor.run("read", request_id.get)
+        with pytest.raises(ValueError, match="42"):
+            await executor.run("read", fail)
+        executor.shutdown()
+        return seen
+
+    assert asyncio.run(run()) == 42
+
+
+def test_invalid_sizes():
+    with pytest.raises(ValueError):
+        BoundedExecutor(0, 10)
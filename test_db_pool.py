@@ -0,0 +1,145 @@
+import pytest
+
+from db_pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self, number: int) -> None:
+        self.number = number
+        self.open = True
+        self.pings = 0
+        self.rollbacks = 0
+        self.ping_error = None
+        self.rollback_error = None
+
+    def ping(self, reconnect: bool = False) -> None:
+        self.pings += 1
+        if self.ping_error:
+            raise self.ping_error
+
+    def rollback(self) -> None:
+        self.rollbacks += 1
+        if self.rollback_error:
+            raise self.rollback_error
+
+    def close(self) -> None:
+        self.open = False
+
+
+class FakeConnect:
+    def __init__(self) -> None:
+        self.opened = []
+
+    def __call__(self) -> FakeConnection:
+        conn = FakeConnection(len(self.opened) + 1)
+        self.opened.append(conn)
+        return conn
+
+
+def make_pool(**kwargs):
+    connect = FakeConnect()
+    return ConnectionPool(connect, **kwargs), connect
+
+
+def age_idle(pool, *, created=0.0, used=0.0):
+    for pooled in pool._idle:
+        pooled.created_at -= created
+        pooled.last_used -= used
+
+
+def test_exhausted_pool_times_out():
+    pool, connect = make_pool(min_size=0, max_size=2)
+    first, second = pool.acquire(), pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire(timeout=0.05)
+    pool.release(first)
+    # Освободившееся соединение выдаётся повторно, новое не открывается
+    assert pool.acquire(timeout=0.05) is first and len(connect.opened) == 2
+    stats = pool.stats()
+    assert (stats["timeouts"], stats["waits"], stats["in_use"], stats["created"]) == (1, 0, 2, 2)
+    pool.release(second)
+
+
+def test_old_connection_is_recycled():
+    pool, connect = make_pool(min_size=0, max_size=2, recycle=60)
+    conn = pool.acquire()
+    pool.release(conn)
+    age_idle(pool, created=61)
+
+    fresh = pool.acquire()
+    assert fresh is not conn and not conn.open
+    assert pool.stats()["discarded"] == 1 and pool.stats()["size"] == 1
+
+
+def test_idle_connection_is_pinged_and_replaced_when_dead():
+    pool, connect = make_pool(min_size=0, max_size=2, ping_interval=30)
+    conn = pool.acquire()
+    pool.release(conn)
+    # Недавно использованное соединение выдаётся без ping
+    assert pool.acquire() is conn and conn.pings == 0
+    pool.release(conn)
+
+    age_idle(pool, used=31)
+    assert pool.acquire() is conn and conn.pings == 1
+    pool.release(conn)
+
+    age_idle(pool, used=31)
+    conn.ping_error = ConnectionError("gone away")
+    replacement = pool.acquire()
+    assert replacement is not conn and not conn.open
+
+
+def test_idle_connections_shrink_to_min_size():
+    pool, connect = make_pool(min_size=1, max_size=4, idle_timeout=60)
+    conns = [pool.acquire() for _ in range(3)]
+    for conn in conns[:2]:
+        pool.release(conn)
+    age_idle(pool, used=61)
+    # Возврат очередного соединения убирает простаивающие сверх min_size
+    pool.release(conns[2])
+    stats = pool.stats()
+    assert (stats["idle"], stats["size"], stats["discarded"]) == (1, 1, 2)
+    assert pool._idle[0].conn is conns[2]
+
+
+def test_fill_opens_up_to_min_size():
+    pool, connect = make_pool(min_size=2, max_size=4)
+    assert pool.fill() == 2 and pool.fill() == 0
+    assert pool.stats()["idle"] == 2
+
+
+def test_connection_returns_to_pool_after_exception():
+    pool, connect = make_pool(min_size=0, max_size=1)
+    with pytest.raises(ValueError):
+        with pool.connection() as conn:
+            raise ValueError("ошибка запроса")
+    assert conn.rollbacks == 1 and conn.open
+    assert pool.stats()["idle"] == 1 and pool.acquire() is conn
+
+
+def test_connection_is_discarded_when_rollback_fails():
+    pool, connect = make_pool(min_size=0, max_size=1)
+    with pytest.raises(ConnectionError):
+        with pool.connection() as conn:
+            conn.rollback_error = ConnectionError("lost connection")
+            raise ValueError("ошибка запроса")
+    assert not conn.open
+    stats = pool.stats()
+    assert (stats["size"], stats["idle"], stats["in_use"], stats["discarded"]) == (0, 0, 0, 1)
+    assert pool.acquire() is not conn
+
+
+def test_stats_and_close():
+    pool, connect = make_pool(min_size=0, max_size=3)
+    with pool.connection():
+        stats = pool.stats()
+        assert (stats["size"], stats["in_use"], stats["idle"], stats["checkouts"]) == (1, 1, 0, 1)
+    pool.close()
+    assert not connect.opened[0].open
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+
+
+def test_invalid_sizes():
+    with pytest.raises(ValueError):
+        ConnectionPool(FakeConnect(), min_size=3, max_size=2)
@@ -0,0 +1,16 @@
+import main
+
+
+def test_select_keeps_choice_order_and_drops_unknown_ids():
+    catalog = main.Departments(items=[], names={1: "Бухгалтерия", 2: "Отдел Ёлок"}, version=1)
+    assert catalog.select([2, 7, 1]) == {2: "Отдел Ёлок", 1: "Бухгалтерия"}
+    assert catalog.resolve([2, 1]) == ["Отдел Ёлок", "Бухгалтерия"]
+
+
+def test_match_groups_by_id():
+    # Название в БД может отличаться от показанного (ё/е, пробел в конце) — сопоставляем по id
+    selected = {2: "Отдел Ёлок", 5: "Удалённый отдел", 1: "Бухгалтерия"}
+    query, args = main._find_groups_query(selected)
+    assert query == "SELECT id FROM auth_group WHERE id IN (%s, %s, %s)" and args == [2, 5, 1]
+    group_ids, missing = main._match_groups(selected, [{"id": 1}, {"id": 2}])
+    assert group_ids == [2, 1] and missing == ["Удалённый отдел"]
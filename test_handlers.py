@@ -0,0 +1,76 @@
+import asyncio
+import types
+
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher import FSMContext
+
+import main
+
+
+class FakeQuery:
+    def __init__(self, data: str) -> None:
+        self.data = data
+        self.from_user = types.SimpleNamespace(id=7)
+        self.message = types.SimpleNamespace(chat=types.SimpleNamespace(id=7), message_id=100)
+        self.answers = []
+
+    async def answer(self, text=None, show_alert=None):
+        self.answers.append((text, show_alert))
+
+
+def departments(count):
+    items = [{"id": index, "name": f"Отдел {index:02d}"} for index in range(1, count + 1)]
+    return main.Departments(items=items, names={item["id"]: item["name"] for item in items}, version=1)
+
+
+def run_handler(monkeypatch, handler, data, form_state, form_data, catalog=None):
+    edits = []
+
+    async def edit_or_answer(message, text, reply_markup=None):
+        edits.append((text, reply_markup))
+
+    async def fetch_departments():
+        return catalog or departments(25)
+
+    monkeypatch.setattr(main, "edit_or_answer", edit_or_answer)
+    monkeypatch.setattr(main, "fetch_departments", fetch_departments)
+
+    async def run():
+        state = FSMContext(MemoryStorage(), chat=7, user=7)
+        if form_state:
+            await state.set_state(form_state)
+        await state.update_data(**form_data)
+        query = FakeQuery(data)
+        await handler(query, state)
+        return query.answers, await state.get_data(), edits
+
+    return asyncio.run(run())
+
+
+def test_page_outside_picker_is_answered_and_ignored(monkeypatch):
+    answers, data, edits = run_handler(monkeypatch, main.handle_department_page, "deptpage_1",
+                                       main.InviteRequestForm.waiting_confirmation.state, {"department_page": 0})
+    assert answers == [(main.FORM_EXPIRED_TEXT, True)]
+    assert data["department_page"] == 0 and edits == []
+
+
+def test_page_number_is_clamped(monkeypatch):
+    answers, data, edits = run_handler(monkeypatch, main.handle_department_page, "deptpage_99",
+                                       main.InviteRequestForm.waiting_departments.state, {"department_page": 0})
+    assert answers == [(None, None)]
+    # 25 отделов по 10 — последняя страница третья
+    assert data["department_page"] == main.department_pages(departments(25).items) - 1 == 2
+    assert len(edits) == 1
+
+
+def test_toggle_outside_picker_keeps_selection(monkeypatch):
+    answers, data, edits = run_handler(monkeypatch, main.handle_department_selection, "dept_3",
+                                       None, {"selected_department_ids": [1]})
+    assert answers == [(main.FORM_EXPIRED_TEXT, True)]
+    assert data["selected_department_ids"] == [1]
+
+
+def test_confirmation_after_expired_form_shows_alert(monkeypatch):
+    answers, data, edits = run_handler(monkeypatch, main.handle_confirmation, "confirm_yes", None, {})
+    assert answers == [(main.FORM_EXPIRED_TEXT, True)]
+    assert data == {} and edits == []
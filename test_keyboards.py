@@ -0,0 +1,53 @@
+import json
+
+import main
+
+
+def departments(count, version=1):
+    items = [{"id": index, "name": f"Отдел {index:02d}"} for index in range(1, count + 1)]
+    return main.Departments(items=items, names={item["id"]: item["name"] for item in items}, version=version)
+
+
+def buttons(markup):
+    return [[button["callback_data"] for button in row] for row in json.loads(markup)["inline_keyboard"]]
+
+
+def test_static_keyboards_are_serialized_once():
+    assert main.region_keyboard() is main.region_keyboard()
+    assert buttons(main.back_keyboard()) == [["back"]]
+
+
+def test_cached_keyboard_depends_only_on_selection_within_page():
+    main.department_keyboards.clear()
+    catalog = departments(3)
+    plain = main.cached_departments_keyboard(catalog)
+    selected = main.cached_departments_keyboard(catalog, {2})
+
+    assert main.cached_departments_keyboard(catalog, ()) is plain
+    assert main.cached_departments_keyboard(catalog, {2, 99}) is selected
+    assert "✅ Отдел 02" in selected and "✅" not in json.dumps(buttons(plain))
+    # Новая версия справочника — новая клавиатура, а не старая из кэша
+    renamed = catalog._replace(items=[{"id": 1, "name": "Бухгалтерия"}], version=2)
+    assert "Бухгалтерия" in main.cached_departments_keyboard(renamed)
+
+
+def test_department_pages():
+    assert [main.department_pages([{}] * count, page_size=10) for count in (0, 1, 10, 11, 25)] == [1, 1, 1, 2, 3]
+
+
+def test_departments_keyboard_pages_wrap_and_clamp():
+    items = departments(25).items
+    first = buttons(main.serialize_keyboard(main.departments_keyboard(items, page=0, page_size=10)))
+    assert first[0] == ["dept_1"] and first[9] == ["dept_10"]
+    # Навигация по кругу: «назад» с первой страницы ведёт на последнюю
+    assert first[10] == ["deptpage_2", "deptpage_0", "deptpage_1"]
+
+    last = buttons(main.serialize_keyboard(main.departments_keyboard(items, page=99, page_size=10)))
+    assert [row for row in last if row[0].startswith("dept_")] == [[f"dept_{index}"] for index in range(21, 26)]
+    assert last[5] == ["deptpage_1", "deptpage_2", "deptpage_0"]
+
+
+def test_single_page_has_no_navigation():
+    rows = buttons(main.serialize_keyboard(main.departments_keyboard(departments(3).items, page_size=10)))
+    assert not any(row[0].startswith("deptpage_") for row in rows)
+    assert rows[-2:] == [["confirm_departments", "reset_departments"], ["back"]]
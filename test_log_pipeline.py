@@ -0,0 +1,74 @@
+import asyncio
+import json
+import logging
+import queue
+
+import log_pipeline
+from log_pipeline import CorrelationFilter, JsonFormatter, SamplingFilter, _DeferredQueueHandler
+
+
+def make_record(name="bot.flow", level=logging.INFO, msg="шаг %s", args=(1,), **extra):
+    record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_sampling_keeps_whole_update_and_all_warnings():
+    sampling = SamplingFilter(("bot.flow",), 0.5)
+    kept = {key for key in range(1000) if sampling.filter(make_record(update_id=key))}
+    assert 350 < len(kept) < 650
+    # Решение зависит только от id апдейта: все записи одного апдейта либо есть, либо нет
+    assert all(sampling.filter(make_record(update_id=key)) == (key in kept) for key in range(1000))
+    assert all(sampling.filter(make_record(level=logging.WARNING, update_id=key)) for key in range(1000))
+    assert sampling.filter(make_record(name="aiogram", update_id=1))
+    assert SamplingFilter(("bot.flow",), 0.0).filter(make_record(update_id=1)) is False
+
+
+def test_update_id_follows_task_context():
+    async def handle(key):
+        log_pipeline.update_id.set(key)
+        await asyncio.sleep(0)
+        record = make_record()
+        CorrelationFilter().filter(record)
+        return record.update_id
+
+    async def run():
+        return await asyncio.gather(handle(1), handle(2))
+
+    assert asyncio.run(run()) == [1, 2]
+    record = make_record()
+    CorrelationFilter().filter(record)
+    assert record.update_id is None
+
+
+def test_json_formatter_includes_extra_fields():
+    entry = json.loads(JsonFormatter().format(make_record(update_id=7, request_id=42)))
+    assert entry["message"] == "шаг 1"
+    assert (entry["level"], entry["logger"], entry["update_id"], entry["request_id"]) == ("INFO", "bot.flow", 7, 42)
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = _DeferredQueueHandler(queue.Queue(1))
+    record = make_record()
+    handler.emit(record)
+    handler.emit(make_record())
+    assert handler.dropped == 1
+    # Сообщение не собирается в вызывающем потоке — это делает поток записи
+    assert handler.queue.get_nowait() is record and record.args == (1,)
+
+
+def test_setup_writes_through_listener(tmp_path):
+    path = tmp_path / "bot.log"
+    root = logging.getLogger()
+    saved = root.handlers[:], root.level
+    try:
+        log_pipeline.setup(fmt="text", path=str(path), sample_rate=1.0)
+        logging.getLogger("bot.flow").info("Заявка %s создана", 5)
+        log_pipeline.stop()
+    finally:
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        for handler in saved[0]:
+            root.addHandler(handler)
+        root.setLevel(saved[1])
+    assert "Заявка 5 создана" in path.read_text(encoding="utf-8")
@@ -0,0 +1,103 @@
+import asyncio
+import socket
+
+import aiohttp
+import pytest
+
+import main
+import metrics
+from metrics import CounterFunc, GaugeFunc, Histogram, Registry, timed
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("bot_latency_seconds", "Задержка", ["op"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, "read")
+    assert histogram.render() == [
+        "# HELP bot_latency_seconds Задержка",
+        "# TYPE bot_latency_seconds histogram",
+        'bot_latency_seconds_bucket{op="read",le="0.1"} 2',
+        'bot_latency_seconds_bucket{op="read",le="1.0"} 3',
+        'bot_latency_seconds_bucket{op="read",le="+Inf"} 4',
+        'bot_latency_seconds_sum{op="read"} 3.65',
+        'bot_latency_seconds_count{op="read"} 4',
+    ]
+
+
+def test_label_values_are_escaped():
+    counter = metrics.Counter("bot_errors_total", "Ошибки", ["error"])
+    counter.inc('say "hi"\\\nnext')
+    assert list(counter.samples()) == ['bot_errors_total{error="say \\"hi\\"\\\\\\nnext"} 1']
+
+
+def test_timed_sync_and_async_including_errors():
+    histogram = Histogram("bot_call_seconds", "Вызовы", ["op"])
+
+    @timed(histogram, "sync")
+    def sync_call(fail):
+        if fail:
+            raise ValueError("sync")
+        return "ok"
+
+    @timed(histogram, "async")
+    async def async_call(fail):
+        await asyncio.sleep(0)
+        if fail:
+            raise ValueError("async")
+        return "ok"
+
+    assert sync_call(False) == "ok" and asyncio.run(async_call(False)) == "ok"
+    with pytest.raises(ValueError):
+        sync_call(True)
+    with pytest.raises(ValueError):
+        asyncio.run(async_call(True))
+    assert async_call.__name__ == "async_call"
+    counts = [line for line in histogram.samples() if "_count" in line]
+    assert counts == ['bot_call_seconds_count{op="async"} 2', 'bot_call_seconds_count{op="sync"} 2']
+
+
+def test_func_metrics_with_dict_values():
+    gauge = GaugeFunc("bot_pool", "Пул", ["state"], lambda: {("idle",): 2, ("in_use",): 1})
+    counter = CounterFunc("bot_api_total", "API", ["method"], lambda: {("sendMessage",): 5})
+    scalar = GaugeFunc("bot_up", "Работает", collect=lambda: 1)
+    assert list(gauge.samples()) == ['bot_pool{state="idle"} 2', 'bot_pool{state="in_use"} 1']
+    assert counter.render()[1] == "# TYPE bot_api_total counter"
+    assert list(counter.samples()) == ['bot_api_total{method="sendMessage"} 5']
+    assert list(scalar.samples()) == ["bot_up 1"]
+
+
+def test_registry_rejects_duplicates():
+    registry = Registry()
+    registry.counter("bot_total", "x")
+    with pytest.raises(ValueError):
+        registry.counter("bot_total", "x")
+
+
+def test_metrics_server_binds_to_metrics_host_only(monkeypatch):
+    port = free_port()
+    monkeypatch.setattr(main, "METRICS_HOST", "127.0.0.1")
+
+    async def run():
+        dp = {"metrics_port": port}
+        await main.start_metrics_server(dp)
+        runner = dp["metrics_runner"]
+        try:
+            addresses = [address[0] for address in runner.addresses]
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"http://127.0.0.1:{port}{main.METRICS_PATH}") as response:
+                    body = await response.text()
+                    content_type = response.headers["Content-Type"]
+        finally:
+            await runner.cleanup()
+        return addresses, body, content_type
+
+    addresses, body, content_type = asyncio.run(run())
+    assert addresses == ["127.0.0.1"]
+    assert "# TYPE bot_handler_duration_seconds histogram" in body
+    assert content_type == metrics.CONTENT_TYPE
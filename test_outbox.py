@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+import outbox
+from outbox import SendScheduler, TokenBucket
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_token_bucket_refill(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(outbox.time, "monotonic", clock)
+    bucket = TokenBucket(rate=2.0, capacity=3)
+
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    # Четвёртый токен — в долг: появится через 1 / rate
+    assert bucket.reserve() == 0.5
+    clock.now += 0.5
+    assert bucket.delay() == 0.5
+    clock.now += 10
+    # Запас не превышает capacity, сколько бы ни прошло времени
+    assert bucket.tokens <= 3 and bucket.idle()
+
+
+def test_token_bucket_pause(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(outbox.time, "monotonic", clock)
+    bucket = TokenBucket(rate=1.0, capacity=3)
+    bucket.pause(5)
+    assert bucket.delay() == 5
+    clock.now += 5
+    assert bucket.delay() == 0.0
+
+
+def test_chat_bucket_same_for_str_and_int_id():
+    scheduler = SendScheduler(chat_rate=1.0, chat_burst=3, group_rate=20 / 60)
+    assert scheduler._chat_bucket("323049682") is scheduler._chat_bucket(323049682)
+    bucket = scheduler._chat_bucket(323049682)
+    assert bucket.rate == 1.0 and bucket.capacity == 3
+    assert len(scheduler._chats) == 1
+
+
+def test_chat_bucket_groups():
+    scheduler = SendScheduler(chat_rate=1.0, chat_burst=3, group_rate=0.5)
+    assert scheduler._chat_bucket(-100123).rate == 0.5
+    assert scheduler._chat_bucket("-100123") is scheduler._chat_bucket(-100123)
+    assert scheduler._chat_bucket("@channel").rate == 0.5
+    assert scheduler._chat_bucket(None) is None
+
+
+def test_submit_keeps_chat_order():
+    async def run():
+        scheduler = SendScheduler(global_rate=0, chat_rate=0)
+        sent = []
+
+        def call(index):
+            async def send():
+                sent.append(index)
+                return index
+            return send
+
+        results = await asyncio.gather(*(scheduler.submit(1, call(i)) for i in range(5)))
+        await scheduler.close()
+        return results, sent
+
+    results, sent = asyncio.run(run())
+    assert results == sent == [0, 1, 2, 3, 4]
+
+
+def test_submit_rejects_unknown_priority():
+    async def run():
+        scheduler = SendScheduler(global_rate=30, chat_rate=0)
+        calls = []
+
+        async def send():
+            calls.append(1)
+
+        with pytest.raises(ValueError):
+            await scheduler.submit(1, send, priority=5)
+        await scheduler.close()
+        return calls, scheduler
+
+    calls, scheduler = asyncio.run(run())
+    assert calls == [] and scheduler.queued == 0
+    # Токен глобального лимита не израсходован
+    assert scheduler._global.tokens == scheduler._global.capacity
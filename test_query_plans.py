@@ -0,0 +1,119 @@
+from query_plans import (SMALL_TABLE_ROWS, IndexAdvice, PlanIssue, PlanReport, Statement, check, explain,
+                         format_report, missing_indexes, wrapped_columns)
+
+
+class FakeCursor:
+    """Курсор DictCursor: ответы на EXPLAIN и information_schema заданы заранее"""
+
+    def __init__(self, plans=None, indexes=None, column_types=None) -> None:
+        self.plans = plans or {}
+        self.indexes = indexes or {}
+        self.column_types = column_types or {}
+        self.executed = []
+        self._rows = []
+
+    def execute(self, sql, args=()):
+        self.executed.append((sql, args))
+        if sql.startswith("EXPLAIN "):
+            plan = self.plans[sql[len("EXPLAIN "):]]
+            if isinstance(plan, Exception):
+                raise plan
+            self._rows = plan
+        elif "information_schema.STATISTICS" in sql:
+            self._rows = [{"INDEX_NAME": name, "COLUMN_NAME": column}
+                          for name, columns in self.indexes.get(args[0], {}).items() for column in columns]
+        elif "information_schema.COLUMNS" in sql:
+            column_type = self.column_types.get(tuple(args))
+            self._rows = [{"COLUMN_TYPE": column_type}] if column_type else []
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+
+def plan(table, access, rows, extra=""):
+    return {"table": table, "type": access, "rows": rows, "Extra": extra}
+
+
+def test_full_scans_below_small_table_rows_are_ignored():
+    statement = Statement("q", "SELECT 1", ())
+    cursor = FakeCursor(plans={"SELECT 1": [
+        plan("auth_group", "ALL", SMALL_TABLE_ROWS - 1),
+        plan("s3app_group", "index", SMALL_TABLE_ROWS - 1),
+        plan("s3app_userrequest", "ALL", SMALL_TABLE_ROWS),
+        plan("s3app_user", "index", 50000),
+        plan("s3app_userrequest", "ref", 3),
+    ]})
+    assert explain(cursor, statement) == [
+        PlanIssue("q", "s3app_userrequest", "full_scan", SMALL_TABLE_ROWS, "полный проход по таблице"),
+        PlanIssue("q", "s3app_user", "full_index_scan", 50000, "полный проход по индексу"),
+    ]
+    assert cursor.executed == [("EXPLAIN SELECT 1", ())]
+
+
+def test_filesort_and_temporary_are_reported():
+    statement = Statement("sorted", "SELECT 2", ())
+    extra = "Using where; Using temporary; Using filesort"
+    cursor = FakeCursor(plans={"SELECT 2": [plan("s3app_userrequest", "ref", 10, extra)]})
+    assert [issue.kind for issue in explain(cursor, statement)] == ["filesort", "temporary"]
+
+
+def test_wrapped_columns_resolve_aliases():
+    statement = Statement("find", """
+        SELECT d.id FROM auth_group d
+        LEFT JOIN s3app_groupsettings gs ON d.id = gs.group_id
+        WHERE LOWER(d.name) IN (%s) AND DATE(created_at) = %s
+    """, ())
+    # Без псевдонима и при нескольких таблицах таблица неизвестна — такое не советуем
+    assert wrapped_columns(statement) == [("LOWER", "auth_group", "name")]
+
+    single = Statement("single", "SELECT id FROM s3app_userrequest WHERE date(created_at) = %s", ())
+    assert wrapped_columns(single) == [("DATE", "s3app_userrequest", "created_at")]
+    assert wrapped_columns(Statement("plain", "SELECT id FROM auth_group g WHERE g.name = %s", ())) == []
+
+
+def test_missing_indexes_match_composite_prefix():
+    advice = [
+        IndexAdvice("s3app_userrequest", ("telegram_id", "created_at"), "tg_created", "последняя заявка"),
+        IndexAdvice("s3app_userrequest", ("status",), "status_idx", "незавершённые"),
+        IndexAdvice("s3app_user", ("telegram_id",), "user_tg", "профиль"),
+    ]
+    cursor = FakeCursor(indexes={
+        # Более длинный индекс с нужным префиксом подходит; status вторым столбцом — нет
+        "s3app_userrequest": {"tg_created_id": ["telegram_id", "CREATED_AT", "id"], "type_status": ["type", "status"]},
+        "s3app_user": {"PRIMARY": ["id"]},
+    })
+    assert [item.name for item in missing_indexes(cursor, advice)] == ["status_idx", "user_tg"]
+    # Индексы одной таблицы читаются один раз
+    assert sum("STATISTICS" in sql for sql, _ in cursor.executed) == 2
+
+
+def test_check_and_format_report():
+    statements = [
+        Statement("ok", "SELECT 1", ()),
+        Statement("broken", "SELECT bad", ()),
+        Statement("lower", "SELECT id FROM auth_group g WHERE LOWER(g.name) = %s", ("x",)),
+    ]
+    cursor = FakeCursor(
+        plans={
+            "SELECT 1": [plan("s3app_userrequest", "ALL", 5000)],
+            "SELECT bad": RuntimeError("Unknown column"),
+            statements[2].sql: [plan("g", "ALL", 10)],
+        },
+        indexes={"auth_group": {"auth_group_name": ["name"]}},
+        column_types={("auth_group", "name"): "varchar(150)"},
+    )
+    report = check(cursor, statements)
+    assert not report.ok and report.errors == [("broken", "Unknown column")]
+    lines = format_report(report)
+    assert lines[0] == "⚠️  ok: полный проход по таблице (s3app_userrequest, ~5000 строк)"
+    assert lines[1] == "❌ broken: EXPLAIN не выполнен: Unknown column"
+    assert "📌 Нет индекса для «последняя заявка пользователя: WHERE telegram_id = ? ORDER BY created_at DESC LIMIT 1»:" in lines
+    assert "   CREATE INDEX s3app_userrequest_tg_created ON s3app_userrequest (telegram_id, created_at);" in lines
+    assert "📌 lower: LOWER(name) в условии по auth_group — индекс не используется. " \
+           "Сравнивайте столбец без функции или добавьте:" in lines
+    assert "   CREATE INDEX auth_group_name_lower ON auth_group ((LOWER(name)));" in lines
+    assert any("varchar(150) GENERATED ALWAYS AS (LOWER(name)) STORED" in line for line in lines)
+    assert format_report(PlanReport([], [], [], [])) == []
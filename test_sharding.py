@@ -0,0 +1,63 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from sharding import ShardRouter, create_router_app, shard_for
+from webhook_server import SECRET_TOKEN_HEADER
+
+
+def message(update_id, chat_id):
+    return {"update_id": update_id, "message": {"message_id": update_id, "chat": {"id": chat_id}, "text": "x"}}
+
+
+def test_shard_for_is_stable_and_in_range():
+    assert [shard_for(key, 3) for key in (0, 1, 2, 3, 323049682)] == [0, 1, 2, 0, 323049682 % 3]
+    # Группы с отрицательным id тоже попадают в диапазон воркеров
+    assert 0 <= shard_for(-1001234567890, 4) < 4
+    assert shard_for(42, 1) == 0
+
+
+def test_router_keeps_chat_on_one_worker_in_order(monkeypatch):
+    async def run():
+        router = ShardRouter(["http://w0", "http://w1"], "secret")
+        received = []
+
+        async def forward(index, update):
+            # Первый апдейт чата доставляется дольше — порядок внутри чата не должен сбиться
+            await asyncio.sleep(0.02 if update["update_id"] == 1 else 0)
+            received.append((index, update["update_id"]))
+            return True
+
+        monkeypatch.setattr(router, "_forward", forward)
+        updates = [message(1, 10), message(2, 11), message(3, 10), message(4, 10)]
+        results = await asyncio.gather(*(router.route(update) for update in updates))
+        return results, received
+
+    results, received = asyncio.run(run())
+    assert all(results)
+    assert [update_id for index, update_id in received if index == 0] == [1, 3, 4]
+    assert [update_id for index, update_id in received if index == 1] == [2]
+
+
+def test_front_forwards_with_secret_and_rejects_bad_token():
+    async def run():
+        got = []
+
+        async def worker(request):
+            got.append((request.headers.get(SECRET_TOKEN_HEADER), (await request.json())["update_id"]))
+            return web.Response(text="ok")
+
+        worker_app = web.Application()
+        worker_app.router.add_post("/hook", worker)
+        async with TestServer(worker_app) as worker_server:
+            router = ShardRouter([str(worker_server.make_url("/hook"))], "worker-secret", retries=1)
+            async with TestClient(TestServer(create_router_app(router, "/hook", "tg-secret"))) as front:
+                bad = await front.post("/hook", json=message(1, 10), headers={SECRET_TOKEN_HEADER: "wrong"})
+                good = await front.post("/hook", json=message(2, 10), headers={SECRET_TOKEN_HEADER: "tg-secret"})
+                return bad.status, good.status, got, router.stats()
+
+    bad, good, got, stats = asyncio.run(run())
+    assert (bad, good) == (401, 200)
+    assert got == [("worker-secret", 2)]
+    assert stats["forwarded"] == [1] and stats["failed"] == 0
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from singleflight import KeyedLock, SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    async def run():
+        flight = SingleFlight()
+        started = 0
+
+        async def load(value):
+            nonlocal started
+            started += 1
+            await asyncio.sleep(0.01)
+            return value
+
+        results = await asyncio.gather(*(flight.run("user:1", load, i) for i in range(5)))
+        other = await flight.run("user:2", load, "other")
+        return results, other, started, flight.stats()
+
+    results, other, started, stats = asyncio.run(run())
+    # Все ждущие получают результат первого вызова
+    assert results == [0] * 5 and other == "other"
+    assert started == 2
+    assert stats == {"calls": 2, "shared": 4, "in_flight": 0}
+
+
+def test_error_reaches_every_waiter_and_is_not_cached():
+    async def run():
+        flight = SingleFlight()
+        attempts = 0
+
+        async def load():
+            nonlocal attempts
+            attempts += 1
+            await asyncio.sleep(0.01)
+            if attempts == 1:
+                raise RuntimeError("db down")
+            return "ok"
+
+        results = await asyncio.gather(*(flight.run("key", load) for _ in range(3)), return_exceptions=True)
+        retry = await flight.run("key", load)
+        return results, retry, attempts
+
+    results, retry, attempts = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert retry == "ok" and attempts == 2
+
+
+def test_cancelled_waiter_does_not_cancel_the_call():
+    async def run():
+        flight = SingleFlight()
+
+        async def load():
+            await asyncio.sleep(0.02)
+            return "done"
+
+        first = asyncio.ensure_future(flight.run("key", load))
+        second = asyncio.ensure_future(flight.run("key", load))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == "done"
+
+
+def test_forget_starts_a_fresh_call():
+    async def run():
+        flight = SingleFlight()
+        calls = []
+
+        async def load(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            return value
+
+        stale = asyncio.ensure_future(flight.run("key", load, "old"))
+        await asyncio.sleep(0)
+        flight.forget("key")
+        fresh = await flight.run("key", load, "new")
+        return await stale, fresh, calls
+
+    assert asyncio.run(run()) == ("old", "new", ["old", "new"])
+
+
+def test_keyed_lock_serialises_one_key_only():
+    async def run():
+        locks = KeyedLock()
+        events = []
+
+        async def write(key, name):
+            async with locks.hold(key):
+                events.append(f"{name} start")
+                await asyncio.sleep(0.01)
+                events.append(f"{name} end")
+
+        await asyncio.gather(write(1, "a"), write(1, "b"), write(2, "c"))
+        return events, locks.stats()
+
+    events, stats = asyncio.run(run())
+    assert events.index("a end") < events.index("b start")
+    # Другой ключ не ждёт: c начинается раньше, чем закончится a
+    assert events.index("c start") < events.index("a end")
+    assert stats == {"keys": 0, "waits": 1}
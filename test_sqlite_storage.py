@@ -0,0 +1,80 @@
+import asyncio
+import threading
+
+import sqlite_storage
+from sqlite_storage import SQLiteStorage
+
+
+def test_state_and_data_roundtrip(tmp_path):
+    async def run():
+        storage = SQLiteStorage(str(tmp_path / "fsm.sqlite3"))
+        await storage.set_state(chat=1, user=1, state="Form:name")
+        await asyncio.gather(*(storage.update_data(chat=1, user=1, **{f"k{i}": i}) for i in range(10)))
+        result = await storage.get_state(chat=1, user=1), await storage.get_data(chat=1, user=1)
+        await storage.reset_state(chat=1, user=1, with_data=True)
+        empty = await storage.get_state(chat=1, user=1), await storage.get_data(chat=1, user=1)
+        await storage.close()
+        await storage.close()
+        return result, empty
+
+    (state, data), empty = asyncio.run(run())
+    assert state == "Form:name"
+    # Параллельные update_data не теряют ключи друг друга
+    assert data == {f"k{i}": i for i in range(10)}
+    assert empty == (None, {})
+
+
+def test_queries_run_off_the_event_loop(tmp_path, monkeypatch):
+    threads = set()
+    original = SQLiteStorage._read
+
+    def read(self, chat, user):
+        threads.add(threading.current_thread().name)
+        return original(self, chat, user)
+
+    monkeypatch.setattr(SQLiteStorage, "_read", read)
+
+    async def run():
+        storage = SQLiteStorage(str(tmp_path / "fsm.sqlite3"))
+        await storage.get_state(chat=1, user=1)
+        await storage.close()
+
+    asyncio.run(run())
+    assert len(threads) == 1 and threads.pop().startswith("fsm-sqlite")
+
+
+def test_expired_records_are_hidden_and_evicted(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sqlite_storage.time, "time", lambda: now[0])
+
+    async def run():
+        storage = SQLiteStorage(str(tmp_path / "fsm.sqlite3"), ttl=60)
+        await storage.set_state(chat=1, user=1, state="Form:name")
+        await storage.set_state(chat=2, user=2, state="Form:name")
+        now[0] += 30
+        await storage.set_state(chat=2, user=2, state="Form:last_name")
+        now[0] += 40
+        hidden = await storage.get_state(chat=1, user=1)
+        evicted = await storage._run(storage.evict_expired)
+        records = await storage._run(storage.count_records)
+        await storage.close()
+        return hidden, evicted, records
+
+    assert asyncio.run(run()) == (None, 1, 1)
+
+
+def test_stats_counts_existing_records_on_first_call(tmp_path):
+    path = str(tmp_path / "fsm.sqlite3")
+
+    async def fill():
+        storage = SQLiteStorage(path)
+        await storage.set_state(chat=1, user=1, state="Form:name")
+        await storage.set_state(chat=2, user=2, state="Form:name")
+        await storage.close()
+
+    asyncio.run(fill())
+    storage = SQLiteStorage(path)
+    try:
+        assert storage.stats()["records"] == 2
+    finally:
+        asyncio.run(storage.close())
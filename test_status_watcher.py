@@ -0,0 +1,125 @@
+import asyncio
+import datetime
+import json
+
+import status_watcher
+from status_watcher import StatusChange, StatusWatcher
+
+T0 = datetime.datetime(2024, 5, 1, 12, 0)
+
+
+class FakeRequests:
+    """Таблица s3app_userrequest в памяти: отвечает на запросы наблюдателя"""
+
+    def __init__(self) -> None:
+        self.rows = {}
+        self.departments = {}
+
+    def add(self, request_id, status="new", processed_at=None):
+        self.rows[request_id] = {"id": request_id, "telegram_id": 1000 + request_id, "status": status,
+                                 "processed_at": processed_at}
+
+    async def fetch_all(self, query, args):
+        rows = sorted(self.rows.values(), key=lambda row: row["id"])
+        if query == status_watcher.SQL_WATCH_BOOTSTRAP:
+            closed = [row["processed_at"] for row in rows if row["processed_at"]]
+            return [{"last_id": max(self.rows, default=0), "processed_at": max(closed, default=None)}]
+        if query == status_watcher.SQL_WATCH_OPEN:
+            return [dict(row) for row in rows if row["status"] in ("new", "pending")]
+        if query == status_watcher.SQL_WATCH_NEW:
+            last_id, limit = args
+            return [dict(row) for row in rows if row["id"] > last_id][:limit]
+        if query == status_watcher.SQL_WATCH_CLOSED:
+            since, _, since_id, limit = args
+            closed = [row for row in rows if row["processed_at"] and (row["processed_at"], row["id"]) > (since, since_id)]
+            return [dict(row) for row in sorted(closed, key=lambda row: (row["processed_at"], row["id"]))][:limit]
+        if query.startswith(status_watcher.SQL_WATCH_BY_ID.split("(")[0]):
+            return [dict(self.rows[request_id]) for request_id in args if request_id in self.rows]
+        if "processed_departments" in query:
+            return [{"id": request_id, "departments": "\n".join(self.departments.get(request_id, []))}
+                    for request_id in args]
+        raise AssertionError(f"Неожиданный запрос: {query}")
+
+
+def test_first_run_starts_from_current_state(tmp_path):
+    table = FakeRequests()
+    table.add(1, "processed", T0)
+    table.add(2, "new")
+    watcher = StatusWatcher(table.fetch_all, state_path=str(tmp_path / "watch.json"))
+
+    # Старые изменения не пересылаются; незакрытая заявка 2 под наблюдением
+    assert asyncio.run(watcher.poll()) == []
+    assert (watcher.last_id, watcher.processed_at, sorted(watcher.open)) == (2, T0, [2])
+
+
+def test_watermarks_advance_and_each_change_is_reported_once(tmp_path):
+    table = FakeRequests()
+    table.add(1, "new")
+    watcher = StatusWatcher(table.fetch_all, state_path=str(tmp_path / "watch.json"), batch_size=2)
+    asyncio.run(watcher.poll())
+
+    table.add(2, "new")
+    table.rows[1]["status"] = "pending"
+    assert asyncio.run(watcher.poll()) == [StatusChange(1, "1001", "pending", [])]
+    assert watcher.last_id == 2 and sorted(watcher.open) == [1, 2]
+
+    # Две заявки закрыты в одну секунду: метка (processed_at, id) не теряет ни одну
+    table.rows[1].update(status="processed", processed_at=T0)
+    table.rows[2].update(status="rejected", processed_at=T0)
+    table.departments[1] = ["Отдел 01", "Отдел 02"]
+    assert asyncio.run(watcher.poll()) == [
+        StatusChange(1, "1001", "processed", ["Отдел 01", "Отдел 02"]),
+        StatusChange(2, "1002", "rejected", []),
+    ]
+    assert (watcher.processed_at, watcher.processed_id, watcher.open) == (T0, 2, {})
+    assert asyncio.run(watcher.poll()) == []
+
+
+def test_closed_batch_resumes_after_the_watermark(tmp_path):
+    table = FakeRequests()
+    watcher = StatusWatcher(table.fetch_all, state_path=str(tmp_path / "watch.json"), batch_size=2)
+    asyncio.run(watcher.poll())
+    for request_id in (1, 2, 3):
+        table.add(request_id, "rejected", T0)
+
+    first = asyncio.run(watcher.poll())
+    second = asyncio.run(watcher.poll())
+    assert [change.request_id for change in first + second] == [1, 2, 3]
+
+
+def test_state_survives_restart(tmp_path):
+    path = str(tmp_path / "watch.json")
+    table = FakeRequests()
+    table.add(1, "new")
+    watcher = StatusWatcher(table.fetch_all, state_path=path)
+    asyncio.run(watcher.poll())
+    table.rows[1].update(status="processed", processed_at=T0)
+    asyncio.run(watcher.poll())
+    watcher.save()
+
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f)["processed_id"] == 1
+    restarted = StatusWatcher(table.fetch_all, state_path=path)
+    assert asyncio.run(restarted.poll()) == []
+    assert (restarted.processed_at, restarted.processed_id) == (T0, 1)
+
+
+def test_full_page_without_notifications_polls_again_at_once(tmp_path):
+    table = FakeRequests()
+    watcher = StatusWatcher(table.fetch_all, state_path=str(tmp_path / "watch.json"), batch_size=2, interval=60)
+    asyncio.run(watcher.poll())
+    # Всплеск новых заявок в статусе new: уведомлять не о чем, но пачка полная
+    for request_id in range(1, 6):
+        table.add(request_id, "new")
+
+    async def run():
+        watcher.start(lambda changes: asyncio.sleep(0))
+        for _ in range(100):
+            if watcher.last_id == 5:
+                break
+            await asyncio.sleep(0.01)
+        await watcher.stop()
+
+    asyncio.run(run())
+    assert watcher.last_id == 5 and not watcher.behind
+    assert watcher.cycles == 4
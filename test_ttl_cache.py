@@ -0,0 +1,71 @@
+import ttl_cache
+from ttl_cache import MISSING, TTLCache
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_ttl_and_negative_ttl(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ttl_cache.time, "monotonic", clock)
+    cache = TTLCache(maxsize=10, ttl=10, negative_ttl=2)
+    cache.set("a", {"id": 1})
+    cache.set("none", None)
+
+    assert cache.get("a") == {"id": 1}
+    assert cache.get("none") is None
+    clock.now += 3
+    assert cache.get("none") is MISSING
+    assert cache.get("a") == {"id": 1}
+    clock.now += 10
+    assert cache.get("a") is MISSING
+    assert cache.stats()["negative_hits"] == 1
+
+
+def test_lru_eviction():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    # Вытесняется давно не использованный ключ
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_stale_read_not_cached_after_invalidate():
+    cache = TTLCache(maxsize=10, ttl=60)
+    generation = cache.generation()
+    # Пока шло чтение из БД, заявку создали и ключ сбросили
+    cache.invalidate("user")
+    cache.set("user", None, generation)
+    assert cache.get("user") is MISSING
+    assert cache.stale_sets == 1
+
+    generation = cache.generation()
+    cache.set("user", {"id": 2}, generation)
+    assert cache.get("user") == {"id": 2}
+
+
+def test_invalidate_other_key_does_not_block_set():
+    cache = TTLCache(maxsize=10, ttl=60)
+    generation = cache.generation()
+    cache.invalidate("other")
+    cache.set("user", 1, generation)
+    assert cache.get("user") == 1
+
+
+def test_forgotten_marks_are_conservative():
+    cache = TTLCache(maxsize=2, ttl=60)
+    generation = cache.generation()
+    for key in ("a", "b", "c"):
+        cache.invalidate(key)
+    # Метки забыты — чтение, начатое до сбросов, в кэш не попадает
+    cache.set("a", 1, generation)
+    assert cache.get("a") is MISSING
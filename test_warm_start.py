@@ -0,0 +1,77 @@
+import asyncio
+
+from aiogram import types
+
+from warm_start import StartupTimer, drain_backlog
+
+
+def make_update(update_id: int, chat_id: int, text: str) -> types.Update:
+    return types.Update(**{
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "text": text,
+                    "chat": {"id": chat_id, "type": "private"}, "from": {"id": chat_id, "is_bot": False, "first_name": "x"}},
+    })
+
+
+class FakeBot:
+    def __init__(self, updates):
+        self.queue = list(updates)
+        self.offsets = []
+
+    async def get_updates(self, offset=None, limit=100, timeout=0):
+        self.offsets.append(offset)
+        if offset is not None:
+            self.queue = [update for update in self.queue if update.update_id >= offset]
+        return self.queue[:limit]
+
+
+class FakeDispatcher:
+    def __init__(self, bot):
+        self.bot = bot
+        self.handled = []
+        self.active = {}
+
+    async def process_update(self, update):
+        chat_id = update.message.chat.id
+        assert not self.active.get(chat_id), "апдейты одного чата пересеклись"
+        self.active[chat_id] = True
+        await asyncio.sleep(0.01)
+        self.handled.append((chat_id, update.message.text))
+        self.active[chat_id] = False
+
+
+def test_drain_backlog_keeps_chat_order_and_confirms_offset():
+    updates = [make_update(i + 1, chat_id=i % 2, text=str(i)) for i in range(7)]
+    bot = FakeBot(updates)
+    dp = FakeDispatcher(bot)
+
+    stats = asyncio.run(drain_backlog(dp, rate=0, batch_size=3))
+
+    assert stats["updates"] == 7 and stats["failed"] == 0
+    for chat_id in (0, 1):
+        texts = [text for chat, text in dp.handled if chat == chat_id]
+        assert texts == sorted(texts, key=int)
+    # Последний вызов подтверждает всё разобранное
+    assert bot.offsets[-1] == 8 and bot.queue == []
+
+
+def test_drain_backlog_rate():
+    bot = FakeBot([make_update(i + 1, chat_id=i, text=str(i)) for i in range(5)])
+    stats = asyncio.run(drain_backlog(FakeDispatcher(bot), rate=50))
+    # Пять апдейтов с интервалом 20 мс — не меньше 80 мс
+    assert stats["updates"] == 5 and stats["elapsed"] >= 0.08
+
+
+def test_startup_timer_records_failed_phase():
+    async def run():
+        timer = StartupTimer()
+        async with timer.phase("ok"):
+            pass
+        async with timer.phase("broken"):
+            raise RuntimeError("нет БД")
+        return timer
+
+    timer = asyncio.run(run())
+    assert [name for name, _, _ in timer.phases] == ["ok", "broken"]
+    assert timer.phases[1][2] == "нет БД"
+    assert "broken" in timer.report() and set(timer.seconds()) == {("ok",), ("broken",)}
@@ -0,0 +1,56 @@
+import asyncio
+
+from webhook_server import ChatLanes, update_chat_id
+
+
+def test_update_chat_id():
+    assert update_chat_id({"update_id": 1, "message": {"chat": {"id": -100}, "from": {"id": 7}}}) == -100
+    assert update_chat_id({"update_id": 2, "callback_query": {"from": {"id": 7}, "message": {"chat": {"id": 5}}}}) == 5
+    # Нажатие под инлайн-сообщением: сообщения нет, ключ — пользователь
+    assert update_chat_id({"update_id": 3, "callback_query": {"from": {"id": 7}, "inline_message_id": "x"}}) == 7
+    assert update_chat_id({"update_id": 4, "my_chat_member": {"chat": {"id": 9}, "from": {"id": 7}}}) == 9
+    assert update_chat_id({"update_id": 5, "inline_query": {"from": {"id": 7}}}) == 7
+    assert update_chat_id({"update_id": 6}) == 0
+
+
+def test_lanes_keep_order_within_key_and_run_keys_in_parallel():
+    async def run():
+        lanes = ChatLanes()
+        events = []
+
+        def step(key, index, delay):
+            async def call():
+                events.append((key, index, "start"))
+                await asyncio.sleep(delay)
+                events.append((key, index, "end"))
+            return call
+
+        # Первый апдейт чата 1 самый медленный — следующие всё равно ждут его
+        tasks = [lanes.submit(1, step(1, 0, 0.03)), lanes.submit(1, step(1, 1, 0)), lanes.submit(2, step(2, 0, 0))]
+        active = len(lanes)
+        await asyncio.gather(*tasks)
+        return events, active, len(lanes)
+
+    events, active, left = asyncio.run(run())
+    assert events.index((1, 0, "end")) < events.index((1, 1, "start"))
+    assert events.index((2, 0, "end")) < events.index((1, 0, "end"))
+    assert (active, left) == (2, 0)
+
+
+def test_failed_call_does_not_block_the_lane():
+    async def run():
+        lanes = ChatLanes()
+
+        async def fail():
+            raise RuntimeError("handler failed")
+
+        async def ok():
+            return "ok"
+
+        first, second = lanes.submit(1, fail), lanes.submit(1, ok)
+        results = await asyncio.gather(first, second, return_exceptions=True)
+        await lanes.drain(timeout=1)
+        return results
+
+    failed, result = asyncio.run(run())
+    assert isinstance(failed, RuntimeError) and result == "ok"
@@ -0,0 +1,107 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Generic, Hashable, Optional, Tuple, TypeVar, Union
+
+V = TypeVar("V")
+
+MISSING = object()
+
+
+class TTLCache(Generic[V]):
+    """Ограниченный LRU-кэш с временем жизни записей.
+
+    Значение None тоже кэшируется («записей нет»), но живёт negative_ttl секунд.
+    Рассчитан на использование из одного цикла событий, блокировок не содержит.
+
+    Чтение из источника, во время которого ключ сбросили, не должно вернуть
+    в кэш старое значение: метку generation() берут до чтения и передают в set().
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 30.0, negative_ttl: Optional[float] = None) -> None:
+        if maxsize < 1:
+            raise ValueError("maxsize должен быть положительным")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Optional[V]]]" = OrderedDict()
+        # Счётчик сбросов и метка последнего сброса по ключу; ключи без метки сброшены не позже _floor
+        self._clock = 0
+        self._invalidated: Dict[Hashable, int] = {}
+        self._floor = 0
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_sets = 0
+
+    def get(self, key: Hashable, default: object = MISSING) -> Union[Optional[V], object]:
+        """Вернуть значение или default (по умолчанию MISSING), если записи нет или она устарела"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        if value is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return value
+
+    def generation(self) -> int:
+        """Метка перед чтением из источника: set() с ней пропустит значение, если ключ с тех пор сбросили"""
+        return self._clock
+
+    def set(self, key: Hashable, value: Optional[V], generation: Optional[int] = None) -> None:
+        if generation is not None and self._invalidated.get(key, self._floor) > generation:
+            self.stale_sets += 1
+            return
+        ttl = self.negative_ttl if value is None else self.ttl
+        if ttl <= 0:
+            self._entries.pop(key, None)
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        # Метку ставим и без записи в кэше: как раз сейчас её может читать кто-то из источника
+        self._clock += 1
+        self._invalidated[key] = self._clock
+        if len(self._invalidated) > self.maxsize:
+            # Забываем метки; до следующего сброса любое ранее начатое чтение считается устаревшим
+            self._invalidated.clear()
+            self._floor = self._clock
+        if self._entries.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._clock += 1
+        self._invalidated.clear()
+        self._floor = self._clock
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, object]:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "stale_sets": self.stale_sets,
+        }
@@ -0,0 +1,81 @@
+"""Тёплый запуск и разбор накопившихся апдейтов.
+
+StartupTimer замеряет фазы запуска (соединения с БД, справочник отделов,
+клавиатуры, сессия Bot API): сбой фазы попадает в журнал, но запуск не
+останавливает — бот поднимется и догрузит нужное при первом обращении.
+
+drain_backlog разбирает апдейты, пришедшие, пока бот не работал, с
+ограниченной скоростью, вместо того чтобы выбрасывать их (skip_updates).
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from aiogram import Dispatcher
+
+from webhook_server import ChatLanes, update_chat_id
+
+
+class StartupTimer:
+    def __init__(self) -> None:
+        # (фаза, секунды, ошибка или None) в порядке выполнения
+        self.phases: List[Tuple[str, float, Optional[str]]] = []
+
+    @asynccontextmanager
+    async def phase(self, name: str) -> AsyncIterator[None]:
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = str(e)
+            logging.warning("Запуск: фаза %s не выполнена: %s", name, e)
+        finally:
+            self.phases.append((name, time.perf_counter() - started, error))
+
+    def seconds(self) -> Dict[Tuple[str, ...], float]:
+        return {(name,): round(elapsed, 4) for name, elapsed, _ in self.phases}
+
+    def report(self) -> str:
+        parts = [f"{name} {elapsed * 1000:.0f} мс" + (" (ошибка)" if error else "") for name, elapsed, error in self.phases]
+        total = sum(elapsed for _, elapsed, _ in self.phases)
+        return f"{total * 1000:.0f} мс: " + ", ".join(parts)
+
+
+async def drain_backlog(dp: Dispatcher, *, rate: float, batch_size: int = 100) -> Dict[str, object]:
+    """Обработать апдейты из очереди Telegram не быстрее rate в секунду, затем подтвердить их.
+
+    Апдейты запускаются с равным интервалом; разные чаты обрабатываются параллельно,
+    апдейты одного чата — по порядку, как при вебхуке (иначе имя и фамилия из очереди
+    прочитали бы одно и то же состояние анкеты). Перед возвратом дожидаемся всех,
+    чтобы они не перемешались с апдейтами из polling.
+    Вебхук должен быть снят: getUpdates при установленном вебхуке не работает.
+    """
+    bot = dp.bot
+    interval = 1.0 / rate if rate > 0 else 0.0
+    started = time.monotonic()
+    next_at = started
+    offset: Optional[int] = None
+    lanes = ChatLanes()
+    tasks: List[asyncio.Task] = []
+    while True:
+        updates = await bot.get_updates(offset=offset, limit=batch_size, timeout=0)
+        for update in updates:
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_at = max(next_at, time.monotonic()) + interval
+            tasks.append(lanes.submit(update_chat_id(update.to_python()), partial(dp.process_update, update)))
+            offset = update.update_id + 1
+        # Неполная пачка — догнали конец очереди; то, что придёт дальше, получит polling
+        if len(updates) < batch_size:
+            break
+    if offset is not None:
+        # getUpdates подтверждает всё до offset — иначе polling получит последнюю пачку ещё раз
+        await bot.get_updates(offset=offset, limit=1, timeout=0)
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    failed = sum(1 for result in results if isinstance(result, Exception))
+    return {"updates": len(tasks), "failed": failed, "elapsed": round(time.monotonic() - started, 2)}
@@ -0,0 +1,108 @@
+import asyncio
+import hmac
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+
+from aiohttp import web
+from aiogram import types
+from aiogram.dispatcher.webhook import WebhookRequestHandler
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+WEBHOOK_SECRET_KEY = "WEBHOOK_SECRET"
+
+# Части апдейта, в которых лежит сообщение с чатом
+_MESSAGE_KEYS = ("message", "edited_message", "channel_post", "edited_channel_post")
+
+
+def update_chat_id(update: Dict[str, object]) -> int:
+    """Id чата (или пользователя, если чата нет) из сырого апдейта"""
+    for key in _MESSAGE_KEYS:
+        message = update.get(key)
+        if message:
+            return int(message["chat"]["id"])
+    query = update.get("callback_query")
+    if query:
+        if query.get("message"):
+            return int(query["message"]["chat"]["id"])
+        return int(query["from"]["id"])
+    for value in update.values():
+        if isinstance(value, dict):
+            if isinstance(value.get("chat"), dict):
+                return int(value["chat"]["id"])
+            if isinstance(value.get("from"), dict):
+                return int(value["from"]["id"])
+    return 0
+
+
+class ChatLanes:
+    """Очереди по ключу: корутины одного ключа выполняются строго по порядку,
+    разных ключей — параллельно. Хранит ссылки на задачи до их завершения."""
+
+    def __init__(self) -> None:
+        self._tails: Dict[int, asyncio.Task] = {}
+
+    def submit(self, key: int, call: Callable[[], Awaitable[object]]) -> asyncio.Task:
+        previous = self._tails.get(key)
+
+        async def run() -> object:
+            if previous is not None:
+                await asyncio.gather(previous, return_exceptions=True)
+            return await call()
+
+        task = asyncio.ensure_future(run())
+        self._tails[key] = task
+
+        def release(done: asyncio.Task) -> None:
+            if self._tails.get(key) is done:
+                del self._tails[key]
+
+        task.add_done_callback(release)
+        return task
+
+    def __len__(self) -> int:
+        return len(self._tails)
+
+    async def drain(self, timeout: Optional[float] = None) -> None:
+        if self._tails:
+            await asyncio.wait(list(self._tails.values()), timeout=timeout)
+
+
+# Апдейты одного чата обрабатываются по порядку, разных чатов — параллельно
+_lanes = ChatLanes()
+
+
+class FastAckWebhookHandler(WebhookRequestHandler):
+    """Приём обновлений от Telegram по вебхуку.
+
+    Проверяет секретный токен из заголовка и сразу отвечает 200, а сам апдейт
+    обрабатывается в фоновой задаче — медленный обработчик не задерживает
+    ответ Telegram и апдейты других чатов. Апдейты одного чата выполняются
+    в порядке поступления.
+    """
+
+    async def post(self):
+        self.validate_ip()
+
+        secret = self.request.app.get(WEBHOOK_SECRET_KEY)
+        received = self.request.headers.get(SECRET_TOKEN_HEADER, "")
+        if secret and not hmac.compare_digest(received.encode(), secret.encode()):
+            logging.warning("Отклонён запрос на вебхук с неверным секретным токеном от %s", self.request.remote)
+            return web.Response(status=401, text="unauthorized")
+
+        dispatcher = self.get_dispatcher()
+        data = await self.request.json()
+        update = types.Update(**data)
+        _lanes.submit(update_chat_id(data), lambda: dispatcher.process_update(update))
+        return web.Response(text="ok")
+
+
+def create_webhook_app(secret: str) -> web.Application:
+    app = web.Application()
+    app[WEBHOOK_SECRET_KEY] = secret
+
+    async def _drain(app: web.Application) -> None:
+        # Дожидаемся апдейтов, принятых до остановки сервера
+        await _lanes.drain(timeout=10)
+
+    app.on_shutdown.append(_drain)
+    return app